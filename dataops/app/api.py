@@ -1,17 +1,27 @@
-import duckdb
+import logging
+import os
+from typing import List, Sequence
+
+import orjson
 
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 
-from prometheus_client import Counter
+from prometheus_client import Counter, multiprocess
 from prometheus_fastapi_instrumentator import Instrumentator
 
-from pydantic import ValidationError
-
-from app import constants, contracts
+from app import batch, constants, contracts, validators
+from app.writer import Forwarder, Store, contract_columns
 
 app = FastAPI()
 
+# Common http metric tracking for all routes
+Instrumentator().instrument(app).expose(app)
+
+# The type and domain checks for /collect/batch, from the contract
+RULES = batch.column_rules(contracts.AgrawalRequest)
+
 VALIDATION_COUNTER = Counter(
     constants.VALIDATION_COUNTER,
     "Data quality validation error counter",
@@ -21,28 +31,44 @@ VALIDATION_COUNTER = Counter(
 
 @app.on_event("startup")
 def startup():
-    """Create the database connection table where we will store the data the API collects."""
-    columns = []
-    for field in contracts.AgrawalRequest.__fields__.values():
-        if field.type_ == float:
-            columns.append(f"{field.name} DOUBLE")
-        else:
-            columns.append(f"{field.name} INT")
-    app.db = duckdb.connect(constants.DUCKDB_FILE)
-    app.db.execute(f"DROP TABLE IF EXISTS {constants.DATA_TABLE}")
-    app.db.execute(f"CREATE TABLE {constants.DATA_TABLE} (" + ", ".join(columns) + ")")
-
+    """Open the table where we will store the data the API collects.
 
-@app.on_event("startup")
-def monitor():
-    """Common http metric tracking for all routes."""
-    Instrumentator().instrument(app).expose(app)
+    When the API runs in several worker processes, they can't all open the DuckDB
+    file, so each worker forwards its rows to the writer process that has it open.
+    """
+    if constants.WORKERS > 1:
+        app.store = Forwarder(constants.WRITER_SOCKET)
+    else:
+        app.store = Store(contract_columns())
 
 
 @app.on_event("shutdown")
 def shutdown():
-    """Close the database connection."""
-    app.db.close()
+    """Flush any buffered rows, snapshot the profile and close the database connection."""
+    app.store.close()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+async def _extend(rows: List[Sequence]) -> bool:
+    """Hands the rows to the store, returning whether it took them.
+
+    Forwarding them to the writer process blocks until it replies, so that happens
+    off the event loop.
+    """
+    if not isinstance(app.store, Forwarder):
+        app.store.extend(rows)
+        return True
+    try:
+        await run_in_threadpool(app.store.extend, rows)
+    except OSError:
+        logging.exception(f"Couldn't forward {len(rows)} rows to the writer")
+        return False
+    return True
+
+
+def _unavailable() -> JSONResponse:
+    return JSONResponse(status_code=503, content={"error": "The writer is unavailable"})
 
 
 @app.get("/")
@@ -51,26 +77,73 @@ def is_healthy():
     return {"status": "ok"}
 
 
+@app.get("/profile")
+def profile():
+    """Summary statistics for each column of the data collected so far."""
+    return app.store.summary()
+
+
 @app.post("/collect")
 async def collect(request: Request):
     """Validate the data from the user before it is collected."""
-    data = await request.json()
+    try:
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
     if data is None:
         return JSONResponse(status_code=400, content={"error": "No data provided"})
-
-    # Parse the raw data into a Pydantic model, handle any validation errors
-    try:
-        parsed = contracts.AgrawalRequest(**data)
-    except ValidationError as e:
-        # update the validation error counters
-        for error in e.errors():
+    if not isinstance(data, dict):
+        return JSONResponse(status_code=400, content={"error": "Expected an object"})
+
+    # Check the data against the contract, with the checks that profile.py compiled
+    # from it, and update the validation error counters for any errors
+    row, errors = validators.validate(data)
+    if errors:
+        for error in errors:
             VALIDATION_COUNTER.labels(loc=error["loc"][0], type=error["type"]).inc()
-        # re-raise the validation error for FastAPI to handle it
-        raise e
-
-    # Otherwise, record the data in DuckDB
-    app.db.execute(
-        "INSERT INTO agrawal VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        parameters=list(parsed.dict().values()),
-    )
+        return JSONResponse(status_code=422, content={"detail": errors})
+
+    # Otherwise, buffer the data to be appended to DuckDB in bulk
+    if not await _extend([row]):
+        return _unavailable()
     return {"status": "ok"}
+
+
+@app.post("/collect/batch")
+async def collect_batch(request: Request):
+    """Validate and collect many rows at once.
+
+    The rows can be sent as a list of objects or as an object of equal-length
+    columns. Each check runs over a whole column at a time, the valid rows are
+    collected and the invalid ones are dropped, and the validation error counters
+    are updated once per field and error type.
+    """
+    try:
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+    if not data:
+        return JSONResponse(status_code=400, content={"error": "No data provided"})
+    if not isinstance(data, (list, dict)):
+        return JSONResponse(
+            status_code=400, content={"error": "Expected a list of rows or columns"}
+        )
+    try:
+        columns, rows = batch.to_columns(data, RULES)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    valid, parsed, errors = batch.validate(columns, rows, RULES)
+    for (loc, error_type), count in errors.items():
+        VALIDATION_COUNTER.labels(loc=loc, type=error_type).inc(count)
+    if not await _extend(parsed):
+        return _unavailable()
+    return {
+        "status": "ok",
+        "accepted": len(parsed),
+        "rejected": [int(i) for i in (~valid).nonzero()[0]],
+        "errors": [
+            {"loc": loc, "type": error_type, "count": count}
+            for (loc, error_type), count in errors.items()
+        ],
+    }
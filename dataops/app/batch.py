@@ -0,0 +1,148 @@
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Type, Union
+
+import numpy as np
+
+from pydantic import BaseModel
+
+from app import constants
+
+# Stands in for a field that a row left out entirely
+MISSING = object()
+
+# Pydantic's error types for values that can't be converted to a field's type
+TYPE_ERRORS = {int: "type_error.integer", float: "type_error.float"}
+
+
+class ColumnRule(NamedTuple):
+    """The type and domain constraints on one field of a contract."""
+
+    name: str
+    type_: type
+    required: bool
+    ge: Optional[float] = None
+    gt: Optional[float] = None
+    le: Optional[float] = None
+    lt: Optional[float] = None
+
+
+def column_rules(model: Type[BaseModel]) -> List[ColumnRule]:
+    """Reads the rules for each field out of a Pydantic model.
+
+    The bounds may be set on the field (`Field(..., ge=...)`, which is what
+    `profile.py` generates) or on a constrained type like `confloat(ge=...)`. Integer
+    fields are also bounded by the range of the INT column they are stored in.
+    """
+    rules = []
+    for field in model.__fields__.values():
+        bounds = {}
+        for bound in ("ge", "gt", "le", "lt"):
+            value = getattr(field.field_info, bound, None)
+            if value is None:
+                value = getattr(field.type_, bound, None)
+            bounds[bound] = value
+        type_ = float if issubclass(field.type_, float) else int
+        if type_ is int:
+            low, high = constants.INT_RANGE
+            if bounds["ge"] is None or bounds["ge"] < low:
+                bounds["ge"] = low
+            if bounds["le"] is None or bounds["le"] > high:
+                bounds["le"] = high
+        rules.append(ColumnRule(field.name, type_, field.required, **bounds))
+    return rules
+
+
+def to_columns(
+    payload: Union[List[Dict[str, Any]], Dict[str, List[Any]]], rules: List[ColumnRule]
+) -> Tuple[Dict[str, List[Any]], int]:
+    """Turns a list of rows or a dict of columns into columns and a row count."""
+    if isinstance(payload, dict):
+        rows = max((len(v) for v in payload.values() if isinstance(v, list)), default=0)
+        columns = {}
+        for rule in rules:
+            values = payload.get(rule.name)
+            if not isinstance(values, list) or len(values) != rows:
+                raise ValueError(f"{rule.name} must be a list of {rows} values")
+            columns[rule.name] = values
+        return columns, rows
+    if not all(isinstance(row, dict) for row in payload):
+        raise ValueError("rows must be objects")
+    columns = {r.name: [row.get(r.name, MISSING) for row in payload] for r in rules}
+    return columns, len(payload)
+
+
+def _convert(
+    values: List[Any], rule: ColumnRule
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Converts a column to an array, with masks of its nulls and the type errors.
+
+    The whole column is converted in one go; only a column that fails to convert
+    (because of nulls or bad values) is gone through value by value.
+    """
+    dtype = np.float64 if rule.type_ is float else np.int64
+    errors = np.full(len(values), "", dtype=object)
+    nulls = np.zeros(len(values), dtype=bool)
+    try:
+        array = np.asarray(values, dtype=dtype)
+        # e.g. a column of lists, or of floats where None was turned into NaN
+        if array.ndim == 1 and not (rule.type_ is float and np.isnan(array).any()):
+            return array, nulls, errors
+    except (TypeError, ValueError, OverflowError):
+        pass
+    array = np.zeros(len(values), dtype=dtype)
+    for i, value in enumerate(values):
+        if value is MISSING or value is None:
+            nulls[i] = True
+            if rule.required:
+                missing = value is MISSING
+                errors[i] = (
+                    "value_error.missing" if missing else "type_error.none.not_allowed"
+                )
+            continue
+        try:
+            array[i] = rule.type_(value)
+        except (TypeError, ValueError, OverflowError):
+            errors[i] = TYPE_ERRORS[rule.type_]
+    return array, nulls, errors
+
+
+def validate(
+    columns: Dict[str, List[Any]], rows: int, rules: List[ColumnRule]
+) -> Tuple[np.ndarray, List[Tuple], Counter]:
+    """Checks every column of a batch against its rules.
+
+    Returns a mask of the rows that passed every check, those rows as tuples
+    (with the fields in the order of the rules), and the number of errors for each
+    (field, error type), using the same error types as Pydantic. Like Pydantic,
+    only the first failed check of each value is counted.
+    """
+    valid = np.ones(rows, dtype=bool)
+    arrays, counts = [], Counter()
+    for rule in rules:
+        array, nulls, errors = _convert(columns[rule.name], rule)
+        failed = errors.astype(bool)
+        # The comparisons that a value must pass; like Pydantic's, NaN fails them
+        checks = [
+            (rule.ge, np.greater_equal, "value_error.number.not_ge"),
+            (rule.gt, np.greater, "value_error.number.not_gt"),
+            (rule.le, np.less_equal, "value_error.number.not_le"),
+            (rule.lt, np.less, "value_error.number.not_lt"),
+        ]
+        for bound, op, error in checks:
+            if bound is None:
+                continue
+            out = ~op(array, bound) & ~failed & ~nulls
+            errors[out] = error
+            failed |= out
+        for error, count in zip(*np.unique(errors[failed], return_counts=True)):
+            counts[(rule.name, error)] += int(count)
+        valid &= ~failed
+        arrays.append((array, nulls))
+
+    values = []
+    for array, nulls in arrays:
+        column = array[valid].tolist()
+        for i in np.flatnonzero(nulls[valid]):
+            column[i] = None
+        values.append(column)
+    return valid, list(zip(*values)), counts
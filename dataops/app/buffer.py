@@ -0,0 +1,172 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import duckdb
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from app import constants
+
+BUFFER_ROWS = Gauge(
+    constants.BUFFER_ROWS,
+    "Rows waiting to be flushed to DuckDB",
+    multiprocess_mode="livesum",
+)
+FLUSH_SECONDS = Histogram(
+    constants.FLUSH_SECONDS,
+    "Time taken to append a batch of buffered rows to DuckDB",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+FLUSHED_ROWS = Counter(constants.FLUSHED_ROWS, "Rows flushed to DuckDB")
+DROPPED_ROWS = Counter(constants.DROPPED_ROWS, "Rows that DuckDB would not store")
+
+
+class RowBuffer:
+    """Buffers validated rows in memory and appends them to a DuckDB table in bulk.
+
+    A background thread flushes the buffer once it holds `max_rows` rows or its
+    oldest row is `max_age_s` seconds old. Each flush writes the rows to a CSV file
+    and loads it with a single `INSERT ... SELECT` from `read_csv`, which is far
+    faster than binding the values of one row at a time. A batch that fails to load
+    is split in half and each half loaded again, so that only the rows DuckDB won't
+    store are dropped. Buffered rows are lost if the process dies before they are
+    flushed. Once a batch is flushed, the rows that were stored are passed on to
+    `on_flush`, if given.
+    """
+
+    def __init__(
+        self,
+        db: duckdb.DuckDBPyConnection,
+        table: str,
+        columns: Dict[str, str],
+        max_rows: int = constants.FLUSH_ROWS,
+        max_age_s: float = constants.FLUSH_INTERVAL_S,
+        on_flush: Optional[Callable[[List[Sequence]], None]] = None,
+    ):
+        self.db = db
+        self.table = table
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_age_s = max_age_s
+        self.on_flush = on_flush
+        self.rows: List[Sequence] = []
+        self.started: Optional[float] = None
+        self.lock = threading.Lock()
+        self.full = threading.Condition(self.lock)
+        self.closed = False
+        self.tmpdir = tempfile.mkdtemp(prefix=f"{table}-buffer-")
+        self.flusher = threading.Thread(
+            target=self._run, name=f"{table}-flusher", daemon=True
+        )
+        self.flusher.start()
+
+    def append(self, row: Sequence):
+        self.extend([row])
+
+    def extend(self, rows: List[Sequence]):
+        with self.lock:
+            first = not self.rows
+            if first:
+                self.started = time.monotonic()
+            self.rows.extend(rows)
+            BUFFER_ROWS.set(len(self.rows))
+            # wake the flusher to start the clock on the new batch, or if it's full
+            if first or len(self.rows) >= self.max_rows:
+                self.full.notify()
+
+    def _take(self) -> List[Sequence]:
+        rows, self.rows, self.started = self.rows, [], None
+        BUFFER_ROWS.set(0)
+        return rows
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.closed and len(self.rows) < self.max_rows:
+                    if self.started is None:
+                        self.full.wait()
+                        continue
+                    left = self.started + self.max_age_s - time.monotonic()
+                    if left <= 0:
+                        break
+                    self.full.wait(left)
+                if self.closed:
+                    return
+                rows = self._take()
+            try:
+                self._flush(rows)
+            except Exception:
+                # e.g. the CSV file can't be written; keep flushing the next batches
+                logging.exception(f"Dropped {len(rows)} rows that failed to flush")
+
+    def _flush(self, rows: List[Sequence]):
+        if not rows:
+            return
+        start = time.perf_counter()
+        rows = self._store(rows)
+        FLUSHED_ROWS.inc(len(rows))
+        FLUSH_SECONDS.observe(time.perf_counter() - start)
+        if self.on_flush and rows:
+            try:
+                self.on_flush(rows)
+            except Exception:
+                # the rows are stored; don't let this take the flusher down
+                logging.exception("on_flush failed")
+
+    def _store(self, rows: List[Sequence]) -> List[Sequence]:
+        """Loads the rows, halving the batch until the ones that fail are found.
+
+        Returns the rows that were stored.
+        """
+        try:
+            self._load(rows)
+            return rows
+        except duckdb.Error as e:
+            if len(rows) == 1:
+                DROPPED_ROWS.inc()
+                logging.warning(f"Dropped a row that failed to flush: {rows[0]}: {e}")
+                return []
+        middle = len(rows) // 2
+        return self._store(rows[:middle]) + self._store(rows[middle:])
+
+    def _load(self, rows: List[Sequence]):
+        path = os.path.join(self.tmpdir, "rows.csv")
+        with open(path, "w") as f:
+            for row in rows:
+                f.write(",".join("" if v is None else repr(v) for v in row))
+                f.write("\n")
+        types = ", ".join(f"'{name}': '{t}'" for name, t in self.columns.items())
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(
+                f"""
+                INSERT INTO {self.table} ({", ".join(self.columns)})
+                SELECT * FROM read_csv('{path}', header=false, columns={{{types}}})
+                """
+            )
+        finally:
+            cursor.close()
+
+    def close(self):
+        """Stops the background flusher and flushes whatever is left.
+
+        A failure to flush is logged rather than raised, so that the caller can go on
+        to close everything else.
+        """
+        with self.lock:
+            self.closed = True
+            self.full.notify()
+        self.flusher.join()
+        with self.lock:
+            rows = self._take()
+        try:
+            self._flush(rows)
+        except Exception:
+            logging.exception(f"Dropped {len(rows)} rows that failed to flush")
+        finally:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
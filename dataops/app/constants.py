@@ -1,5 +1,36 @@
+import os
+
 DUCKDB_FILE = "/tmp/agrawal.duckdb"
 DATA_TABLE = "agrawal"
 
 VALIDATION_COUNTER = "agrawal_validation_checks"
 VALIDATION_COUNTER_FIELDS = ["loc", "type"]
+
+# Rows are buffered in memory and appended to DuckDB in bulk once there are this many
+# of them, or the oldest of them is this many seconds old
+FLUSH_ROWS = int(os.getenv("FLUSH_ROWS", "5000"))
+FLUSH_INTERVAL_S = float(os.getenv("FLUSH_INTERVAL_S", "1.0"))
+
+BUFFER_ROWS = "agrawal_buffer_rows"
+FLUSH_SECONDS = "agrawal_flush_seconds"
+FLUSHED_ROWS = "agrawal_flushed_rows"
+DROPPED_ROWS = "agrawal_dropped_rows"
+
+# The range of DuckDB's INT, which the contract's integer fields are stored as
+INT_RANGE = (-(2**31), 2**31 - 1)
+
+# Where the running profile of the collected data is snapshotted, and how often
+PROFILE_FILE = os.getenv("PROFILE_FILE", "/tmp/agrawal_profile.json")
+PROFILE_SNAPSHOT_INTERVAL_S = float(os.getenv("PROFILE_SNAPSHOT_INTERVAL_S", "60"))
+
+# Rows are moved out of the DuckDB table to hourly Parquet partitions here once their
+# hour is over, and the partitions are kept for this many days (0 keeps them forever)
+PARQUET_DIR = os.getenv("PARQUET_DIR", "/tmp/agrawal")
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+MAINTENANCE_INTERVAL_S = float(os.getenv("MAINTENANCE_INTERVAL_S", "60"))
+
+# With more than one worker, the API's worker processes forward the rows they collect
+# over this socket to a single writer process (app/writer.py), which holds the DuckDB
+# file
+WORKERS = int(os.getenv("WORKERS", "1"))
+WRITER_SOCKET = os.getenv("WRITER_SOCKET", "/tmp/agrawal-writer.sock")
@@ -0,0 +1,213 @@
+import datetime
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+
+from app import constants
+
+# Every row is stamped with the time it was stored, in microseconds since the epoch
+INGEST_COLUMN = "ingest_micros"
+
+HOUR_MICROS = 3600 * 1000000
+
+
+def create_table(db: duckdb.DuckDBPyConnection, table: str, columns: Dict[str, str]):
+    """Creates the table if it isn't there yet, adding the ingest time column if needed.
+
+    The data the table already holds is kept, so nothing is lost on a restart.
+    """
+    defs = [f"{name} {t}" for name, t in columns.items()]
+    ingest = f"{INGEST_COLUMN} BIGINT DEFAULT epoch_us(now())"
+    db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(defs + [ingest])})")
+    existing = [row[0] for row in db.execute(f"DESCRIBE {table}").fetchall()]
+    if INGEST_COLUMN not in existing:
+        # tables from before rows were stamped count as stored now
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {ingest}")
+
+
+def connect() -> Tuple[duckdb.DuckDBPyConnection, bool]:
+    """Opens the database for reading, and says whether the live table can be read.
+
+    While the API is running, it holds the only connection to the database, but the
+    exported partitions can still be read from an in-memory database.
+    """
+    try:
+        return duckdb.connect(constants.DUCKDB_FILE, read_only=True), True
+    except duckdb.IOException:
+        return duckdb.connect(), False
+
+
+def to_micros(value: datetime.datetime) -> int:
+    """Naive datetimes are taken to be in UTC, like the partitions."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp() * 1000000)
+
+
+def _in_range(column: str, start: Optional[int], end: Optional[int]) -> List[str]:
+    filters = []
+    if start is not None:
+        filters.append(f"{column} >= {start}")
+    if end is not None:
+        filters.append(f"{column} < {end}")
+    return filters
+
+
+def scan(
+    table: str,
+    parquet_dir: str,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    live: bool = True,
+) -> str:
+    """Returns a SELECT over the rows of the table stored in the time range.
+
+    The rows come from the partitions exported to `parquet_dir` and, if `live`, from
+    the table itself. Only the Parquet partitions that overlap the range are read.
+    """
+    start_micros = to_micros(start) if start else None
+    end_micros = to_micros(end) if end else None
+    rows = _in_range(INGEST_COLUMN, start_micros, end_micros)
+    selects = []
+    if glob.glob(os.path.join(parquet_dir, "*", "*", "*.parquet")):
+        # the start of each partition's hour; this only involves the partition
+        # columns, which lets DuckDB skip the files of the partitions out of range
+        hour = f"epoch_us(date::TIMESTAMP) + hour * {HOUR_MICROS}"
+        partitions = _in_range(
+            hour,
+            start_micros - start_micros % HOUR_MICROS if start else None,
+            end_micros,
+        )
+        selects.append(
+            f"""
+            SELECT * EXCLUDE (date, hour) FROM read_parquet(
+                '{parquet_dir}/*/*/*.parquet', hive_partitioning=true, union_by_name=true
+            ) WHERE {" AND ".join(partitions + rows) or "true"}
+        """
+        )
+    if live or not selects:
+        selects.append(f"SELECT * FROM {table} WHERE {' AND '.join(rows) or 'true'}")
+    return " UNION ALL BY NAME ".join(selects)
+
+
+class PartitionedTable:
+    """Moves a table's rows out to hourly Parquet partitions as their hour closes.
+
+    A background thread periodically exports the rows stored before the current
+    hour to `parquet_dir/date=YYYY-MM-DD/hour=H/` and deletes them from the table,
+    which keeps the live table small, and removes the days of partitions that are
+    older than `retention_days`.
+    """
+
+    def __init__(
+        self,
+        db: duckdb.DuckDBPyConnection,
+        table: str,
+        parquet_dir: str = constants.PARQUET_DIR,
+        retention_days: Optional[int] = constants.RETENTION_DAYS,
+        interval_s: float = constants.MAINTENANCE_INTERVAL_S,
+    ):
+        self.db = db
+        self.table = table
+        self.parquet_dir = parquet_dir
+        self.retention_days = retention_days
+        self.interval_s = interval_s
+        self.closed = threading.Event()
+        self.maintainer = threading.Thread(
+            target=self._run, name=f"{table}-partitions", daemon=True
+        )
+        self.maintainer.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.rollover()
+                self.expire()
+            except (duckdb.Error, OSError):
+                logging.exception(f"Maintenance of {self.table} failed")
+            if self.closed.wait(self.interval_s):
+                return
+
+    def rollover(self, now: Optional[int] = None) -> List[str]:
+        """Exports the rows stored before the current hour, returning the new files."""
+        now = now if now is not None else int(time.time() * 1000000)
+        current = now - now % HOUR_MICROS
+        cursor = self.db.cursor()
+        try:
+            closed = cursor.execute(
+                f"""
+                SELECT {INGEST_COLUMN} // {HOUR_MICROS} AS hour, min({INGEST_COLUMN})
+                FROM {self.table} WHERE {INGEST_COLUMN} < {current}
+                GROUP BY ALL ORDER BY ALL
+            """
+            ).fetchall()
+            files = []
+            for hour, first in closed:
+                start, end = hour * HOUR_MICROS, (hour + 1) * HOUR_MICROS
+                stamp = datetime.datetime.fromtimestamp(
+                    start / 1000000, datetime.timezone.utc
+                )
+                partition = os.path.join(
+                    self.parquet_dir, f"date={stamp.date()}", f"hour={stamp.hour}"
+                )
+                os.makedirs(partition, exist_ok=True)
+                # Named after its first row, so that redoing an export that died
+                # before its rows were deleted overwrites the same file
+                path = os.path.join(partition, f"part-{first}.parquet")
+                rows = f"{INGEST_COLUMN} >= {start} AND {INGEST_COLUMN} < {end}"
+                # In one transaction, so that the DELETE sees the same snapshot as
+                # the COPY and leaves alone any rows of the hour that are flushed in
+                # the meantime; the next rollover exports those
+                cursor.execute("BEGIN TRANSACTION")
+                try:
+                    cursor.execute(
+                        f"""
+                        COPY (
+                            SELECT * FROM {self.table} WHERE {rows}
+                            ORDER BY {INGEST_COLUMN}
+                        ) TO '{path}.tmp' (FORMAT PARQUET)
+                    """
+                    )
+                    os.replace(f"{path}.tmp", path)
+                    cursor.execute(f"DELETE FROM {self.table} WHERE {rows}")
+                    cursor.execute("COMMIT")
+                except BaseException as e:
+                    cursor.execute("ROLLBACK")
+                    # the rows are still in the table, so they can't be in a
+                    # partition as well
+                    for leftover in (f"{path}.tmp", path):
+                        if os.path.exists(leftover):
+                            os.remove(leftover)
+                    if not isinstance(e, duckdb.TransactionException):
+                        raise
+                    # DuckDB may instead refuse to delete the rows around ones that
+                    # were flushed in the meantime
+                    logging.info(f"Leaving {partition} to the next rollover: {e}")
+                    continue
+                files.append(path)
+            return files
+        finally:
+            cursor.close()
+
+    def expire(self, today: Optional[datetime.date] = None) -> List[str]:
+        """Removes the partitions of the days past the retention period."""
+        if not self.retention_days:
+            return []
+        today = today or datetime.datetime.now(datetime.timezone.utc).date()
+        cutoff = today - datetime.timedelta(days=self.retention_days)
+        removed = []
+        for day in sorted(glob.glob(os.path.join(self.parquet_dir, "date=*"))):
+            if datetime.date.fromisoformat(day.split("=", 1)[1]) < cutoff:
+                shutil.rmtree(day)
+                removed.append(day)
+        return removed
+
+    def close(self):
+        self.closed.set()
+        self.maintainer.join()
@@ -1,11 +1,13 @@
+import argparse
+import datetime
 import json
 import yaml
 from pathlib import Path
 
+import black
 from datamodel_code_generator import InputFileType, generate
-import duckdb
 
-from app import constants
+from app import constants, partitions
 
 
 def to_json_type(duckdb_type: str) -> str:
@@ -18,15 +20,47 @@ def to_json_type(duckdb_type: str) -> str:
         raise ValueError(f"Unknown type: {duckdb_type}")
 
 
+def summarize_snapshot(path: str) -> list:
+    """Reads the column summaries out of a profile snapshot written by the API.
+
+    The rows look like the ones `summarize` returns, so they can be used in its place
+    without scanning the table.
+    """
+    with open(path) as f:
+        snapshot = json.load(f)
+    return [
+        dict(column["summary"], column_name=name) for name, column in snapshot.items()
+    ]
+
+
+def summarize(curr, rows: str) -> list:
+    """Summarizes each column of the `rows` query with DuckDB's `SUMMARIZE`.
+
+    `SUMMARIZE` rounds the percentage of nulls, so each row also gets the exact
+    number of `nulls` in its column.
+    """
+    curr.execute(f"SUMMARIZE {rows}")
+    cols = [x[0] for x in curr.description]
+    summary = [dict(zip(cols, row)) for row in curr.fetchall()]
+    counts = ", ".join(f'count(*) - count("{row["column_name"]}")' for row in summary)
+    curr.execute(f"SELECT {counts} FROM ({rows})")
+    for row, nulls in zip(summary, curr.fetchone()):
+        row["nulls"] = nulls
+    return summary
+
+
 def to_json_schema(title, summary_table) -> dict:
-    """Convert a duckdb SUMMARIZE result to a JSON Schema."""
+    """Convert a column summary from `summarize` to a JSON Schema.
+
+    Only the columns that have never been null are required.
+    """
     res = {"type": "object", "title": title}
     props = {}
     required_fields = []
     for row in summary_table:
         col_type = row["column_type"]
         prop = {"type": to_json_type(col_type)}
-        if row["null_percentage"] == "0.0%":
+        if row["nulls"] == 0:
             required_fields.append(row["column_name"])
         if col_type in ("INTEGER", "DOUBLE"):
             prop["minimum"] = row["min"]
@@ -39,14 +73,162 @@ def to_json_schema(title, summary_table) -> dict:
     return res
 
 
+VALIDATOR_HEADER = '''"""Checks for {title}, generated from the data profile by `app/profile.py`.
+
+The checks for each field are written out flat, with the bounds inlined, and the
+failures are returned as a list of errors in Pydantic's format instead of being
+raised, which makes validating a request several times cheaper than building the
+Pydantic model.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+_MISSING = object()
+
+
+def _null(loc: str, value: Any, required: bool, errors: List[Dict[str, Any]]):
+    if not required:
+        return
+    if value is _MISSING:
+        errors.append({{"loc": (loc,), "msg": "field required", "type": "value_error.missing"}})
+    else:
+        errors.append(
+            {{
+                "loc": (loc,),
+                "msg": "none is not an allowed value",
+                "type": "type_error.none.not_allowed",
+            }}
+        )
+
+
+def _int(loc: str, value: Any, required: bool, errors: List[Dict[str, Any]]):
+    """The slow path, for values that aren't already ints; coerces like Pydantic."""
+    if value is _MISSING or value is None:
+        return _null(loc, value, required, errors)
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        errors.append(
+            {{"loc": (loc,), "msg": "value is not a valid integer", "type": "type_error.integer"}}
+        )
+
+
+def _float(loc: str, value: Any, required: bool, errors: List[Dict[str, Any]]):
+    """The slow path, for values that aren't already floats; coerces like Pydantic."""
+    if value is _MISSING or value is None:
+        return _null(loc, value, required, errors)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        errors.append(
+            {{"loc": (loc,), "msg": "value is not a valid float", "type": "type_error.float"}}
+        )
+
+
+def validate(data: Dict[str, Any]) -> Tuple[Optional[Tuple], List[Dict[str, Any]]]:
+    """Checks a request, returning its values in the order of the fields and the errors.
+
+    The values are None if there were any errors.
+    """
+    errors: List[Dict[str, Any]] = []
+'''
+
+# The bounds checks, in the order that Pydantic runs them; like Pydantic's, they are
+# written so that NaN fails them
+BOUNDS = (
+    ("minimum", ">=", "greater than or equal to", "value_error.number.not_ge"),
+    ("maximum", "<=", "less than or equal to", "value_error.number.not_le"),
+)
+
+
+def to_validator(json_schema: dict) -> str:
+    """Generate the source of a module that validates requests against a JSON Schema.
+
+    The checks are the same ones as the Pydantic model that `datamodel_code_generator`
+    generates from the schema, with the same errors, except that integers are also
+    checked against the range of the INT column they are stored in.
+    """
+    required = set(json_schema.get("required", []))
+    lines = [VALIDATOR_HEADER.format(title=json_schema["title"])]
+    for name, prop in json_schema["properties"].items():
+        py_type = int if prop["type"] == "integer" else float
+        lines.append(f"    value = data.get({name!r}, _MISSING)")
+        lines.append(f"    if type(value) is not {py_type.__name__}:")
+        lines.append(
+            f"        value = _{py_type.__name__}"
+            f"({name!r}, value, {name in required}, errors)"
+        )
+        limits = {key: prop.get(key) for key, *_ in BOUNDS}
+        if py_type is int:
+            low, high = constants.INT_RANGE
+            if limits["minimum"] is None or limits["minimum"] < low:
+                limits["minimum"] = low
+            if limits["maximum"] is None or limits["maximum"] > high:
+                limits["maximum"] = high
+        checks = [
+            (py_type(limits[key]), op, msg, error_type)
+            for key, op, msg, error_type in BOUNDS
+            if limits[key] is not None
+        ]
+        if checks:
+            lines.append("    if value is not None:")
+            for i, (limit, op, msg, error_type) in enumerate(checks):
+                error = {
+                    "loc": (name,),
+                    "msg": f"ensure this value is {msg} {limit}",
+                    "type": error_type,
+                    "ctx": {"limit_value": limit},
+                }
+                lines.append(
+                    f"        {'elif' if i else 'if'} not value {op} {limit!r}:"
+                )
+                lines.append(f"            errors.append({error!r})")
+        lines.append(f"    {name} = value")
+    values = "".join(f"{name}, " for name in json_schema["properties"])
+    lines.append("    if errors:")
+    lines.append("        return None, errors")
+    lines.append(f"    return ({values.rstrip()}), errors")
+    # black comes with datamodel_code_generator, which formats its models with it too
+    return black.format_str("\n".join(lines) + "\n", mode=black.Mode())
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate the data contract and alerting rules from a data profile"
+    )
+    parser.add_argument(
+        "--start",
+        type=datetime.datetime.fromisoformat,
+        help="only profile the data stored from this time (UTC) on",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.datetime.fromisoformat,
+        help="only profile the data stored before this time (UTC)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        nargs="?",
+        const=constants.PROFILE_FILE,
+        help="use the API's profile snapshot (by default, "
+        f"{constants.PROFILE_FILE}) instead of summarizing the table",
+    )
+    args = parser.parse_args()
 
-    conn = duckdb.connect(constants.DUCKDB_FILE)
-    curr = conn.cursor()
-    curr.execute(f"SUMMARIZE {constants.DATA_TABLE}")
-    cols = [x[0] for x in curr.description]
-    summary = [dict(zip(cols, row)) for row in curr.fetchall()]
-    conn.close()
+    if args.snapshot:
+        summary = summarize_snapshot(args.snapshot)
+    else:
+        conn, live = partitions.connect()
+        if not live:
+            print("The API is running, so only the exported partitions are profiled")
+        rows = partitions.scan(
+            constants.DATA_TABLE, constants.PARQUET_DIR, args.start, args.end, live
+        )
+        summary = summarize(
+            conn.cursor(),
+            f"SELECT * EXCLUDE ({partitions.INGEST_COLUMN}) FROM ({rows})",
+        )
+        conn.close()
 
     # Generate a JSON schema to use for type and domain validation
     json_schema = to_json_schema("AgrawalRequest", summary)
@@ -57,6 +239,9 @@ if __name__ == "__main__":
         output=Path("app") / "contracts.py",
         field_constraints=True,
     )
+    # and the same checks compiled down for /collect
+    with open(Path("app") / "validators.py", "w") as f:
+        f.write(to_validator(json_schema))
 
     alert_rules = []
     for name, prop in json_schema["properties"].items():
@@ -0,0 +1,42 @@
+import argparse
+import datetime
+
+from app import constants, partitions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Query the {constants.DATA_TABLE} data stored in a time range"
+    )
+    parser.add_argument(
+        "sql",
+        help=f'e.g. "SELECT avg(salary) FROM {constants.DATA_TABLE}"',
+    )
+    parser.add_argument(
+        "--start",
+        type=datetime.datetime.fromisoformat,
+        help="only include the data stored from this time (UTC) on",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.datetime.fromisoformat,
+        help="only include the data stored before this time (UTC)",
+    )
+    args = parser.parse_args()
+
+    conn, live = partitions.connect()
+    # The view stands in for the table in the query, so the table itself has to be
+    # named by its database, or the view would refer to itself
+    [database] = conn.execute("SELECT current_database()").fetchone()
+    rows = partitions.scan(
+        f"{database}.main.{constants.DATA_TABLE}",
+        constants.PARQUET_DIR,
+        args.start,
+        args.end,
+        live,
+    )
+    conn.execute(f"CREATE TEMP VIEW {constants.DATA_TABLE} AS {rows}")
+    cursor = conn.execute(args.sql)
+    print([x[0] for x in cursor.description])
+    for row in cursor.fetchall():
+        print(row)
+    conn.close()
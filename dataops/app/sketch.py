@@ -0,0 +1,231 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# The quantiles reported for each column
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    """A fast, well-mixed 64-bit hash of each value's bits."""
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def _leading_zeros(x: np.ndarray) -> np.ndarray:
+    zeros = np.zeros(len(x), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        top_clear = x < np.uint64(1 << (64 - shift))
+        zeros += top_clear.astype(np.uint8) * np.uint8(shift)
+        x = np.where(top_clear, x << np.uint64(shift), x)
+    return zeros
+
+
+class HyperLogLog:
+    """Approximate distinct counts, to within about 1.6% with the default precision."""
+
+    def __init__(self, precision: int = 12, registers: Optional[List[int]] = None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+        if registers is not None:
+            self.registers[:] = registers
+
+    def update(self, values: np.ndarray):
+        # hash the float64 bits, so that 3 and 3.0 count as the same value
+        hashes = _splitmix64(values.astype(np.float64).view(np.uint64))
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        # cap the rank at the number of bits left, like a guard bit would
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(
+            1 << (self.precision - 1)
+        )
+        np.maximum.at(self.registers, index, _leading_zeros(rest) + 1)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m
+        estimate /= np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and empty:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / empty)
+        return int(round(estimate))
+
+
+class ColumnSketch:
+    """Running statistics for one numeric column.
+
+    The count, nulls, min, max, mean and variance are exact; the mean and variance
+    are updated a batch at a time with Chan et al.'s parallel algorithm. Quantiles
+    come from a uniform reservoir sample of the values and distinct counts from a
+    HyperLogLog.
+    """
+
+    def __init__(self, column_type: str, reservoir_size: int = 4096, seed: int = 0):
+        self.column_type = column_type
+        self.count = 0
+        self.nulls = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.reservoir_size = reservoir_size
+        self.reservoir = np.empty(0, dtype=np.float64)
+        self.distinct = HyperLogLog()
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray, nulls: int = 0):
+        """Adds a batch of non-null values (and a count of nulls) to the sketch."""
+        self.nulls += nulls
+        n = len(values)
+        if not n:
+            return
+        lo, hi = float(values.min()), float(values.max())
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+        total = self.count + n
+        mean = float(values.mean())
+        delta = mean - self.mean
+        self.m2 += (
+            float(((values - mean) ** 2).sum()) + delta**2 * self.count * n / total
+        )
+        self.mean += delta * n / total
+
+        # Algorithm R: the i-th value seen replaces a random slot with
+        # probability reservoir_size / i
+        free = max(0, self.reservoir_size - len(self.reservoir))
+        self.reservoir = np.concatenate([self.reservoir, values[:free]])
+        if n > free:
+            seen = np.arange(self.count + free + 1, total + 1)
+            slots = (self.rng.random(len(seen)) * seen).astype(np.int64)
+            keep = slots < self.reservoir_size
+            self.reservoir[slots[keep]] = values[free:][keep]
+        self.count = total
+        self.distinct.update(values)
+
+    def summary(self) -> Dict[str, Any]:
+        rows = self.count + self.nulls
+        summary = {
+            "column_type": self.column_type,
+            "count": rows,
+            "nulls": self.nulls,
+            "null_percentage": 100.0 * self.nulls / rows if rows else 0.0,
+            "min": self._typed(self.min),
+            "max": self._typed(self.max),
+            "mean": self.mean if self.count else None,
+            "variance": self.m2 / (self.count - 1) if self.count > 1 else None,
+            "approx_distinct": self.distinct.count(),
+            "approx_quantiles": {},
+        }
+        if len(self.reservoir):
+            values = np.quantile(self.reservoir, QUANTILES)
+            summary["approx_quantiles"] = {
+                str(q): float(v) for q, v in zip(QUANTILES, values)
+            }
+        return summary
+
+    def _typed(self, value: Optional[float]):
+        if value is not None and self.column_type == "INTEGER":
+            return int(value)
+        return value
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "column_type": self.column_type,
+            "count": self.count,
+            "nulls": self.nulls,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "m2": self.m2,
+            "reservoir_size": self.reservoir_size,
+            "reservoir": self.reservoir.tolist(),
+            "registers": self.distinct.registers.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "ColumnSketch":
+        sketch = cls(state["column_type"], state["reservoir_size"])
+        for key in ("count", "nulls", "min", "max", "mean", "m2"):
+            setattr(sketch, key, state[key])
+        sketch.reservoir = np.asarray(state["reservoir"], dtype=np.float64)
+        sketch.distinct = HyperLogLog(registers=state["registers"])
+        return sketch
+
+
+class Profile:
+    """Sketches of every column of a table, kept up to date as rows are stored.
+
+    Snapshots hold both the summary of each column and the state of its sketch, so
+    that a profile can be picked up again from where a snapshot left off. If given a
+    `path`, the profile snapshots itself there at most every `interval_s` seconds as
+    it is updated.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, str],
+        path: Optional[str] = None,
+        interval_s: float = 60.0,
+    ):
+        # DuckDB's INT is an alias for INTEGER, which is what SUMMARIZE reports
+        self.columns = {
+            name: ColumnSketch("INTEGER" if t in ("INT", "INTEGER") else t)
+            for name, t in columns.items()
+        }
+        self.path = path
+        self.interval_s = interval_s
+        self.saved_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, rows: List[Sequence]):
+        """Adds a batch of rows, with their values in the order of the columns."""
+        if not rows:
+            return
+        # None becomes NaN, which marks the nulls
+        batch = np.array(rows, dtype=np.float64)
+        with self.lock:
+            for i, sketch in enumerate(self.columns.values()):
+                column = batch[:, i]
+                nulls = np.isnan(column)
+                sketch.update(column[~nulls], int(nulls.sum()))
+        if self.path and time.monotonic() - self.saved_at >= self.interval_s:
+            self.snapshot()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {name: s.summary() for name, s in self.columns.items()}
+
+    def snapshot(self, path: Optional[str] = None):
+        """Atomically writes the profile's summary and sketch states to `path`."""
+        path = path or self.path
+        with self.lock:
+            self.saved_at = time.monotonic()
+            snapshot = {
+                name: {"summary": s.summary(), "state": s.state()}
+                for name, s in self.columns.items()
+            }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, interval_s: float = 60.0) -> "Profile":
+        """Picks a profile up from its snapshot, to carry on snapshotting there."""
+        with open(path) as f:
+            snapshot = json.load(f)
+        profile = cls({}, path, interval_s)
+        profile.columns = {
+            name: ColumnSketch.from_state(column["state"])
+            for name, column in snapshot.items()
+        }
+        return profile
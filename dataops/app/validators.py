@@ -0,0 +1,232 @@
+"""Checks for AgrawalRequest, generated from the data profile by `app/profile.py`.
+
+The checks for each field are written out flat, with the bounds inlined, and the
+failures are returned as a list of errors in Pydantic's format instead of being
+raised, which makes validating a request several times cheaper than building the
+Pydantic model.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+_MISSING = object()
+
+
+def _null(loc: str, value: Any, required: bool, errors: List[Dict[str, Any]]):
+    if not required:
+        return
+    if value is _MISSING:
+        errors.append(
+            {"loc": (loc,), "msg": "field required", "type": "value_error.missing"}
+        )
+    else:
+        errors.append(
+            {
+                "loc": (loc,),
+                "msg": "none is not an allowed value",
+                "type": "type_error.none.not_allowed",
+            }
+        )
+
+
+def _int(loc: str, value: Any, required: bool, errors: List[Dict[str, Any]]):
+    """The slow path, for values that aren't already ints; coerces like Pydantic."""
+    if value is _MISSING or value is None:
+        return _null(loc, value, required, errors)
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        errors.append(
+            {
+                "loc": (loc,),
+                "msg": "value is not a valid integer",
+                "type": "type_error.integer",
+            }
+        )
+
+
+def _float(loc: str, value: Any, required: bool, errors: List[Dict[str, Any]]):
+    """The slow path, for values that aren't already floats; coerces like Pydantic."""
+    if value is _MISSING or value is None:
+        return _null(loc, value, required, errors)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        errors.append(
+            {
+                "loc": (loc,),
+                "msg": "value is not a valid float",
+                "type": "type_error.float",
+            }
+        )
+
+
+def validate(data: Dict[str, Any]) -> Tuple[Optional[Tuple], List[Dict[str, Any]]]:
+    """Checks a request, returning its values in the order of the fields and the errors.
+
+    The values are None if there were any errors.
+    """
+    errors: List[Dict[str, Any]] = []
+
+    value = data.get("salary", _MISSING)
+    if type(value) is not float:
+        value = _float("salary", value, True, errors)
+    salary = value
+    value = data.get("commission", _MISSING)
+    if type(value) is not float:
+        value = _float("commission", value, True, errors)
+    commission = value
+    value = data.get("age", _MISSING)
+    if type(value) is not int:
+        value = _int("age", value, True, errors)
+    if value is not None:
+        if not value >= -2147483648:
+            errors.append(
+                {
+                    "loc": ("age",),
+                    "msg": "ensure this value is greater than or equal to -2147483648",
+                    "type": "value_error.number.not_ge",
+                    "ctx": {"limit_value": -2147483648},
+                }
+            )
+        elif not value <= 2147483647:
+            errors.append(
+                {
+                    "loc": ("age",),
+                    "msg": "ensure this value is less than or equal to 2147483647",
+                    "type": "value_error.number.not_le",
+                    "ctx": {"limit_value": 2147483647},
+                }
+            )
+    age = value
+    value = data.get("elevel", _MISSING)
+    if type(value) is not int:
+        value = _int("elevel", value, True, errors)
+    if value is not None:
+        if not value >= -2147483648:
+            errors.append(
+                {
+                    "loc": ("elevel",),
+                    "msg": "ensure this value is greater than or equal to -2147483648",
+                    "type": "value_error.number.not_ge",
+                    "ctx": {"limit_value": -2147483648},
+                }
+            )
+        elif not value <= 2147483647:
+            errors.append(
+                {
+                    "loc": ("elevel",),
+                    "msg": "ensure this value is less than or equal to 2147483647",
+                    "type": "value_error.number.not_le",
+                    "ctx": {"limit_value": 2147483647},
+                }
+            )
+    elevel = value
+    value = data.get("car", _MISSING)
+    if type(value) is not int:
+        value = _int("car", value, True, errors)
+    if value is not None:
+        if not value >= -2147483648:
+            errors.append(
+                {
+                    "loc": ("car",),
+                    "msg": "ensure this value is greater than or equal to -2147483648",
+                    "type": "value_error.number.not_ge",
+                    "ctx": {"limit_value": -2147483648},
+                }
+            )
+        elif not value <= 2147483647:
+            errors.append(
+                {
+                    "loc": ("car",),
+                    "msg": "ensure this value is less than or equal to 2147483647",
+                    "type": "value_error.number.not_le",
+                    "ctx": {"limit_value": 2147483647},
+                }
+            )
+    car = value
+    value = data.get("zipcode", _MISSING)
+    if type(value) is not int:
+        value = _int("zipcode", value, True, errors)
+    if value is not None:
+        if not value >= -2147483648:
+            errors.append(
+                {
+                    "loc": ("zipcode",),
+                    "msg": "ensure this value is greater than or equal to -2147483648",
+                    "type": "value_error.number.not_ge",
+                    "ctx": {"limit_value": -2147483648},
+                }
+            )
+        elif not value <= 2147483647:
+            errors.append(
+                {
+                    "loc": ("zipcode",),
+                    "msg": "ensure this value is less than or equal to 2147483647",
+                    "type": "value_error.number.not_le",
+                    "ctx": {"limit_value": 2147483647},
+                }
+            )
+    zipcode = value
+    value = data.get("hvalue", _MISSING)
+    if type(value) is not int:
+        value = _int("hvalue", value, True, errors)
+    if value is not None:
+        if not value >= -2147483648:
+            errors.append(
+                {
+                    "loc": ("hvalue",),
+                    "msg": "ensure this value is greater than or equal to -2147483648",
+                    "type": "value_error.number.not_ge",
+                    "ctx": {"limit_value": -2147483648},
+                }
+            )
+        elif not value <= 2147483647:
+            errors.append(
+                {
+                    "loc": ("hvalue",),
+                    "msg": "ensure this value is less than or equal to 2147483647",
+                    "type": "value_error.number.not_le",
+                    "ctx": {"limit_value": 2147483647},
+                }
+            )
+    hvalue = value
+    value = data.get("hyears", _MISSING)
+    if type(value) is not int:
+        value = _int("hyears", value, True, errors)
+    if value is not None:
+        if not value >= -2147483648:
+            errors.append(
+                {
+                    "loc": ("hyears",),
+                    "msg": "ensure this value is greater than or equal to -2147483648",
+                    "type": "value_error.number.not_ge",
+                    "ctx": {"limit_value": -2147483648},
+                }
+            )
+        elif not value <= 2147483647:
+            errors.append(
+                {
+                    "loc": ("hyears",),
+                    "msg": "ensure this value is less than or equal to 2147483647",
+                    "type": "value_error.number.not_le",
+                    "ctx": {"limit_value": 2147483647},
+                }
+            )
+    hyears = value
+    value = data.get("loan", _MISSING)
+    if type(value) is not float:
+        value = _float("loan", value, True, errors)
+    loan = value
+    if errors:
+        return None, errors
+    return (
+        salary,
+        commission,
+        age,
+        elevel,
+        car,
+        zipcode,
+        hvalue,
+        hyears,
+        loan,
+    ), errors
@@ -0,0 +1,218 @@
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import duckdb
+import orjson
+
+from prometheus_client import multiprocess
+
+from app import constants, contracts
+from app.buffer import RowBuffer
+from app.partitions import PartitionedTable, create_table
+from app.sketch import Profile
+
+# Each message is a kind, the length of its payload and then its JSON payload
+HEADER = struct.Struct("!cI")
+ROWS = b"R"
+PROFILE = b"P"
+
+
+def contract_columns() -> Dict[str, str]:
+    """The DuckDB type of each field of the contract."""
+    columns = {}
+    for field in contracts.AgrawalRequest.__fields__.values():
+        if field.type_ == float:
+            columns[field.name] = "DOUBLE"
+        else:
+            columns[field.name] = "INT"
+    return columns
+
+
+class Store:
+    """The table where we store the data the API collects.
+
+    This holds the one connection to the DuckDB file, so only one process can have a
+    Store open at a time: the API itself when it runs in a single process, or the
+    writer process that its workers forward their rows to.
+    """
+
+    def __init__(self, columns: Dict[str, str]):
+        self.db = duckdb.connect(constants.DUCKDB_FILE)
+        create_table(self.db, constants.DATA_TABLE, columns)
+        self.partitions = PartitionedTable(
+            self.db, constants.DATA_TABLE, constants.PARQUET_DIR
+        )
+
+        # Carry on with the profile of the data collected before the restart
+        self.profile = None
+        if os.path.exists(constants.PROFILE_FILE):
+            try:
+                self.profile = Profile.load(
+                    constants.PROFILE_FILE, constants.PROFILE_SNAPSHOT_INTERVAL_S
+                )
+            except (OSError, ValueError, KeyError):
+                logging.exception("Starting a new profile; the snapshot is unreadable")
+        if self.profile is None or list(self.profile.columns) != list(columns):
+            self.profile = Profile(
+                columns, constants.PROFILE_FILE, constants.PROFILE_SNAPSHOT_INTERVAL_S
+            )
+        self.buffer = RowBuffer(
+            self.db, constants.DATA_TABLE, columns, on_flush=self.profile.update
+        )
+
+    def append(self, row: Sequence):
+        self.buffer.append(row)
+
+    def extend(self, rows: List[Sequence]):
+        self.buffer.extend(rows)
+
+    def summary(self) -> Dict[str, Dict]:
+        return self.profile.summary()
+
+    def close(self):
+        """Flush any buffered rows, snapshot the profile and close the database."""
+        self.buffer.close()
+        self.partitions.close()
+        self.profile.snapshot()
+        self.db.close()
+
+
+def _send(sock: socket.socket, kind: bytes, payload: bytes):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("The writer closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+class Forwarder:
+    """Stands in for the Store in an API worker, forwarding its rows to the writer.
+
+    The rows go over a unix socket to the writer process, which buffers them and
+    appends them to DuckDB like the API does when it runs in a single process, and
+    replies once it has taken them. The connection is opened on first use, and
+    opened again once if the writer has gone away since.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sock: Optional[socket.socket] = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def append(self, row: Sequence):
+        self.extend([row])
+
+    def extend(self, rows: List[Sequence]):
+        """Forwards the rows and waits for the writer to take them.
+
+        Raises OSError if the writer can't be reached, or goes away before replying.
+        This blocks, so the API calls it off the event loop.
+        """
+        if not rows:
+            return
+        payload = orjson.dumps(rows)
+        with self.lock:
+            for retry in (True, False):
+                try:
+                    if self.sock is None:
+                        self.sock = self._connect()
+                    _send(self.sock, ROWS, payload)
+                    break
+                except OSError:
+                    self._disconnect()
+                    if not retry:
+                        raise
+            try:
+                # the writer may have taken the rows, so they aren't sent again
+                _recv_exactly(self.sock, HEADER.size)
+            except OSError:
+                self._disconnect()
+                raise
+
+    def _disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def summary(self) -> Dict[str, Dict]:
+        """Asks the writer for its profile of the data, over a connection of its own."""
+        with self._connect() as sock:
+            _send(sock, PROFILE, b"")
+            kind, length = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+            return orjson.loads(_recv_exactly(sock, length))
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        while True:
+            header = self.rfile.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            kind, length = HEADER.unpack(header)
+            payload = self.rfile.read(length)
+            if kind == ROWS:
+                store.extend(orjson.loads(payload))
+                # tell the worker the rows are ours now
+                _send(self.connection, ROWS, b"")
+            elif kind == PROFILE:
+                _send(self.connection, PROFILE, orjson.dumps(store.summary()))
+
+
+class WriterServer(socketserver.ThreadingUnixStreamServer):
+    """Takes in the rows that the API workers forward, one thread per worker."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, store: Store):
+        if os.path.exists(path):
+            # left over from a writer that didn't shut down cleanly
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        self.store = store
+
+
+def main():
+    """Serves the API workers until SIGINT or SIGTERM, then closes the store."""
+    logging.basicConfig(level=logging.INFO)
+    path = constants.WRITER_SOCKET
+    store = Store(contract_columns())
+    server = WriterServer(path, store)
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopped.set())
+    serving = threading.Thread(target=server.serve_forever, name="writer-server")
+    serving.start()
+    logging.info(f"Taking in the rows the API workers forward on {path}")
+    stopped.wait()
+    server.shutdown()
+    server.server_close()
+    os.unlink(path)
+    store.close()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+if __name__ == "__main__":
+    main()
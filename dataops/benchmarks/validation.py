@@ -0,0 +1,79 @@
+"""Measures the per-request CPU cost of validating a /collect body.
+
+Compares the old path, the standard library json module plus building the Pydantic
+contract, against orjson plus the validator that profile.py compiles from the same
+profile, for both a valid and an invalid request.
+
+Usage: PYTHONPATH=. python benchmarks/validation.py [requests]
+"""
+
+import json
+import sys
+import time
+
+import orjson
+
+from pydantic import ValidationError
+
+from app import contracts, validators
+
+VALID = json.dumps(
+    {
+        "salary": 72500.0,
+        "commission": 0.0,
+        "age": 41,
+        "elevel": 2,
+        "car": 7,
+        "zipcode": 3,
+        "hvalue": 215000,
+        "hyears": 12,
+        "loan": 180000.0,
+    }
+).encode()
+
+# A value of the wrong type and a missing field
+INVALID = json.dumps(
+    {
+        "salary": 72500.0,
+        "commission": 0.0,
+        "age": "forty-one",
+        "elevel": 2,
+        "car": 7,
+        "zipcode": 3,
+        "hvalue": 215000,
+        "hyears": 12,
+    }
+).encode()
+
+
+def pydantic(body: bytes):
+    try:
+        parsed = contracts.AgrawalRequest(**json.loads(body))
+    except ValidationError as e:
+        return None, e.errors()
+    return tuple(parsed.dict().values()), []
+
+
+def compiled(body: bytes):
+    return validators.validate(orjson.loads(body))
+
+
+def run(fn, body: bytes, requests: int) -> dict:
+    start = time.process_time()
+    for _ in range(requests):
+        fn(body)
+    elapsed = time.process_time() - start
+    return {
+        "path": fn.__name__,
+        "valid": body is VALID,
+        "cpu_us_per_request": round(elapsed / requests * 1e6, 2),
+    }
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for body in (VALID, INVALID):
+        # both paths must agree before their costs are worth comparing
+        assert pydantic(body) == compiled(body)
+        for fn in (pydantic, compiled):
+            print(json.dumps(run(fn, body, requests)))
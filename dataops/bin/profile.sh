@@ -1 +1 @@
-PYTHONPATH=. python app/profile.py
+PYTHONPATH=. python app/profile.py "$@"
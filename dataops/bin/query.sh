@@ -0,0 +1 @@
+PYTHONPATH=. python app/query.py "$@"
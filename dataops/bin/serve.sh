@@ -1 +1,18 @@
-uvicorn app.api:app --port 8080
+WORKERS=${WORKERS:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    # the workers forward their rows to a single writer that holds the DuckDB file,
+    # and share a directory of metrics that /metrics adds up across the processes
+    export WORKERS
+    export WRITER_SOCKET=${WRITER_SOCKET:-/tmp/agrawal-writer.sock}
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/agrawal-metrics}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    rm -f "$WRITER_SOCKET"
+    PYTHONPATH=. python app/writer.py &
+    WRITER=$!
+    trap 'kill $WRITER; wait $WRITER' EXIT
+    while [ ! -S "$WRITER_SOCKET" ]; do
+        kill -0 $WRITER || exit 1
+        sleep 0.1
+    done
+fi
+uvicorn app.api:app --port 8080 --workers "$WORKERS"
@@ -0,0 +1,14 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import api, constants
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """The API, with its DuckDB file, profile and partitions under tmp_path."""
+    monkeypatch.setattr(constants, "DUCKDB_FILE", str(tmp_path / "agrawal.duckdb"))
+    monkeypatch.setattr(constants, "PROFILE_FILE", str(tmp_path / "profile.json"))
+    monkeypatch.setattr(constants, "PARQUET_DIR", str(tmp_path / "agrawal"))
+    with TestClient(api.app) as client:
+        yield client
@@ -0,0 +1,35 @@
+import pytest
+
+ROW = {
+    "salary": 72500.0,
+    "commission": 0.0,
+    "age": 41,
+    "elevel": 2,
+    "car": 7,
+    "zipcode": 3,
+    "hvalue": 215000,
+    "hyears": 12,
+    "loan": 180000.0,
+}
+
+
+@pytest.mark.parametrize("path", ["/collect", "/collect/batch"])
+def test_collect_rejects_invalid_json(client, path):
+    response = client.post(path, content=b"{bad json")
+    assert response.status_code == 400
+    assert response.json() == {"error": "Invalid JSON"}
+
+
+def test_collect_batch(client):
+    rows = [ROW, dict(ROW, age="forty-one"), dict(ROW, hvalue=2**40)]
+    response = client.post("/collect/batch", json=rows)
+    assert response.status_code == 200
+    assert response.json() == {
+        "status": "ok",
+        "accepted": 1,
+        "rejected": [1, 2],
+        "errors": [
+            {"loc": "age", "type": "type_error.integer", "count": 1},
+            {"loc": "hvalue", "type": "value_error.number.not_le", "count": 1},
+        ],
+    }
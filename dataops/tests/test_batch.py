@@ -0,0 +1,42 @@
+import math
+
+import pytest
+from pydantic import BaseModel, Field, ValidationError
+
+from app import batch
+
+
+class Bounded(BaseModel):
+    salary: float = Field(..., ge=0.0, le=10.0)
+    loan: float = Field(..., gt=0.0, lt=10.0)
+    age: int
+
+
+@pytest.mark.parametrize(
+    "row, out_of_range",
+    [
+        ({"salary": 5.0, "loan": 5.0, "age": 30}, set()),
+        ({"salary": math.nan, "loan": math.nan, "age": 30}, set()),
+        ({"salary": -1.0, "loan": 0.0, "age": 30}, set()),
+        ({"salary": 11.0, "loan": 10.0, "age": 2**40}, {"not_le"}),
+        ({"salary": "x", "loan": None, "age": -(2**40)}, {"not_ge"}),
+        ({"salary": "nan", "age": 1.5}, set()),
+    ],
+)
+def test_validate_matches_pydantic(row, out_of_range):
+    rules = batch.column_rules(Bounded)
+    columns, rows = batch.to_columns([row], rules)
+    valid, parsed, errors = batch.validate(columns, rows, rules)
+
+    try:
+        expected = Bounded(**row)
+        expected_errors = set()
+    except ValidationError as e:
+        expected = None
+        expected_errors = {(error["loc"][0], error["type"]) for error in e.errors()}
+    # ints out of the range of the INT column they are stored in fail too
+    expected_errors |= {("age", f"value_error.number.{e}") for e in out_of_range}
+    assert set(errors) == expected_errors
+    assert valid.tolist() == [not expected_errors]
+    if not expected_errors:
+        assert parsed == [tuple(expected.dict().values())]
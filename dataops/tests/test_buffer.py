@@ -0,0 +1,78 @@
+import queue
+import time
+
+import duckdb
+import pytest
+from prometheus_client import REGISTRY
+
+from app import constants
+from app.buffer import RowBuffer
+
+COLUMNS = {"age": "INT", "salary": "DOUBLE"}
+
+
+@pytest.fixture
+def db():
+    db = duckdb.connect()
+    db.execute("CREATE TABLE agrawal (age INT, salary DOUBLE)")
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def flushed():
+    """The batches the buffer has stored, as it passes them to on_flush."""
+    return queue.Queue()
+
+
+def _buffer(db, flushed, **kwargs) -> RowBuffer:
+    return RowBuffer(db, "agrawal", COLUMNS, on_flush=flushed.put, **kwargs)
+
+
+def _stored(db):
+    return db.execute("SELECT * FROM agrawal ORDER BY age").fetchall()
+
+
+def test_flushes_once_full(db, flushed):
+    buffer = _buffer(db, flushed, max_rows=3, max_age_s=60)
+    buffer.append((1, 10.0))
+    buffer.extend([(2, 20.0), (3, 30.0), (4, 40.0)])
+    assert flushed.get(timeout=10) == [(1, 10.0), (2, 20.0), (3, 30.0), (4, 40.0)]
+    assert len(_stored(db)) == 4
+    buffer.close()
+
+
+def test_flushes_once_the_oldest_row_is_old_enough(db, flushed):
+    buffer = _buffer(db, flushed, max_rows=1000, max_age_s=0.2)
+    start = time.monotonic()
+    buffer.append((1, 10.0))
+    time.sleep(0.1)
+    buffer.append((2, 20.0))
+    assert flushed.get(timeout=10) == [(1, 10.0), (2, 20.0)]
+    # the clock started with the first row, not the last
+    assert time.monotonic() - start >= 0.2
+    buffer.close()
+
+
+def test_flushes_whatever_is_left_on_close(db, flushed):
+    buffer = _buffer(db, flushed, max_rows=1000, max_age_s=60)
+    buffer.extend([(1, 10.0), (2, None)])
+    assert flushed.empty()
+    buffer.close()
+    assert _stored(db) == [(1, 10.0), (2, None)]
+    assert flushed.get_nowait() == [(1, 10.0), (2, None)]
+
+
+def test_drops_only_the_rows_duckdb_wont_store(db, flushed):
+    dropped = REGISTRY.get_sample_value(f"{constants.DROPPED_ROWS}_total")
+    buffer = _buffer(db, flushed, max_rows=1000, max_age_s=60)
+    rows = [(age, 1.0) for age in range(10)]
+    # too big for an INT, and not a number at all
+    rows[3] = (2**40, 1.0)
+    rows[8] = (8, "eight")
+    buffer.extend(rows)
+    buffer.close()
+    good = [row for i, row in enumerate(rows) if i not in (3, 8)]
+    assert _stored(db) == good
+    assert flushed.get_nowait() == good
+    assert REGISTRY.get_sample_value(f"{constants.DROPPED_ROWS}_total") == dropped + 2
@@ -0,0 +1,118 @@
+import datetime
+import os
+
+import duckdb
+import pytest
+
+from app import partitions
+from app.partitions import HOUR_MICROS, PartitionedTable, create_table
+
+
+@pytest.fixture
+def table(tmp_path):
+    db = duckdb.connect(str(tmp_path / "agrawal.duckdb"))
+    create_table(db, "agrawal", {"age": "INT"})
+    table = PartitionedTable(db, "agrawal", str(tmp_path / "agrawal"), 2, 3600)
+    # only the rollovers the tests run themselves
+    table.close()
+    yield table
+    db.close()
+
+
+def _store(db, *rows):
+    values = ", ".join(f"({age}, {micros})" for age, micros in rows)
+    db.execute(f"INSERT INTO agrawal (age, ingest_micros) VALUES {values}")
+
+
+def _live(table):
+    return table.db.execute("SELECT age FROM agrawal ORDER BY age").fetchall()
+
+
+def _exported(table):
+    pattern = os.path.join(table.parquet_dir, "*", "*", "*.parquet")
+    return duckdb.sql(
+        f"SELECT age FROM read_parquet('{pattern}') ORDER BY age"
+    ).fetchall()
+
+
+def test_rollover_exports_the_closed_hours(table):
+    _store(table.db, (1, HOUR_MICROS + 5), (2, HOUR_MICROS + 9), (3, 2 * HOUR_MICROS))
+    _store(table.db, (4, 3 * HOUR_MICROS + 1))
+
+    files = table.rollover(now=3 * HOUR_MICROS + 10)
+    assert [os.path.relpath(f, table.parquet_dir) for f in files] == [
+        f"date=1970-01-01/hour=1/part-{HOUR_MICROS + 5}.parquet",
+        f"date=1970-01-01/hour=2/part-{2 * HOUR_MICROS}.parquet",
+    ]
+    assert _exported(table) == [(1,), (2,), (3,)]
+    assert _live(table) == [(4,)]
+    assert table.rollover(now=3 * HOUR_MICROS + 10) == []
+
+
+def test_failed_export_leaves_the_rows(table, monkeypatch):
+    _store(table.db, (1, HOUR_MICROS), (2, HOUR_MICROS + 1))
+
+    def full(src, dst):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(partitions.os, "replace", full)
+    with pytest.raises(OSError):
+        table.rollover(now=2 * HOUR_MICROS)
+    monkeypatch.undo()
+    assert _live(table) == [(1,), (2,)]
+    assert not os.listdir(os.path.join(table.parquet_dir, "date=1970-01-01", "hour=1"))
+
+    table.rollover(now=2 * HOUR_MICROS)
+    assert _exported(table) == [(1,), (2,)]
+    assert _live(table) == []
+
+
+def test_rows_flushed_during_an_export_are_kept(table, monkeypatch):
+    _store(table.db, (1, HOUR_MICROS), (2, HOUR_MICROS + 1))
+    replace = os.replace
+
+    def flush_then_replace(src, dst):
+        # the buffer flushes a row of the same hour, on a connection of its own
+        cursor = table.db.cursor()
+        _store(cursor, (3, HOUR_MICROS + 2))
+        cursor.close()
+        replace(src, dst)
+
+    monkeypatch.setattr(partitions.os, "replace", flush_then_replace)
+    table.rollover(now=2 * HOUR_MICROS)
+    monkeypatch.undo()
+    assert _exported(table) == [(1,), (2,)]
+    assert _live(table) == [(3,)]
+
+    table.rollover(now=2 * HOUR_MICROS)
+    assert _exported(table) == [(1,), (2,), (3,)]
+    assert _live(table) == []
+
+
+def test_expire_drops_the_days_past_retention(table):
+    for day in ("2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"):
+        os.makedirs(os.path.join(table.parquet_dir, f"date={day}", "hour=0"))
+
+    removed = table.expire(today=datetime.date(2024, 1, 4))
+    assert [os.path.basename(d) for d in removed] == ["date=2024-01-01"]
+    assert sorted(os.listdir(table.parquet_dir)) == [
+        "date=2024-01-02",
+        "date=2024-01-03",
+        "date=2024-01-04",
+    ]
+
+
+def test_scan_unions_the_live_table_and_the_partitions(table):
+    _store(table.db, (1, HOUR_MICROS), (2, 2 * HOUR_MICROS + 5), (3, 3 * HOUR_MICROS))
+    table.rollover(now=3 * HOUR_MICROS)
+
+    def scan(start=None, end=None, live=True):
+        rows = partitions.scan("agrawal", table.parquet_dir, start, end, live)
+        return table.db.execute(f"SELECT age FROM ({rows}) ORDER BY age").fetchall()
+
+    epoch = datetime.datetime(1970, 1, 1)
+    assert scan() == [(1,), (2,), (3,)]
+    assert scan(live=False) == [(1,), (2,)]
+    # the range starts partway into hour 2, and ends with the live row's hour
+    assert scan(epoch + datetime.timedelta(hours=2, microseconds=1)) == [(2,), (3,)]
+    assert scan(end=epoch + datetime.timedelta(hours=3)) == [(1,), (2,)]
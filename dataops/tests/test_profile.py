@@ -0,0 +1,33 @@
+import duckdb
+import pytest
+
+# profile.py generates the contract with it
+pytest.importorskip("datamodel_code_generator")
+
+from app import profile  # noqa: E402
+from app.sketch import Profile  # noqa: E402
+
+# one null in a hundred thousand rounds to 0.0%
+ROWS = [(i, float(i) if i else None) for i in range(100_000)]
+
+
+def _required(summary):
+    return profile.to_json_schema("AgrawalRequest", summary).get("required", [])
+
+
+def test_a_rare_null_makes_a_field_optional_when_summarizing_the_table():
+    db = duckdb.connect()
+    db.execute("CREATE TABLE agrawal (age INTEGER, salary DOUBLE)")
+    db.executemany("INSERT INTO agrawal VALUES (?, ?)", ROWS[:1000])
+    db.execute("INSERT INTO agrawal SELECT i, i FROM range(1000, 100000) t(i)")
+    summary = profile.summarize(db.cursor(), "SELECT * FROM agrawal")
+    assert [row["nulls"] for row in summary] == [0, 1]
+    assert _required(summary) == ["age"]
+
+
+def test_a_rare_null_makes_a_field_optional_in_a_snapshot(tmp_path):
+    path = str(tmp_path / "profile.json")
+    sketches = Profile({"age": "INTEGER", "salary": "DOUBLE"}, path)
+    sketches.update(ROWS)
+    sketches.snapshot()
+    assert _required(profile.summarize_snapshot(path)) == ["age"]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from app.sketch import ColumnSketch, HyperLogLog, Profile
+
+
+def test_merged_moments_match_the_exact_ones():
+    rng = np.random.default_rng(1)
+    values = rng.normal(50_000, 20_000, 100_000)
+    sketch = ColumnSketch("DOUBLE")
+    # uneven batches, so that each merge weighs the two sides differently
+    for batch in np.split(values, [1, 10, 5_000, 5_001, 60_000]):
+        sketch.update(batch, nulls=3)
+    summary = sketch.summary()
+    assert summary["count"] == len(values) + 18
+    assert summary["nulls"] == 18
+    assert summary["min"] == values.min() and summary["max"] == values.max()
+    assert summary["mean"] == pytest.approx(values.mean(), rel=1e-12)
+    assert summary["variance"] == pytest.approx(values.var(ddof=1), rel=1e-9)
+
+
+@pytest.mark.parametrize("distinct", [10, 1_000, 50_000, 500_000])
+def test_hyperloglog_counts_within_its_error(distinct):
+    hll = HyperLogLog()
+    values = np.arange(distinct)
+    # repeats don't count, and nor does an integer's type
+    hll.update(values)
+    hll.update(values.astype(np.float64))
+    # three standard errors of 1.04 / sqrt(4096)
+    assert hll.count() == pytest.approx(distinct, rel=0.05)
+
+
+def test_reservoir_is_a_uniform_sample():
+    values = np.random.default_rng(2).random(100_000)
+    sketch = ColumnSketch("DOUBLE", reservoir_size=1000)
+    for batch in np.array_split(values, 37):
+        sketch.update(batch)
+    assert len(sketch.reservoir) == 1000
+    assert np.isin(sketch.reservoir, values).all()
+    quantiles = sketch.summary()["approx_quantiles"]
+    for q, value in quantiles.items():
+        assert value == pytest.approx(float(q), abs=0.05)
+
+
+def test_profile_picks_up_from_its_snapshot(tmp_path):
+    columns = {"salary": "DOUBLE", "age": "INT"}
+    rows = [(1000.0 * i, i % 60 if i % 7 else None) for i in range(2000)]
+    whole = Profile(columns)
+    whole.update(rows)
+
+    path = str(tmp_path / "profile.json")
+    first = Profile(columns, path)
+    first.update(rows[:1500])
+    first.snapshot()
+    loaded = Profile.load(path)
+    assert loaded.summary() == first.summary()
+    loaded.update(rows[1500:])
+
+    for name, summary in loaded.summary().items():
+        expected = whole.summary()[name]
+        assert summary["column_type"] == expected["column_type"]
+        for key in ("count", "nulls", "min", "max", "approx_distinct"):
+            assert summary[key] == expected[key]
+        for key in ("mean", "variance"):
+            assert summary[key] == pytest.approx(expected[key], rel=1e-12)
+    assert loaded.summary()["age"]["nulls"] == 286
+    assert loaded.summary()["age"]["column_type"] == "INTEGER"
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+from pydantic import ValidationError
+
+from app import constants, contracts, validators
+
+FIELDS = contracts.AgrawalRequest.__fields__
+
+# Values of each JSON type, and the edge cases of coercing them
+VALUES = [
+    0,
+    41,
+    -7,
+    2**31,
+    -(2**31) - 1,
+    2**63,
+    72500.0,
+    1.5,
+    -0.0,
+    1e300,
+    float("nan"),
+    float("inf"),
+    True,
+    False,
+    None,
+    "41",
+    " 12 ",
+    "1.5",
+    "1e3",
+    "nan",
+    "-inf",
+    "forty-one",
+    "",
+    [],
+    [1],
+    {},
+    {"a": 1},
+]
+
+
+def _range_error(name, value):
+    """The error for an int that fits the contract but not the INT column."""
+    low, high = constants.INT_RANGE
+    if value < low:
+        return {
+            "loc": (name,),
+            "msg": f"ensure this value is greater than or equal to {low}",
+            "type": "value_error.number.not_ge",
+            "ctx": {"limit_value": low},
+        }
+    if value > high:
+        return {
+            "loc": (name,),
+            "msg": f"ensure this value is less than or equal to {high}",
+            "type": "value_error.number.not_le",
+            "ctx": {"limit_value": high},
+        }
+
+
+def _expected(data):
+    """What building the contract makes of the request, in the validator's terms."""
+    try:
+        model = contracts.AgrawalRequest(**data)
+        model_errors = []
+    except ValidationError as e:
+        model = None
+        model_errors = e.errors()
+    errors = []
+    for name, field in FIELDS.items():
+        field_errors = [error for error in model_errors if error["loc"] == (name,)]
+        errors.extend(field_errors)
+        if not field_errors and field.outer_type_ is int:
+            # the model isn't built if another field failed, so coerce this one alone
+            error = _range_error(name, field.validate(data[name], {}, loc=name)[0])
+            if error:
+                errors.append(error)
+    values = tuple(model.dict().values()) if model and not errors else None
+    return values, errors
+
+
+def _valid():
+    return {
+        name: 1 if field.outer_type_ is int else 1.0 for name, field in FIELDS.items()
+    }
+
+
+def test_validator_matches_the_contract():
+    rng = random.Random(0)
+    for _ in range(5000):
+        data = _valid()
+        for name in rng.sample(list(FIELDS), rng.randint(1, 3)):
+            if rng.random() < 0.1:
+                del data[name]
+            else:
+                data[name] = rng.choice(VALUES)
+        values, errors = validators.validate(data)
+        expected_values, expected_errors = _expected(data)
+        assert errors == expected_errors, data
+        assert repr(values) == repr(expected_values), data
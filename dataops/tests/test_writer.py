@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import duckdb
+from fastapi.testclient import TestClient
+
+from app import api, constants, writer
+from test_api import ROW
+
+
+def _serve(settings):
+    """Runs the writer process with the given constants, as bin/serve.sh would."""
+    for name, value in settings.items():
+        setattr(constants, name, value)
+    writer.main()
+
+
+def test_rows_round_trip_through_the_writer(tmp_path, monkeypatch):
+    settings = {
+        "DUCKDB_FILE": str(tmp_path / "agrawal.duckdb"),
+        "PROFILE_FILE": str(tmp_path / "profile.json"),
+        "PARQUET_DIR": str(tmp_path / "agrawal"),
+        "WRITER_SOCKET": str(tmp_path / "writer.sock"),
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(constants, name, value)
+    monkeypatch.setattr(constants, "WORKERS", 2)
+    process = multiprocessing.get_context("spawn").Process(
+        target=_serve, args=(settings,)
+    )
+    process.start()
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(settings["WRITER_SOCKET"]):
+            assert process.is_alive() and time.monotonic() < deadline
+            time.sleep(0.05)
+        with TestClient(api.app) as client:
+            assert client.post("/collect", json=ROW).status_code == 200
+            response = client.post("/collect/batch", json=[ROW, ROW])
+            assert response.json()["accepted"] == 2
+            # the writer stores what it was sent when it stops...
+            os.kill(process.pid, signal.SIGTERM)
+            process.join(30)
+            assert process.exitcode == 0
+            # ...and once it's gone, the API says so instead of losing the rows
+            response = client.post("/collect", json=ROW)
+            assert response.status_code == 503
+            assert client.post("/collect/batch", json=[ROW]).status_code == 503
+    finally:
+        if process.is_alive():
+            process.kill()
+            process.join()
+    with duckdb.connect(settings["DUCKDB_FILE"]) as db:
+        assert db.execute("SELECT count(*) FROM agrawal").fetchone() == (3,)
@@ -1,33 +1,281 @@
-from typing import Dict, List
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, Union
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from prometheus_fastapi_instrumentator import Instrumentator
+from pydantic import BaseModel, ValidationError
 
 from . import contracts
-from .lib.storage import Storage
+from .lib import codec, metrics
+from .lib.storage import ACK_DURABLE, BufferFull, Storage
+
+
+class CodecRequest(Request):
+    """Parses JSON request bodies with the fastest codec that is installed."""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = codec.loads(await self.body())
+        return self._json
+
+
+class CodecRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        table = self.path.strip("/").split("/")[0]
+
+        async def codec_route_handler(request: Request):
+            request = CodecRequest(request.scope, request.receive)
+            # FastAPI reads and validates the body before calling the endpoint,
+            # which can tell how long that took from here
+            request.state.received = time.perf_counter()
+            try:
+                return await handler(request)
+            except RequestValidationError as e:
+                if any(error["loc"][0] == "body" for error in e.errors()):
+                    metrics.VALIDATION_ERRORS.labels(table).inc()
+                raise
+
+        return codec_route_handler
+
 
 # The FastAPI app instance
 app = FastAPI()
+app.router.route_class = CodecRoute
+Instrumentator().instrument(app).expose(app, include_in_schema=False)
+
+# Content types for newline-delimited JSON batch bodies; anything else is parsed
+# as a single JSON array.
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson")
+
+# How long clients should back off for when the ingest buffer is full
+RETRY_AFTER_S = os.getenv("RETRY_AFTER_S", "1")
+
+# When set, persist the request bytes we validated instead of re-serializing the
+# parsed model; only a missing server-side timestamp_micros gets added.
+RAW_INGEST = os.getenv("RAW_INGEST", "") not in ("", "0", "false")
+
+
+def _to_record(
+    event: contracts.Common, raw: Optional[bytes] = None, columnar: bool = False
+) -> Union[str, Dict]:
+    """Returns what to persist for a validated event and its original bytes.
+
+    Columnar storage takes the event as a dict, which saves it parsing JSON.
+    """
+    if columnar:
+        return event.dict()
+    if not RAW_INGEST or raw is None:
+        return event.json()
+    record = raw.decode()
+    if "timestamp_micros" not in event.__fields_set__:
+        record = codec.prepend_fields(
+            record, f'"timestamp_micros":{event.timestamp_micros}'
+        )
+    return record
+
+
+async def _persist(table: str, records: List[Union[str, Dict]]):
+    """Hands validated records to storage without blocking the event loop.
+
+    With group commit, the default, the records go straight into the table's
+    bounded buffer, and a full buffer turns into a 503 the client can retry. With
+    `GROUP_COMMIT=off`, each write is committed on the threadpool instead, with
+    nothing to bound how many wait there.
+    """
+    storage = Storage.get()
+    if not storage.writers:
+        await run_in_threadpool(storage.write_many, table, records)
+        return
+    try:
+        fut = storage.submit(table, records)
+    except BufferFull as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": RETRY_AFTER_S}
+        )
+    if storage.ack == ACK_DURABLE:
+        await asyncio.wrap_future(fut)
+
+
+def _observe_validation(table: str, request: Request):
+    metrics.VALIDATION_SECONDS.labels(table).observe(
+        time.perf_counter() - request.state.received
+    )
 
 
 @app.post("/searches")
-def log_search_event(body: contracts.SearchEvent):
+async def log_search_event(body: contracts.SearchEvent, request: Request):
     """Validates and persists a search log record to permanent storage."""
-    Storage.get().write("searches", body.json())
+    _observe_validation("searches", request)
+    record = _to_record(body, await request.body(), Storage.get().columnar)
+    await _persist("searches", [record])
     return {"ok": True}
 
 
 @app.post("/clicks")
-def log_click_event(body: contracts.ClickEvent):
+async def log_click_event(body: contracts.ClickEvent, request: Request):
     """Validates and persists a click log record to permanent storage."""
-    Storage.get().write("clicks", body.json())
+    _observe_validation("clicks", request)
+    record = _to_record(body, await request.body(), Storage.get().columnar)
+    await _persist("clicks", [record])
     return {"ok": True}
 
 
+def _batch_openapi(model: Type[BaseModel]) -> Dict:
+    """Documents the JSON array/NDJSON request body of a batch endpoint."""
+    ref = {"$ref": f"#/components/schemas/{model.__name__}"}
+    return {
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": ref}},
+                NDJSON_CONTENT_TYPES[0]: {"schema": ref},
+            },
+            "required": True,
+        }
+    }
+
+
+async def _batch_items(request: Request):
+    """Yields the items of a JSON array or NDJSON request body one at a time.
+
+    NDJSON bodies are split into lines as they stream in and each line is yielded
+    as raw bytes for the caller to parse, so one bad line doesn't sink the batch.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in NDJSON_CONTENT_TYPES:
+        buf = b""
+        async for chunk in request.stream():
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buf.strip():
+            yield buf
+        return
+
+    try:
+        items = codec.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+    for item in items:
+        yield item
+
+
+async def _log_batch(table: str, model: Type[BaseModel], request: Request):
+    """Validates each event in the batch and persists the good ones together."""
+    records, errors = [], []
+    index = 0
+    columnar = Storage.get().columnar
+    async for item in _batch_items(request):
+        try:
+            raw = None
+            if isinstance(item, bytes):
+                raw, item = item, codec.loads(item)
+            elif RAW_INGEST:
+                # array items have no bytes of their own, so re-encode the parsed
+                # dict rather than the model
+                raw = codec.dumps(item).encode()
+            records.append(_to_record(model.parse_obj(item), raw, columnar))
+        except ValidationError as e:
+            errors.append({"index": index, "detail": e.errors()})
+        except ValueError as e:
+            errors.append(
+                {
+                    "index": index,
+                    "detail": [{"msg": str(e), "type": "value_error.jsondecode"}],
+                }
+            )
+        index += 1
+    _observe_validation(table, request)
+    if errors:
+        metrics.VALIDATION_ERRORS.labels(table).inc(len(errors))
+    if records:
+        await _persist(table, records)
+    return {"ok": not errors, "written": len(records), "errors": errors}
+
+
+@app.post("/searches/batch", openapi_extra=_batch_openapi(contracts.SearchEvent))
+async def log_search_events(request: Request):
+    """Validates a batch of search log records and persists the valid ones."""
+    return await _log_batch("searches", contracts.SearchEvent, request)
+
+
+@app.post("/clicks/batch", openapi_extra=_batch_openapi(contracts.ClickEvent))
+async def log_click_events(request: Request):
+    """Validates a batch of click log records and persists the valid ones."""
+    return await _log_batch("clicks", contracts.ClickEvent, request)
+
+
+def _stream_rows(rows: Iterator[Tuple[int, int, str]]) -> Iterator[str]:
+    """Streams stored records out as a JSON array without re-parsing them."""
+    yield "["
+    for i, (rowid, ts, data) in enumerate(rows):
+        if i:
+            yield ","
+        yield codec.prepend_fields(data, f'"__ts":{ts},"__cursor":"{ts}:{rowid}"')
+    yield "]"
+
+
 @app.get("/fetch", response_model=List[Dict])
-def fetch(table: str, limit: int = 10):
-    """Retrieves recently logged entries from the storage engine, useful for debugging."""
-    ret = Storage.get().fetch(table, limit)
-    return ret
+def fetch(
+    table: str,
+    limit: int = 10,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    cursor: Optional[str] = None,
+    query_id: Optional[str] = None,
+    user_id: Optional[int] = None,
+):
+    """Retrieves recently logged entries from the storage engine, useful for debugging.
+
+    Entries come back newest first, optionally limited to the `[since, until)` range
+    of `__ts` values and filtered by query or user id. To get the next page, pass the
+    `__cursor` of the last entry of the previous page as `cursor`.
+    """
+    storage = Storage.get()
+    if table not in storage.tables:
+        raise HTTPException(status_code=404, detail=f"Unknown table {table}")
+    before = None
+    if cursor:
+        try:
+            ts, rowid = cursor.split(":")
+            before = (int(ts), int(rowid))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor}")
+    filters = {"query_id": query_id, "user_id": user_id}
+    try:
+        rows = storage.scan(
+            table,
+            limit,
+            since=since,
+            until=until,
+            before=before,
+            filters={k: v for k, v in filters.items() if v is not None},
+        )
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return StreamingResponse(_stream_rows(rows), media_type="application/json")
+
+
+@app.get("/stats")
+def stats():
+    """Reports the depth and rejected row counts of each table's ingest buffer."""
+    return Storage.get().stats()
+
+
+@app.on_event("shutdown")
+def close_storage():
+    """Writes out everything storage is holding, which has already been acknowledged."""
+    Storage.close_instance()
 
 
 @app.get("/")
@@ -0,0 +1,205 @@
+import argparse
+import os
+import pathlib
+import re
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.etl import (
+    ETLSettings,
+    _database,
+    _swap,
+    add_settings_arguments,
+    read_watermarks,
+)
+
+# The parts the ETL writes are named after their source database and first rowid
+ETL_PART = re.compile(r"^part-(.+)-(\d{12})-\d+\.parquet$")
+
+
+def _partitions(table_dir: pathlib.Path) -> List[pathlib.Path]:
+    """Finds the directories under the table's that hold Parquet files."""
+    partitions = []
+    for root, dirs, files in os.walk(table_dir):
+        # skip _schemas, _staging and leftover .old directories
+        dirs[:] = sorted(d for d in dirs if not d.startswith(("_", ".")))
+        if any(f.endswith(".parquet") for f in files):
+            partitions.append(pathlib.Path(root))
+    return partitions
+
+
+def _committed(part: pathlib.Path, watermarks: Dict[str, int]) -> bool:
+    """Whether an incremental ETL run could still rewrite the part.
+
+    Parts are published before their source's watermark moves past them, and a run
+    that died in between redoes the export by overwriting the parts by name, so
+    merging them away before then would duplicate their rows.
+    """
+    match = ETL_PART.match(part.name)
+    if not watermarks or not match:
+        return True
+    stem, first = match.group(1), int(match.group(2))
+    marks = [m for name, m in watermarks.items() if pathlib.Path(name).stem == stem]
+    return bool(marks) and marks[0] >= first
+
+
+def _versions(ddb, parts: List[pathlib.Path]) -> Dict[pathlib.Path, Optional[str]]:
+    files = ", ".join(f"'{p}'" for p in parts)
+    versions = {p: None for p in parts}
+    for name, version in ddb.execute(
+        f"""
+        SELECT file_name, decode(value) FROM parquet_kv_metadata([{files}])
+        WHERE decode(key) = 'schema_version'
+    """
+    ).fetchall():
+        versions[pathlib.Path(name)] = version
+    return versions
+
+
+def _merge(
+    ddb,
+    parts: List[pathlib.Path],
+    version: Optional[str],
+    output_dir: pathlib.Path,
+    prefix: str,
+    target_bytes: int,
+    sort_by: Optional[str],
+    settings: ETLSettings,
+):
+    """Rewrites the parts as files of about `target_bytes` each in `output_dir`."""
+    files = ", ".join(f"'{p}'" for p in parts)
+    # the partition columns are in the path, not the files, and must stay that way
+    select = (
+        f"SELECT * FROM read_parquet([{files}], hive_partitioning=false, "
+        "union_by_name=true)"
+    )
+    if sort_by:
+        select += f" ORDER BY {sort_by}"
+    options = settings.parquet_options() + [
+        f"FILE_SIZE_BYTES {target_bytes}",
+        f"FILENAME_PATTERN '{prefix}-{{i}}'",
+    ]
+    if version:
+        options.append(f"KV_METADATA {{schema_version: '{version}'}}")
+    ddb.execute(f"COPY ({select}) TO '{output_dir}' ({', '.join(options)})")
+
+
+def compact_partition(
+    partition: pathlib.Path,
+    staging: pathlib.Path,
+    target_bytes: int,
+    sort_by: Optional[str] = None,
+    watermarks: Optional[Dict[str, int]] = None,
+    settings: ETLSettings = ETLSettings(),
+) -> Tuple[int, int]:
+    """Merges the partition's small files, returning its file counts before and after.
+
+    Files smaller than `target_bytes` that were written with the same schema
+    version are rewritten together, sorted by `sort_by` if given, into files of
+    about `target_bytes`. The new partition directory is built in `staging` (the
+    files that are kept are hard linked into it) and then swapped in whole.
+    """
+    parts = sorted(partition.glob("*.parquet"))
+    small = [
+        p
+        for p in parts
+        if p.stat().st_size < target_bytes and _committed(p, watermarks or {})
+    ]
+    if len(small) < 2:
+        return len(parts), len(parts)
+
+    ddb = _database(settings).cursor()
+    try:
+        groups: Dict[Optional[str], List[pathlib.Path]] = {}
+        for part, version in _versions(ddb, small).items():
+            groups.setdefault(version, []).append(part)
+        merged, stamp = set(), int(time.time() * 1e6)
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        for version, group in groups.items():
+            if len(group) < 2:
+                continue
+            prefix = f"part-compacted-{stamp}-{len(merged)}"
+            output = staging.parent / f"{staging.name}.{prefix}"
+            _merge(ddb, group, version, output, prefix, target_bytes, sort_by, settings)
+            for new in output.iterdir():
+                os.replace(new, staging / new.name)
+            output.rmdir()
+            merged.update(group)
+    finally:
+        ddb.close()
+    if not merged:
+        shutil.rmtree(staging)
+        return len(parts), len(parts)
+
+    for part in parts:
+        if part not in merged:
+            os.link(part, staging / part.name)
+    old = _swap(staging, partition)
+    # Parts published into the partition after we listed it (or rewritten by an
+    # ETL redo) are still in the old directory; move them over too.
+    merged_names = {p.name for p in merged}
+    for part in old.glob("*.parquet"):
+        if part.name not in merged_names:
+            os.replace(part, partition / part.name)
+    shutil.rmtree(old)
+    return len(parts), len(list(partition.glob("*.parquet")))
+
+
+def compact(
+    table_dir: pathlib.Path,
+    target_bytes: int = 128 * 1024 * 1024,
+    sort_by: Optional[str] = None,
+    settings: ETLSettings = ETLSettings(),
+) -> Dict[str, Tuple[int, int]]:
+    """Compacts every partition of an exported table.
+
+    Returns the file counts before and after for each partition that changed.
+    Parts an incremental ETL run could still redo are left alone; a full export
+    can't tell its old parts from compacted ones, so it should go to a fresh
+    directory rather than over a compacted table.
+    """
+    watermarks = read_watermarks(table_dir)
+    staging_dir = table_dir.parent / "_staging" / f"compact-{table_dir.name}"
+    changed = {}
+    for partition in _partitions(table_dir):
+        relative = partition.relative_to(table_dir)
+        before, after = compact_partition(
+            partition,
+            staging_dir / relative,
+            target_bytes,
+            sort_by,
+            watermarks,
+            settings,
+        )
+        if before != after:
+            changed[str(relative)] = (before, after)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return changed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge an exported table's small Parquet files"
+    )
+    parser.add_argument(
+        "table_dir", type=pathlib.Path, help="the table's directory, e.g. ./searches"
+    )
+    parser.add_argument(
+        "--target-mb", type=int, default=128, help="size of the compacted files"
+    )
+    parser.add_argument(
+        "--sort-by",
+        help="column to sort the compacted rows by, e.g. query_id or timestamp_micros",
+    )
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    changed = compact(
+        args.table_dir,
+        args.target_mb * 1024 * 1024,
+        args.sort_by,
+        ETLSettings.from_args(args),
+    )
+    for partition, (before, after) in changed.items():
+        print(f"compacted {partition}: {before} files -> {after}")
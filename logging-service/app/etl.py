@@ -1,11 +1,110 @@
+import argparse
+import concurrent.futures
+import contextlib
+import ctypes
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
 import os
 import pathlib
-import sys
-from typing import List
+import shutil
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 import duckdb
+import prometheus_client
 
-from app.lib.jsonschema import AppDefs, StructType, ArrayType
+from app.lib.jsonschema import (
+    AppDefs,
+    StructType,
+    ArrayType,
+    column_type,
+    record_schema,
+    schema_version,
+)
+from app.lib import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-table record of the last SQLite rowid exported from each source file
+WATERMARKS_FILE = "_watermarks.json"
+
+# Where compiled flattening plans are kept between runs. The plans hold SQL that the
+# ETL runs as is, so the directory must be private to the user running it.
+PLAN_CACHE_DIR = pathlib.Path(
+    os.getenv(
+        "ETL_PLAN_CACHE",
+        os.path.join(
+            os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+            "logging-service",
+            "etl_plans",
+        ),
+    )
+)
+
+# Part of every plan's cache key; bump it whenever _compile changes what it emits
+PLAN_FORMAT_VERSION = 1
+
+
+class ETLSettings(NamedTuple):
+    """DuckDB resource limits and Parquet writer options for an ETL run.
+
+    Anything left unset falls back to DuckDB's defaults. The resource limits apply
+    to each ETL process, so a pool of workers uses up to `workers` times as much.
+    """
+
+    # e.g. "4GB"; past this, DuckDB spills to the temp directory
+    memory_limit: Optional[str] = None
+    threads: Optional[int] = None
+    temp_directory: Optional[str] = None
+    row_group_size: Optional[int] = None
+    # snappy, zstd, gzip or uncompressed
+    compression: Optional[str] = None
+
+    def duckdb_config(self) -> Dict[str, str]:
+        config = {}
+        if self.memory_limit:
+            config["memory_limit"] = self.memory_limit
+        if self.threads:
+            config["threads"] = str(self.threads)
+        if self.temp_directory:
+            config["temp_directory"] = str(self.temp_directory)
+        return config
+
+    def parquet_options(self) -> List[str]:
+        options = ["FORMAT PARQUET"]
+        if self.row_group_size:
+            options.append(f"ROW_GROUP_SIZE {self.row_group_size}")
+        if self.compression:
+            options.append(f"COMPRESSION {self.compression}")
+        return options
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "ETLSettings":
+        """The settings given by the options that `add_settings_arguments` added."""
+        return cls(**{field: getattr(args, field, None) for field in cls._fields})
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser, parquet: bool = True):
+    """Adds the command line options for `ETLSettings` to a script's parser.
+
+    Scripts that don't write Parquet with the settings leave out its options.
+    """
+    parser.add_argument("--memory-limit", help="DuckDB memory limit, e.g. 4GB")
+    parser.add_argument("--threads", type=int, help="DuckDB threads per process")
+    parser.add_argument(
+        "--temp-directory", help="where DuckDB spills data past the memory limit"
+    )
+    if parquet:
+        parser.add_argument("--row-group-size", type=int, help="Parquet rows per group")
+        parser.add_argument(
+            "--compression",
+            choices=["snappy", "zstd", "gzip", "uncompressed"],
+            help="Parquet compression codec",
+        )
 
 
 def _columns_helper(table: str) -> List[str]:
@@ -14,33 +113,97 @@ def _columns_helper(table: str) -> List[str]:
         return f.read().splitlines()
 
 
-def etl(
-    sqlite3_db: pathlib.Path, table: str, app_defs: AppDefs, output_dir: pathlib.Path
-) -> pathlib.Path:
-    """ETLs the data from the SQLite3 database table into a Parquet file using DuckDB."""
+# One DuckDB database per distinct config for the life of the process, so that the
+# extensions are only loaded once; every ETL run gets its own cursor on it.
+_databases: Dict[Tuple, duckdb.DuckDBPyConnection] = {}
+_attached = itertools.count()
 
-    # Open DuckDB, load the extensions we need and attach the SQLite3 database
-    ddb = duckdb.connect(":memory:")  # TODO: fix me
-    for ext in ("sqlite_scanner", "json", "parquet"):
-        ddb.install_extension(ext)
-        ddb.load_extension(ext)
-    ddb.execute(f"CALL sqlite_attach('{sqlite3_db}')")
 
-    # Get the DuckDB structure of the table from the app defs and define
-    # a view for parsing the raw text into DuckDB JSON
-    structure = app_defs.to_structure(app_defs.get_schema_name(table))
-    ddb.execute(
-        f"""
-        CREATE VIEW {table}_parsed AS
-        SELECT from_json(data, '{structure.to_json()}') AS d
-        FROM {table}
+def _database(settings: ETLSettings) -> duckdb.DuckDBPyConnection:
+    config = settings.duckdb_config()
+    key = tuple(sorted(config.items()))
+    if key not in _databases:
+        ddb = duckdb.connect(":memory:", config=config)
+        for ext in ("sqlite_scanner", "json", "parquet"):
+            try:
+                ddb.load_extension(ext)
+            except duckdb.Error:
+                ddb.install_extension(ext)
+                ddb.load_extension(ext)
+        _databases[key] = ddb
+    return _databases[key]
+
+
+@contextlib.contextmanager
+def _connect(
+    sqlite3_db: pathlib.Path, settings: ETLSettings
+) -> Iterator[duckdb.DuckDBPyConnection]:
+    """Yields a DuckDB cursor with the SQLite3 database attached as its default.
+
+    Unqualified table names resolve to the SQLite3 tables, and anything the cursor
+    creates should be TEMP so that it goes away with the cursor.
     """
-    )
+    alias = f"src_{next(_attached)}"
+    ddb = _database(settings).cursor()
+    ddb.execute(f"ATTACH '{sqlite3_db}' AS {alias} (TYPE sqlite, READ_ONLY)")
+    ddb.execute(f"USE {alias}")
+    try:
+        yield ddb
+    finally:
+        ddb.execute("USE memory")
+        ddb.execute(f"DETACH {alias}")
+        ddb.close()
+
+
+class FlattenPlan(NamedTuple):
+    """The compiled SQL for flattening a table's JSON records into columns."""
+
+    # The DuckDB structure for from_json
+    structure: str
+    # TEMP macros the SELECT list relies on
+    macros: List[str]
+    # The SELECT list over the parsed records
+    select: List[str]
+    # The DuckDB type of each output column, and the schema version they make up
+    types: Dict[str, str]
+    version: str
+
+
+_plans: Dict[str, FlattenPlan] = {}
+
 
-    # Generates the SELECT statement we need to extract the flattened data
-    # from the parsed JSON view
-    select = []
-    for col in _columns_helper(table):
+def _plan_key(table: str, app_defs: AppDefs, columns: List[str]) -> str:
+    """Hashes the plan format, the table's schema, the schemas it refers to and its
+    column list."""
+    names, todo = set(), [app_defs.get_schema_name(table)]
+    while todo:
+        name = todo.pop()
+        if name not in names:
+            names.add(name)
+            todo.extend(app_defs.schema_deps.get(name, ()))
+    spec = {
+        "format": PLAN_FORMAT_VERSION,
+        "schema": app_defs.get_schema_name(table),
+        "schemas": {name: app_defs.schemas[name] for name in names},
+        "columns": columns,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def _compile(table: str, app_defs: AppDefs, columns: List[str]) -> FlattenPlan:
+    # Get the DuckDB structure of the table from the app defs
+    structure = app_defs.to_structure(app_defs.get_schema_name(table))
+
+    # Generates the SELECT list we need to extract the flattened data
+    # from the parsed JSON
+    select, macros, types = [], [], {}
+    for col in columns:
+        types[col] = column_type(structure, col)
+        if types[col] is None:
+            # The field was dropped from the schema; the parts exported before
+            # then keep the column, and later ones read it back as NULL.
+            del types[col]
+            continue
         if col in structure.fields:
             # simple top-level field
             select.append(f"d.{col} as {col}")
@@ -55,36 +218,406 @@ def etl(
                 elif isinstance(ddbt, ArrayType):
                     # hack to get around https://github.com/duckdb/duckdb/issues/5005
                     macro_name = f"extract_{col}_{i}(x)"
-                    macro = f"CREATE MACRO {macro_name} AS x.{pieces[i]}"
-                    ddb.execute(macro)
+                    macros.append(f"CREATE TEMP MACRO {macro_name} AS x.{pieces[i]}")
                     expr = f"list_transform({expr}, x -> {macro_name})"
                     ddbt = ddbt.element_type
                 else:
                     expr += f".{pieces[i]}"
                     ddbt = None
             select.append(f"{expr} as {col}")
+    return FlattenPlan(
+        structure.to_json(), macros, select, types, schema_version(types)
+    )
+
 
-    # Write the flattened JSON data out to a Parquet file
-    output_file = output_dir / f"{table}.parquet"
-    ddb.execute(
-        f"COPY (SELECT {', '.join(select)} FROM {table}_parsed) TO '{output_file}'"
+def flatten_plan(table: str, app_defs: AppDefs) -> FlattenPlan:
+    """Returns the flattening plan for the table, compiling it only if we must.
+
+    Plans are keyed by a hash of the table's schema and column list, so tables
+    with the same definitions share one, and an edit to either gets a new plan.
+    They are cached in memory and as JSON files in `PLAN_CACHE_DIR`, as long as that
+    directory is private to the current user.
+    """
+    columns = _columns_helper(table)
+    key = _plan_key(table, app_defs, columns)
+    if key in _plans:
+        return _plans[key]
+    cache_dir = _plan_cache_dir()
+    try:
+        if cache_dir is None:
+            raise FileNotFoundError("no private plan cache")
+        with open(cache_dir / f"{key}.json") as f:
+            plan = FlattenPlan(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        plan = _compile(table, app_defs, columns)
+        if cache_dir is not None:
+            try:
+                tmp = cache_dir / f"{key}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(plan._asdict(), f)
+                os.replace(tmp, cache_dir / f"{key}.json")
+            except OSError:
+                pass  # the cache is only an optimization
+    _plans[key] = plan
+    return plan
+
+
+def _plan_cache_dir() -> Optional[pathlib.Path]:
+    """Returns the plan cache directory, or None if it isn't safe to use.
+
+    The directory is created private to the current user. One that is owned by
+    anyone else, or that others can write to, is ignored rather than trusted,
+    since whoever can write a plan there can run SQL in the ETL.
+    """
+    try:
+        PLAN_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        st = PLAN_CACHE_DIR.stat()
+    except OSError:
+        return None
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        logger.warning(
+            "Not using the plan cache %s, which isn't private", PLAN_CACHE_DIR
+        )
+        return None
+    return PLAN_CACHE_DIR
+
+
+def _flatten(
+    ddb: duckdb.DuckDBPyConnection,
+    table: str,
+    plan: FlattenPlan,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> str:
+    """Returns a SELECT over the table's rows that flattens the JSON into columns.
+
+    Only the rows with rowids in `(start, end]` are read. DuckDB doesn't push a
+    rowid filter down into its scan of a SQLite table, so past the first rows
+    the range is looked up by SQLite itself, which reads only the new rows
+    rather than the whole table. A scan from the start stays a DuckDB scan,
+    which can run in parallel.
+    """
+    if start:
+        [db] = ddb.execute("SELECT current_database()").fetchone()
+        rows = (
+            f"SELECT rowid AS _rowid, data FROM {table} "
+            f"WHERE rowid > {start} AND rowid <= {end}"
+        )
+        source = (
+            f"SELECT CAST(_rowid AS BIGINT) AS _rowid, data "
+            f"FROM sqlite_query('{db}', '{rows}')"
+        )
+    else:
+        source = f"SELECT rowid AS _rowid, data FROM {table}"
+        if end is not None:
+            source += f" WHERE rowid <= {end}"
+    statements = plan.macros + [
+        f"""
+        CREATE TEMP VIEW {table}_parsed AS
+        SELECT _rowid, from_json(data, '{plan.structure}') AS d
+        FROM ({source})
+    """
+    ]
+    ddb.execute(";".join(statements))
+    return f"SELECT {', '.join(plan.select)} FROM {table}_parsed"
+
+
+def _parquet_options(settings: ETLSettings, plan: FlattenPlan) -> List[str]:
+    # Stamp every file with the schema version it was written with
+    return settings.parquet_options() + [
+        f"KV_METADATA {{schema_version: '{plan.version}'}}"
+    ]
+
+
+def scan_table(table_dir: pathlib.Path) -> str:
+    """Returns a `read_parquet` call over all of an exported table's parts.
+
+    Parts written under different schema versions are unioned by column name, and
+    columns that a part predates read as NULL, so no part ever has to be rewritten.
+    """
+    return (
+        f"read_parquet('{table_dir}/**/*.parquet', "
+        "hive_partitioning=true, union_by_name=true)"
     )
-    ddb.close()
+
+
+def etl(
+    sqlite3_db: pathlib.Path,
+    table: str,
+    app_defs: AppDefs,
+    output_dir: pathlib.Path,
+    settings: ETLSettings = ETLSettings(),
+) -> pathlib.Path:
+    """ETLs the data from the SQLite3 database table into a Parquet file using DuckDB."""
+    start = time.perf_counter()
+    plan = flatten_plan(table, app_defs)
+    with _connect(sqlite3_db, settings) as ddb:
+        select = _flatten(ddb, table, plan)
+
+        # Write the flattened JSON data out to a Parquet file
+        output_file = output_dir / f"{table}.parquet"
+        options = ", ".join(_parquet_options(settings, plan))
+        rows = ddb.execute(f"COPY ({select}) TO '{output_file}' ({options})")
+        metrics.observe_etl(table, rows.fetchone()[0], time.perf_counter() - start)
     return output_file
 
 
-if __name__ == "__main__":
+def _fsync(path: pathlib.Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _publish(tmp: pathlib.Path, path: pathlib.Path):
+    """Durably moves a fully written temp file into place."""
+    _fsync(tmp)
+    os.replace(tmp, path)
+    _fsync(path.parent)
+
+
+# renameat2(2) flag for swapping two paths in one step (Linux 3.15+)
+_RENAME_EXCHANGE = 2
+_AT_FDCWD = -100
+
+
+def _exchange(a: pathlib.Path, b: pathlib.Path) -> bool:
+    """Atomically swaps two paths, if the platform and filesystem support it."""
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    return (
+        renameat2(
+            _AT_FDCWD, os.fsencode(a), _AT_FDCWD, os.fsencode(b), _RENAME_EXCHANGE
+        )
+        == 0
+    )
+
+
+def _swap(staged: pathlib.Path, target: pathlib.Path) -> Optional[pathlib.Path]:
+    """Replaces the target directory with the staged one.
+
+    Where the two directories can be exchanged in one step, readers of the target
+    see either all of its old files or all of the new ones; elsewhere, it is
+    briefly missing. Returns where the old files were left (for the caller to
+    remove), or None if there was no target.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if not target.exists():
+        staged.rename(target)
+        return None
+    if _exchange(staged, target):
+        return staged
+    old = target.parent / f".{target.name}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    target.rename(old)
+    staged.rename(target)
+    return old
+
 
-    if len(sys.argv) < 4:
-        print("Usage: python etl.py <sqlite3_db> <table> <output_dir>")
-        sys.exit(1)
+def read_watermarks(table_dir: pathlib.Path) -> Dict[str, int]:
+    path = table_dir / WATERMARKS_FILE
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
 
-    sqldb, table, output_dir = (
-        pathlib.Path(sys.argv[1]),
-        sys.argv[2],
-        pathlib.Path(sys.argv[3]),
+
+def _export_partitions(
+    sqlite3_db: pathlib.Path,
+    table: str,
+    app_defs: AppDefs,
+    table_dir: pathlib.Path,
+    start: int = 0,
+    settings: ETLSettings = ETLSettings(),
+) -> Tuple[Optional[int], List[pathlib.Path]]:
+    """Exports the rows after rowid `start` as Hive-partitioned Parquet part files.
+
+    Rows are partitioned by the `date` and `hour` of their timestamp_micros, so
+    that readers can prune partitions, into `table_dir/date=.../hour=.../`. The
+    parts are named after the source database and the first rowid they hold,
+    which makes re-running an export overwrite its own earlier output. Returns the
+    last rowid exported (None if there was nothing new) and the part files.
+    """
+    with _connect(sqlite3_db, settings) as ddb:
+        end = ddb.execute(f"SELECT max(rowid) FROM {table}").fetchone()[0]
+        if end is None or end <= start:
+            return None, []
+        plan = flatten_plan(table, app_defs)
+        select = _flatten(ddb, table, plan, start, end)
+        prefix = f"part-{pathlib.Path(sqlite3_db).stem}-{start + 1:012d}"
+
+        # Stage the partitions outside of the table's directory, then move the
+        # files into place one by one; readers never see a partially written file.
+        staging = table_dir.parent / "_staging" / table_dir.name / prefix
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.parent.mkdir(parents=True, exist_ok=True)
+        options = _parquet_options(settings, plan) + [
+            "PARTITION_BY (date, hour)",
+            f"FILENAME_PATTERN '{prefix}-{{i}}'",
+        ]
+        ddb.execute(
+            f"""
+            COPY (
+                SELECT *,
+                    strftime(make_timestamp(timestamp_micros), '%Y-%m-%d') AS date,
+                    hour(make_timestamp(timestamp_micros)) AS hour
+                FROM ({select})
+            ) TO '{staging}' ({", ".join(options)})
+        """
+        )
+    parts = []
+    for staged in sorted(staging.glob("*/*/*.parquet")):
+        part = table_dir / staged.relative_to(staging)
+        part.parent.mkdir(parents=True, exist_ok=True)
+        _publish(staged, part)
+        parts.append(part)
+    shutil.rmtree(staging)
+    return end, parts
+
+
+def _save_watermarks(table_dir: pathlib.Path, watermarks: Dict[str, int]):
+    tmp = table_dir / f"{WATERMARKS_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(watermarks, f)
+    _publish(tmp, table_dir / WATERMARKS_FILE)
+
+
+def etl_incremental(
+    sqlite3_db: pathlib.Path,
+    table: str,
+    app_defs: AppDefs,
+    output_dir: pathlib.Path,
+    settings: ETLSettings = ETLSettings(),
+) -> List[pathlib.Path]:
+    """ETLs the table's rows added since the last run into new Parquet part files.
+
+    Parts are written to `output_dir/table/`, next to a watermarks file recording the
+    last rowid exported from each source database. The watermark only moves once
+    the parts are durably in place, and parts are named after the first rowid they
+    hold, so a run that dies in between is redone by overwriting the same parts
+    rather than duplicating their rows. Returns the new part files.
+    """
+    return etl_many(
+        [sqlite3_db], table, app_defs, output_dir, incremental=True, settings=settings
+    )
+
+
+def _resolve_sources(spec: str, table: str) -> List[pathlib.Path]:
+    """Expands a SQLite file, a directory of segments or a glob into source files."""
+    path = pathlib.Path(spec)
+    if path.is_dir():
+        return sorted(path.glob(f"logging_service_{table}_*.db"))
+    if glob.has_magic(spec):
+        return sorted(pathlib.Path(p) for p in glob.glob(spec))
+    return [path]
+
+
+def etl_many(
+    sources: List[pathlib.Path],
+    table: str,
+    app_defs: AppDefs,
+    output_dir: pathlib.Path,
+    incremental: bool = False,
+    workers: Optional[int] = None,
+    settings: ETLSettings = ETLSettings(),
+) -> List[pathlib.Path]:
+    """ETLs the table from many SQLite segments in parallel into partitioned Parquet.
+
+    Each source is exported by its own process in a pool of `workers` processes,
+    into Hive partitions under `output_dir/table/`. When `incremental` is set, only
+    rows past each source's watermark are exported and the watermarks are advanced
+    (by this process alone) as each source finishes. Unless `settings` says
+    otherwise, the CPUs are split evenly between the workers' DuckDB threads.
+    The columns of the schema version the parts are written with are recorded
+    in `output_dir/table/_schemas/`. Returns the new part files.
+    """
+    started = time.perf_counter()
+    table_dir = output_dir / table
+    table_dir.mkdir(parents=True, exist_ok=True)
+    record_schema(table_dir, flatten_plan(table, app_defs).types)
+    watermarks = read_watermarks(table_dir) if incremental else {}
+    parallel = len(sources) > 1 and workers != 1
+    if parallel and not settings.threads:
+        cpus = os.cpu_count() or 1
+        procs = min(workers or cpus, len(sources))
+        settings = settings._replace(threads=max(1, cpus // procs))
+    exports = [
+        (source, table, app_defs, table_dir, watermarks.get(source.name, 0), settings)
+        for source in sources
+    ]
+    starts = {source: start for source, _, _, _, start, _ in exports}
+    parts, rows = [], 0
+
+    def finished(source: pathlib.Path, end: Optional[int], new_parts):
+        nonlocal rows
+        parts.extend(new_parts)
+        if end is not None:
+            # segments are append-only, so their rowids have no gaps
+            rows += end - starts[source]
+        if incremental and end is not None:
+            watermarks[source.name] = end
+            _save_watermarks(table_dir, watermarks)
+
+    if parallel:
+        # the workers must not inherit this process's DuckDB databases
+        ctx = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+            futures = {pool.submit(_export_partitions, *e): e[0] for e in exports}
+            for fut in concurrent.futures.as_completed(futures):
+                finished(futures[fut], *fut.result())
+    else:
+        for e in exports:
+            finished(e[0], *_export_partitions(*e))
+    metrics.observe_etl(table, rows, time.perf_counter() - started)
+    return sorted(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ETL a logged table into Parquet")
+    parser.add_argument(
+        "sources",
+        nargs="+",
+        help="SQLite files, directories of segment files or globs to read from",
+    )
+    parser.add_argument("table")
+    parser.add_argument("output_dir", type=pathlib.Path)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only export rows added since the last incremental run",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="number of sources to ETL in parallel"
+    )
+    add_settings_arguments(parser)
+    parser.add_argument(
+        "--metrics-file",
+        help="write Prometheus metrics here, for the node exporter's textfile collector",
     )
+    args = parser.parse_args()
+    settings = ETLSettings.from_args(args)
     app_defs = AppDefs.get_current()
+    sources = [p for spec in args.sources for p in _resolve_sources(spec, args.table)]
 
-    # ETL the data
-    etl(sqlite3_db=sqldb, table=table, app_defs=app_defs, output_dir=output_dir)
+    # ETL the data: a single database goes to a single Parquet file, anything
+    # more to Hive-partitioned part files
+    single = len(args.sources) == 1 and pathlib.Path(args.sources[0]).is_file()
+    if single and not args.incremental:
+        etl(sources[0], args.table, app_defs, args.output_dir, settings)
+    else:
+        etl_many(
+            sources,
+            args.table,
+            app_defs,
+            args.output_dir,
+            incremental=args.incremental,
+            workers=args.workers,
+            settings=settings,
+        )
+    if args.metrics_file:
+        prometheus_client.write_to_textfile(
+            args.metrics_file, prometheus_client.REGISTRY
+        )
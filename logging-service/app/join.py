@@ -0,0 +1,182 @@
+import argparse
+import datetime
+import hashlib
+import json
+import pathlib
+import shutil
+from typing import Dict, List
+
+from app.etl import ETLSettings, _database, _publish, _swap, add_settings_arguments
+
+# Per-day fingerprints of the inputs each day of labeled rows was built from
+INPUTS_FILE = "_inputs.json"
+
+
+def _date_dirs(table_dir: pathlib.Path) -> Dict[str, pathlib.Path]:
+    return {d.name.split("=", 1)[1]: d for d in sorted(table_dir.glob("date=*"))}
+
+
+def _parts(date_dir: pathlib.Path) -> List[pathlib.Path]:
+    return sorted(date_dir.glob("*/*.parquet"))
+
+
+def _fingerprint(parts: List[pathlib.Path]) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        stat = part.stat()
+        h.update(f"{part}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def _read_parts(parts: List[pathlib.Path]) -> str:
+    files = ", ".join(f"'{p}'" for p in parts)
+    return f"read_parquet([{files}], hive_partitioning=false, union_by_name=true)"
+
+
+def _join_day(
+    searches: List[pathlib.Path],
+    clicks: List[pathlib.Path],
+    staging: pathlib.Path,
+    buckets: int,
+    settings: ETLSettings,
+):
+    """Writes one day's labeled rows to `staging/bucket=*/`, a bucket at a time.
+
+    Both sides are first hash-partitioned on query_id into bucket files, so each
+    join only has to hold one bucket's worth of searches and clicks in memory.
+    """
+    ddb = _database(settings).cursor()
+    try:
+        bucket = f"hash(query_id) % {buckets} AS bucket"
+        ddb.execute(
+            f"""
+            COPY (
+                SELECT query_id, timestamp_micros, user__id,
+                    results__document_id, results__position, results__score,
+                    {bucket}
+                FROM {_read_parts(searches)}
+            ) TO '{staging / "_searches"}' (FORMAT PARQUET, PARTITION_BY (bucket))
+        """
+        )
+        if clicks:
+            ddb.execute(
+                f"""
+                COPY (
+                    SELECT DISTINCT query_id, document_id, {bucket}
+                    FROM {_read_parts(clicks)}
+                ) TO '{staging / "_clicks"}' (FORMAT PARQUET, PARTITION_BY (bucket))
+            """
+            )
+        for b in range(buckets):
+            searches_part = list((staging / "_searches" / f"bucket={b}").glob("*"))
+            if not searches_part:
+                continue
+            clicks_part = list((staging / "_clicks" / f"bucket={b}").glob("*"))
+            clicked = "false"
+            joins = ""
+            if clicks_part:
+                clicked = "c.query_id IS NOT NULL"
+                joins = f"""
+                    LEFT JOIN {_read_parts(clicks_part)} c
+                    ON r.query_id = c.query_id AND r.document_id = c.document_id
+                """
+            output = staging / f"bucket={b}"
+            output.mkdir()
+            ddb.execute(
+                f"""
+                COPY (
+                    SELECT r.query_id, r.timestamp_micros, r.user__id,
+                        r.document_id, r.position, r.score, {clicked} AS clicked
+                    FROM (
+                        SELECT query_id, timestamp_micros, user__id,
+                            unnest(results__document_id) AS document_id,
+                            unnest(results__position) AS position,
+                            unnest(results__score) AS score
+                        FROM {_read_parts(searches_part)}
+                    ) r {joins}
+                    ORDER BY r.query_id, r.position
+                ) TO '{output / "part-0.parquet"}' (FORMAT PARQUET)
+            """
+            )
+    finally:
+        ddb.close()
+    shutil.rmtree(staging / "_searches")
+    shutil.rmtree(staging / "_clicks", ignore_errors=True)
+
+
+def join(
+    output_dir: pathlib.Path,
+    buckets: int = 16,
+    click_window_days: int = 1,
+    settings: ETLSettings = ETLSettings(),
+) -> List[str]:
+    """Joins the exported searches and clicks into per-result labeled training rows.
+
+    Each search result becomes a (query_id, timestamp_micros, user__id,
+    document_id, position, score, clicked) row, where `clicked` says whether a
+    click on that document was logged for the query on the search's day or in the
+    `click_window_days` after it. Rows go to `output_dir/labeled/date=.../bucket=.../`,
+    hash-partitioned on query_id and sorted by query_id and position.
+
+    A day is only rebuilt when the searches or clicks it depends on changed since
+    it was last built, and its directory is swapped in whole. Returns the days
+    that were (re)built.
+    """
+    labeled_dir = output_dir / "labeled"
+    labeled_dir.mkdir(parents=True, exist_ok=True)
+    inputs_path = labeled_dir / INPUTS_FILE
+    built = json.loads(inputs_path.read_text()) if inputs_path.exists() else {}
+    search_days = _date_dirs(output_dir / "searches")
+    click_days = _date_dirs(output_dir / "clicks")
+
+    rebuilt = []
+    for day, search_dir in search_days.items():
+        start = datetime.date.fromisoformat(day)
+        window = [
+            str(start + datetime.timedelta(days=i))
+            for i in range(click_window_days + 1)
+        ]
+        searches = _parts(search_dir)
+        clicks = [p for d in window if d in click_days for p in _parts(click_days[d])]
+        fingerprint = _fingerprint(searches + clicks)
+        if not searches or built.get(day) == fingerprint:
+            continue
+
+        staging = output_dir / "_staging" / "labeled" / f"date={day}"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        _join_day(searches, clicks, staging, buckets, settings)
+        old = _swap(staging, labeled_dir / f"date={day}")
+        if old:
+            shutil.rmtree(old)
+
+        built[day] = fingerprint
+        tmp = labeled_dir / f"{INPUTS_FILE}.tmp"
+        tmp.write_text(json.dumps(built))
+        _publish(tmp, inputs_path)
+        rebuilt.append(day)
+    return rebuilt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Join exported searches and clicks into labeled training rows"
+    )
+    parser.add_argument(
+        "output_dir", type=pathlib.Path, help="the directory the ETL exported to"
+    )
+    parser.add_argument(
+        "--buckets", type=int, default=16, help="hash partitions per day"
+    )
+    parser.add_argument(
+        "--click-window-days",
+        type=int,
+        default=1,
+        help="how many days after a search to look for its clicks",
+    )
+    # it writes its own Parquet files, so only the resource limits apply
+    add_settings_arguments(parser, parquet=False)
+    args = parser.parse_args()
+    settings = ETLSettings.from_args(args)
+    for day in join(args.output_dir, args.buckets, args.click_window_days, settings):
+        print(f"joined {day}")
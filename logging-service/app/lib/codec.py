@@ -0,0 +1,36 @@
+"""JSON encoding/decoding that uses orjson when it is installed.
+
+orjson is an optional dependency: it parses and serializes several times faster
+than the standard library, but everything works without it.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    if orjson:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def prepend_fields(obj: str, fields: str) -> str:
+    """Splices encoded `"key":value` fields into the front of an encoded JSON object.
+
+    This lets us add a field or two to a stored record without a parse/serialize
+    round trip.
+    """
+    body = obj.lstrip()[1:]
+    sep = "" if body.lstrip().startswith("}") else ","
+    return "{" + fields + sep + body
@@ -1,6 +1,11 @@
+import hashlib
 import json
 import os
-from typing import Dict, List, Optional
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+# Where each exported table directory records the columns of its schema versions
+SCHEMAS_DIR = "_schemas"
 
 
 class DuckDBType:
@@ -37,23 +42,79 @@ class PrimitiveType(DuckDBType):
         return self.name
 
 
+def column_type(structure: StructType, column: str) -> Optional[str]:
+    """Returns the DuckDB type of a flattened `a__b__c` column of the structure.
+
+    Returns None if the structure has no such field, e.g. one that was removed.
+    """
+    ddbt = structure
+    arrays = 0
+    for key in column.split("__"):
+        while isinstance(ddbt, ArrayType):
+            ddbt = ddbt.element_type
+            arrays += 1
+        if not isinstance(ddbt, StructType) or key not in ddbt.fields:
+            return None
+        ddbt = ddbt.fields[key]
+    return str(ddbt) + "[]" * arrays
+
+
+def schema_version(column_types: Dict[str, str]) -> str:
+    """A short, stable identifier for a table's flattened columns and their types."""
+    encoded = json.dumps(column_types, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:12]
+
+
+def record_schema(table_dir: pathlib.Path, column_types: Dict[str, str]) -> str:
+    """Records a schema version's columns under `table_dir` and returns the version."""
+    version = schema_version(column_types)
+    path = pathlib.Path(table_dir) / SCHEMAS_DIR / f"{version}.json"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "columns": column_types}, f, indent=4)
+        os.replace(tmp, path)
+    return version
+
+
 class AppDefs:
+    # The defs last parsed from config/openapi.json, with the (mtime, size) and
+    # content hash of the file they were parsed from
+    _current: Optional[Tuple[Tuple[int, int], str, "AppDefs"]] = None
+
     @classmethod
     def get_current(cls) -> Optional["AppDefs"]:
+        """Returns the defs in config/openapi.json, only re-parsing it if it changed.
+
+        The defs are shared between callers, so treat them as read-only.
+        """
         working_dir = os.path.dirname(os.path.realpath(__file__))
         openapi_path = f"{working_dir}/../config/openapi.json"
-        if os.path.exists(openapi_path):
-            with open(openapi_path) as f:
-                json_schema = json.load(f)
-                return cls.from_json_schema(json_schema)
-        else:
+        try:
+            st = os.stat(openapi_path)
+        except FileNotFoundError:
             return AppDefs({}, {}, {})
+        stamp = (st.st_mtime_ns, st.st_size)
+        if cls._current and cls._current[0] == stamp:
+            return cls._current[2]
+        with open(openapi_path, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if cls._current and cls._current[1] == digest:
+            # touched, but not changed
+            app_defs = cls._current[2]
+        else:
+            app_defs = cls.from_json_schema(json.loads(content))
+        cls._current = (stamp, digest, app_defs)
+        return app_defs
 
     @classmethod
     def save_as_current(cls, json_schema: Dict):
         working_dir = os.path.dirname(os.path.realpath(__file__))
         with open(f"{working_dir}/../config/openapi.json", "w") as f:
             json.dump(json_schema, f, indent=4)
+        cls._current = None
 
     @classmethod
     def from_json_schema(cls, json_schema: Dict) -> "AppDefs":
@@ -61,11 +122,18 @@ class AppDefs:
         for path, path_item in json_schema["paths"].items():
             for method, method_item in path_item.items():
                 if method.lower() == "post":
+                    schema = (
+                        method_item.get("requestBody", {})
+                        .get("content", {})
+                        .get("application/json", {})
+                        .get("schema", {})
+                    )
+                    # Only endpoints that log a single record define a table; the
+                    # batch endpoints take arrays of those same records.
+                    if "$ref" not in schema:
+                        continue
                     table_name = path.split("/")[-1]
-                    schema_path = method_item["requestBody"]["content"][
-                        "application/json"
-                    ]["schema"]["$ref"]
-                    tabledefs[table_name] = schema_path.split("/")[-1]
+                    tabledefs[table_name] = schema["$ref"].split("/")[-1]
 
         schemas = json_schema["components"]["schemas"]
 
@@ -97,17 +165,20 @@ class AppDefs:
         self.tables = tables
         self.schemas = schemas
         self.schema_deps = schema_deps
+        self._structures: Dict[str, StructType] = {}
 
     def get_schema_name(self, table_name: str) -> str:
         return self.tables[table_name]
 
     def to_structure(self, schema_name: str) -> StructType:
-        schema = self.schemas[schema_name]
-        assert schema["type"] == "object"
-        structure = {}
-        for field, config in schema["properties"].items():
-            structure[field] = self.to_field_type(config)
-        return StructType(structure)
+        if schema_name not in self._structures:
+            schema = self.schemas[schema_name]
+            assert schema["type"] == "object"
+            structure = {}
+            for field, config in schema["properties"].items():
+                structure[field] = self.to_field_type(config)
+            self._structures[schema_name] = StructType(structure)
+        return self._structures[schema_name]
 
     def to_field_type(self, config: Dict) -> DuckDBType:
         if "$ref" in config:
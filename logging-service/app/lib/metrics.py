@@ -0,0 +1,100 @@
+"""Prometheus metrics for the ingest path, the storage engine and the ETL.
+
+The API serves these, along with its HTTP metrics, at `/metrics`. Batch jobs like
+the ETL record into the same registry and can write it out for the node
+exporter's textfile collector instead.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Most of what we time takes microseconds to milliseconds
+FAST_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+
+VALIDATION_SECONDS = Histogram(
+    "logging_service_validation_seconds",
+    "Time spent reading, decoding and validating request bodies",
+    ["table"],
+    buckets=FAST_BUCKETS,
+)
+VALIDATION_ERRORS = Counter(
+    "logging_service_validation_errors",
+    "Logged events that failed validation",
+    ["table"],
+)
+
+LOCK_WAIT_SECONDS = Histogram(
+    "logging_service_storage_lock_wait_seconds",
+    "Time spent waiting for a table's write lock",
+    ["table"],
+    buckets=FAST_BUCKETS,
+)
+INSERT_SECONDS = Histogram(
+    "logging_service_storage_insert_seconds",
+    "Time spent inserting a transaction's rows",
+    ["table"],
+    buckets=FAST_BUCKETS,
+)
+COMMIT_SECONDS = Histogram(
+    "logging_service_storage_commit_seconds",
+    "Time spent committing a transaction",
+    ["table"],
+    buckets=FAST_BUCKETS,
+)
+ROWS_WRITTEN = Counter(
+    "logging_service_storage_rows_written", "Rows written to storage", ["table"]
+)
+BYTES_WRITTEN = Counter(
+    "logging_service_storage_bytes_written",
+    "Bytes written to storage: record text in SQLite, or Parquet file bytes",
+    ["table"],
+)
+DB_FILE_BYTES = Gauge(
+    "logging_service_storage_db_file_bytes",
+    "Size of the table's current segment file, including its WAL",
+    ["table"],
+)
+BUFFER_PENDING = Gauge(
+    "logging_service_storage_buffer_pending",
+    "Rows queued or in flight in the table's ingest buffer",
+    ["table"],
+)
+BUFFER_DROPPED = Counter(
+    "logging_service_storage_buffer_dropped",
+    "Rows rejected because the table's ingest buffer was full",
+    ["table"],
+)
+
+ETL_ROWS = Counter("logging_service_etl_rows", "Rows exported by the ETL", ["table"])
+ETL_SECONDS = Histogram(
+    "logging_service_etl_seconds",
+    "Duration of each ETL export",
+    ["table"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+ETL_ROWS_PER_SECOND = Gauge(
+    "logging_service_etl_rows_per_second",
+    "Throughput of the table's most recent ETL export",
+    ["table"],
+)
+
+
+def observe_etl(table: str, rows: int, seconds: float):
+    ETL_ROWS.labels(table).inc(rows)
+    ETL_SECONDS.labels(table).observe(seconds)
+    if seconds > 0:
+        ETL_ROWS_PER_SECOND.labels(table).set(rows / seconds)
@@ -0,0 +1,243 @@
+"""A write-only storage backend that writes events straight to Parquet files.
+
+Rather than persisting JSON text to SQLite for the ETL to parse and flatten later,
+each table buffers its validated events in memory as columns, laid out like
+`config/{table}_columns.csv`, and flushes them to Hive-partitioned Parquet files
+under `output_dir/{table}/` (the same layout, and schema versioning, as the ETL's
+output) once a buffer holds `flush_rows` events or its oldest event is
+`flush_age_s` old.
+
+Each flush still goes through DuckDB's JSON reader: the flattened rows are written
+to a staging file as NDJSON and loaded with explicit column types. Without pyarrow,
+that is the fastest way to get them into DuckDB. Having it read the columns from
+NumPy arrays took twice as long (rebuilding the list columns is the slow part), and
+binding the values as parameters took far longer than that.
+
+The buffers are flushed on `close()`, which the API calls on shutdown, so only a
+hard crash loses buffered events. A batch that fails to flush goes back into its
+buffer, ahead of the events buffered since, to be written by the next flush. The
+tables can't be read back through `/fetch`, so this backend is meant for
+analytics-only tables.
+"""
+
+import itertools
+import logging
+import os
+import pathlib
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import duckdb
+
+from . import codec, metrics
+from .jsonschema import AppDefs, column_type, record_schema
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(table: str) -> List[str]:
+    working_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(f"{working_dir}/../config/{table}_columns.csv") as f:
+        return f.read().splitlines()
+
+
+def _extract(value: Any, path: List[str]) -> Any:
+    """Pulls a flattened column's value out of a record, mapping over any lists."""
+    for i, key in enumerate(path):
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return [_extract(v, path[i:]) for v in value]
+        value = value.get(key)
+    return value
+
+
+class _ColumnBuffer:
+    """An in-memory batch of a table's events, one list per flattened column."""
+
+    def __init__(self, types: Dict[str, str]):
+        self.types = types
+        self.paths = {col: col.split("__") for col in types}
+        self.columns: Dict[str, List] = {col: [] for col in types}
+        self.rows = 0
+        self.started: Optional[float] = None
+
+    def append(self, record: Dict):
+        for col, path in self.paths.items():
+            self.columns[col].append(_extract(record, path))
+        self.rows += 1
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def extend(self, other: "_ColumnBuffer"):
+        """Appends the events of another buffer, which are taken to be newer."""
+        for col, values in other.columns.items():
+            self.columns[col].extend(values)
+        self.rows += other.rows
+        if self.started is None:
+            self.started = other.started
+
+    def to_ndjson(self, path: pathlib.Path):
+        names = list(self.columns)
+        with open(path, "w") as f:
+            for row in zip(*self.columns.values()):
+                f.write(codec.dumps(dict(zip(names, row))))
+                f.write("\n")
+
+
+class ParquetStorage:
+    # Records may be handed over as parsed dicts, which skips a decode
+    columnar = True
+
+    def __init__(
+        self,
+        data_dir: pathlib.Path,
+        tables: List[str],
+        output_dir: Optional[pathlib.Path] = None,
+        flush_rows: int = 50000,
+        flush_age_s: Optional[float] = 60,
+        app_defs: Optional[AppDefs] = None,
+    ):
+        app_defs = app_defs or AppDefs.get_current()
+        self.output_dir = output_dir or data_dir / "parquet"
+        self.staging_dir = self.output_dir / "_staging"
+        self.tables = tables
+        self.flush_rows = flush_rows
+        self.flush_age_s = flush_age_s
+        self.types = {}
+        for table in tables:
+            structure = app_defs.to_structure(app_defs.get_schema_name(table))
+            types = {col: column_type(structure, col) for col in _columns(table)}
+            self.types[table] = {c: t for c, t in types.items() if t}
+        self.versions = {
+            t: record_schema(self.output_dir / t, self.types[t]) for t in tables
+        }
+        self.buffers = {t: _ColumnBuffer(self.types[t]) for t in tables}
+        self.lock = threading.Lock()
+        self.ddb = duckdb.connect(":memory:")
+        self.parts = itertools.count()
+        # The API checks these to decide how to hand over writes
+        self.writers = {}
+        self.ack = None
+        self.closed = threading.Event()
+        if flush_age_s:
+            threading.Thread(
+                target=self._flush_on_age, name="storage-parquet-flusher", daemon=True
+            ).start()
+
+    def close(self) -> Dict[str, pathlib.Path]:
+        """Flushes every table's buffer and returns their output directories."""
+        self.closed.set()
+        for table in self.tables:
+            batch = self._take(table)
+            try:
+                self._flush(table, batch)
+            except Exception:
+                logger.exception(
+                    "Dropped %d %s rows that failed to flush", batch.rows, table
+                )
+        return {t: self.output_dir / t for t in self.tables}
+
+    def _flush_on_age(self):
+        while not self.closed.wait(min(self.flush_age_s, 1.0)):
+            for table in self.tables:
+                started = self.buffers[table].started
+                if started and time.monotonic() - started >= self.flush_age_s:
+                    self._flush_or_restore(table)
+
+    def _take(self, table: str) -> _ColumnBuffer:
+        with self.lock:
+            batch = self.buffers[table]
+            self.buffers[table] = _ColumnBuffer(self.types[table])
+        return batch
+
+    def _flush_or_restore(self, table: str) -> List[pathlib.Path]:
+        """Flushes the table's buffer, putting the batch back if that fails."""
+        batch = self._take(table)
+        try:
+            return self._flush(table, batch)
+        except Exception:
+            logger.exception(
+                "Flushing %d %s rows failed; will retry", batch.rows, table
+            )
+            with self.lock:
+                batch.extend(self.buffers[table])
+                self.buffers[table] = batch
+            return []
+
+    def _flush(self, table: str, batch: _ColumnBuffer) -> List[pathlib.Path]:
+        """Writes a batch out as Parquet parts, partitioned by date and hour."""
+        if not batch.rows:
+            return []
+        prefix = f"part-{int(time.time() * 1e6)}-{next(self.parts)}"
+        staging = self.staging_dir / table / prefix
+        staging.mkdir(parents=True)
+        rows = staging / "rows.json"
+        columns = ", ".join(f"'{col}': '{t}'" for col, t in batch.types.items())
+        options = [
+            "FORMAT PARQUET",
+            "PARTITION_BY (date, hour)",
+            f"FILENAME_PATTERN '{prefix}-{{i}}'",
+            f"KV_METADATA {{schema_version: '{self.versions[table]}'}}",
+        ]
+        parts = []
+        ddb = self.ddb.cursor()
+        try:
+            # the fastest way in for the flattened rows; see the module docstring
+            batch.to_ndjson(rows)
+            ddb.execute(
+                f"""
+                COPY (
+                    SELECT *,
+                        strftime(make_timestamp(timestamp_micros), '%Y-%m-%d') AS date,
+                        hour(make_timestamp(timestamp_micros)) AS hour
+                    FROM read_json('{rows}', format='newline_delimited',
+                        columns={{{columns}}})
+                ) TO '{staging / "parts"}' ({", ".join(options)})
+            """
+            )
+            for staged in sorted((staging / "parts").glob("*/*/*.parquet")):
+                part = self.output_dir / table / staged.relative_to(staging / "parts")
+                part.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(staged, part)
+                parts.append(part)
+        except BaseException:
+            # the batch is written again in full, so none of it can be left in place
+            for part in parts:
+                part.unlink(missing_ok=True)
+            raise
+        finally:
+            ddb.close()
+            shutil.rmtree(staging, ignore_errors=True)
+        metrics.ROWS_WRITTEN.labels(table).inc(batch.rows)
+        metrics.BYTES_WRITTEN.labels(table).inc(sum(p.stat().st_size for p in parts))
+        return parts
+
+    def write(self, table: str, data: Union[str, Dict]):
+        self.write_many(table, [data])
+
+    def write_many(self, table: str, datas: List[Union[str, Dict]]):
+        """Buffers the records, flushing the table if its buffer is full.
+
+        The flush happens on the calling thread, which keeps writers from
+        outrunning the Parquet writer.
+        """
+        with self.lock:
+            buffer = self.buffers[table]
+            for data in datas:
+                buffer.append(codec.loads(data) if isinstance(data, str) else data)
+            full = buffer.rows >= self.flush_rows
+        if full:
+            self._flush_or_restore(table)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Current buffered row counts for each table."""
+        return {t: {"pending": b.rows, "dropped": 0} for t, b in self.buffers.items()}
+
+    def scan(self, table: str, limit: int, **kwargs):
+        raise NotImplementedError("The Parquet storage backend is write-only")
+
+    def fetch(self, table: str, limit: int = 10, **kwargs):
+        raise NotImplementedError("The Parquet storage backend is write-only")
@@ -1,58 +1,585 @@
-import json
+import contextlib
+import fcntl
+import logging
 import os
 import pathlib
+import queue
+import re
 import socket
 import sqlite3
 import threading
 import time
-from typing import List
+from concurrent.futures import Future
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from . import codec, metrics
 
-def _get_db_filename() -> str:
-    return f"logging_service_{int(time.time() * 1e6)}.db"
+logger = logging.getLogger(__name__)
+
+# Ack policies for group commit mode: reply once the batch containing the event
+# has been committed, or as soon as the event has been queued for the writer.
+ACK_DURABLE = "durable"
+ACK_QUEUED = "queued"
+
+
+class BufferFull(Exception):
+    """Raised when a table's group commit buffer is over its high watermark."""
+
+
+# JSON paths of the fields that /fetch can filter on. Indexed filters are backed
+# by an expression index on every table, which the filter SQL must match exactly.
+FETCH_FILTERS = {"query_id": "$.query_id", "user_id": "$.user.id"}
+
+
+def _filter_expr(name: str) -> str:
+    return f"json_extract(data, '{FETCH_FILTERS[name]}')"
+
+
+def _get_db_filename(table: str) -> str:
+    return f"logging_service_{table}_{int(time.time() * 1e6)}.db"
+
+
+class _GroupCommitWriter:
+    """Background writer that drains queued events and commits them in batches.
+
+    A batch is flushed when it holds `batch_size` rows, or once the queue is empty
+    and `max_delay` seconds have passed since its first row was dequeued. With no
+    delay, whatever arrives while one batch commits becomes the next batch.
+
+    At most `max_pending` rows may be queued or in flight at once; past that high
+    watermark `submit` rejects new rows instead of letting the backlog grow.
+    """
+
+    def __init__(
+        self,
+        store: "_TableStore",
+        batch_size: int,
+        max_delay: float,
+        max_pending: Optional[int],
+    ):
+        self.store = store
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.pending = 0
+        self.dropped = 0
+        self.pending_lock = threading.Lock()
+        self.dropped_metric = metrics.BUFFER_DROPPED.labels(store.table)
+        metrics.BUFFER_PENDING.labels(store.table).set_function(lambda: self.pending)
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(
+            target=self._run, name=f"storage-group-commit-{store.table}", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, rows: List[Tuple[int, str]]) -> Future:
+        """Queues (ts, data) rows that will be committed in the same transaction."""
+        with self.pending_lock:
+            # An empty buffer always takes the rows, so a batch bigger than the
+            # watermark is still written rather than rejected forever.
+            if (
+                self.max_pending
+                and self.pending
+                and self.pending + len(rows) > self.max_pending
+            ):
+                self.dropped += len(rows)
+                self.dropped_metric.inc(len(rows))
+                raise BufferFull(
+                    f"{self.pending} rows are already pending for {self.store.table}"
+                )
+            self.pending += len(rows)
+        fut = Future()
+        self.queue.put((rows, fut))
+        return fut
+
+    def close(self):
+        # The sentinel goes in behind everything already queued, so the writer
+        # flushes all pending events before it exits.
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch, size = [item], len(item[0])
+            deadline = time.monotonic() + self.max_delay
+            while size < self.batch_size:
+                # Take whatever is already queued first, and only linger for
+                # stragglers once the queue has been drained.
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._flush(batch)
+
+    def _flush(self, batch):
+        rows = [row for rows, _ in batch for row in rows]
+        try:
+            self.store.insert(rows)
+        except Exception as e:
+            logger.exception("Group commit of %d writes failed", len(batch))
+            for _, fut in batch:
+                fut.set_exception(e)
+        else:
+            for _, fut in batch:
+                fut.set_result(None)
+        finally:
+            with self.pending_lock:
+                self.pending -= len(rows)
+
+
+class _TableStore:
+    """The segment files, writer connection and read pool for a single table.
+
+    Each table gets its own SQLite file in WAL mode, so a writer on one table never
+    waits on another table, and readers from the pool run concurrently with the
+    table's single writer instead of queueing behind its lock.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        data_dir: pathlib.Path,
+        ready_dir: pathlib.Path,
+        segment_max_bytes: Optional[int],
+        segment_max_age_s: Optional[float],
+        fetch_indexes: List[str],
+    ):
+        self.table = table
+        self.fetch_indexes = fetch_indexes
+        self.data_dir = data_dir
+        self.ready_dir = ready_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age_s = segment_max_age_s
+        self.lock = threading.Lock()
+        # Guards the read pool; sealing a segment waits for checked out readers
+        # to come back so that the file can be checkpointed and moved.
+        self.pool_cond = threading.Condition()
+        self.idle_readers = []
+        self.active_readers = 0
+        self.sealing = True
+        self.closed = False
+        self.lock_wait = metrics.LOCK_WAIT_SECONDS.labels(table)
+        self.insert_seconds = metrics.INSERT_SECONDS.labels(table)
+        self.commit_seconds = metrics.COMMIT_SECONDS.labels(table)
+        self.rows_written = metrics.ROWS_WRITTEN.labels(table)
+        self.bytes_written = metrics.BYTES_WRITTEN.labels(table)
+        metrics.DB_FILE_BYTES.labels(table).set_function(self.file_bytes)
+        self._recover_segments()
+        self._open_segment()
+
+    def _recover_segments(self) -> List[pathlib.Path]:
+        """Publishes the segments that an earlier process left behind unsealed.
+
+        A process holds an exclusive flock on its live segment until it seals it,
+        so a segment that can be locked belongs to a process that is gone. Its WAL
+        is checkpointed into it and it is moved to the ready directory, like a
+        segment sealed on shutdown.
+        """
+        segment = re.compile(rf"logging_service_{re.escape(self.table)}_\d+\.db")
+        recovered = []
+        for path in sorted(self.data_dir.glob(f"logging_service_{self.table}_*.db")):
+            if not segment.fullmatch(path.name):
+                continue
+            with open(path, "rb") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    db = sqlite3.connect(path)
+                    try:
+                        db.execute("PRAGMA journal_mode=DELETE")
+                    finally:
+                        db.close()
+                except sqlite3.DatabaseError:
+                    logger.exception("Left unsealed segment %s behind", path)
+                    continue
+                self.ready_dir.mkdir(parents=True, exist_ok=True)
+                os.replace(path, self.ready_dir / path.name)
+            logger.info("Recovered unsealed segment %s", path.name)
+            recovered.append(self.ready_dir / path.name)
+        return recovered
+
+    def _open_segment(self):
+        self.path = self.data_dir / _get_db_filename(self.table)
+        # The segment is created, and locked, under a name that recovery doesn't
+        # look for, so no other process can ever see it unlocked
+        new = self.path.with_name(self.path.name + ".new")
+        self.segment_lock = open(new, "ab")
+        fcntl.flock(self.segment_lock, fcntl.LOCK_EX)
+        os.replace(new, self.path)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (ts int, data text)")
+        self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_ts ON {self.table} (ts)"
+        )
+        for name in self.fetch_indexes:
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_{name} "
+                f"ON {self.table} ({_filter_expr(name)}, ts)"
+            )
+        self.db.commit()
+        self.page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+        # the schema and indexes take up pages before any rows are written
+        self.empty_bytes = self._segment_bytes()
+        self.segment_started = None
+        with self.pool_cond:
+            self.sealing = False
+            self.pool_cond.notify_all()
+
+    def _seal_segment(self) -> Optional[pathlib.Path]:
+        """Closes the current segment and publishes it. Requires the lock.
+
+        A segment that no rows were written to is removed instead, and None is
+        returned. New readers are held off until the next segment is opened.
+        """
+        with self.pool_cond:
+            self.sealing = True
+            self.pool_cond.wait_for(lambda: self.active_readers == 0)
+            for conn in self.idle_readers:
+                conn.close()
+            self.idle_readers = []
+        # With no other connections open, switching back to a rollback journal
+        # folds the WAL into the main file, so the sealed segment is a single
+        # self-contained file that any SQLite reader can open. Every write was
+        # committed under the lock, so the atomic rename publishes it whole.
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.close()
+        sealed = None
+        if self.segment_started is None:
+            # removed while still locked, so recovery never picks it up
+            os.unlink(self.path)
+        else:
+            self.ready_dir.mkdir(parents=True, exist_ok=True)
+            sealed = self.ready_dir / self.path.name
+            os.replace(self.path, sealed)
+        self.segment_lock.close()
+        self.segment_started = None
+        return sealed
+
+    def _segment_bytes(self) -> int:
+        return self.db.execute("PRAGMA page_count").fetchone()[0] * self.page_size
+
+    def _maybe_roll(self):
+        """Rolls over to a new segment if the current one is full. Requires the lock.
+
+        The size limit applies to what the rows have added to the segment, not to
+        the pages its empty tables and indexes start out with.
+        """
+        if self.segment_started is None:
+            return
+        if (
+            self.segment_max_bytes
+            and self._segment_bytes() - self.empty_bytes >= self.segment_max_bytes
+        ) or (
+            self.segment_max_age_s
+            and time.monotonic() - self.segment_started >= self.segment_max_age_s
+        ):
+            self._seal_segment()
+            self._open_segment()
+
+    def file_bytes(self) -> int:
+        """The size of the current segment, including its WAL."""
+        size = 0
+        for path in (self.path, self.path.with_name(self.path.name + "-wal")):
+            try:
+                size += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    def roll_if_old(self):
+        with self.lock:
+            self._maybe_roll()
+
+    def close(self) -> Optional[pathlib.Path]:
+        """Seals the segment, returning its path, or None if it had no rows."""
+        with self.lock:
+            sealed = self._seal_segment()
+            if sealed:
+                self.path = sealed
+            with self.pool_cond:
+                self.closed = True
+                self.pool_cond.notify_all()
+        return sealed
+
+    def insert(self, rows):
+        """Writes the given (ts, data) rows in one transaction."""
+        waited = time.perf_counter()
+        with self.lock:
+            start = time.perf_counter()
+            self.lock_wait.observe(start - waited)
+            try:
+                self.db.executemany(
+                    f"INSERT INTO {self.table} (ts, data) VALUES (?, ?)", rows
+                )
+                inserted = time.perf_counter()
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            self.insert_seconds.observe(inserted - start)
+            self.commit_seconds.observe(time.perf_counter() - inserted)
+            self.rows_written.inc(len(rows))
+            self.bytes_written.inc(sum(len(data) for _, data in rows))
+            if self.segment_started is None:
+                self.segment_started = time.monotonic()
+            self._maybe_roll()
+
+    @contextlib.contextmanager
+    def reader(self):
+        """Checks out a read-only connection to the current segment from the pool."""
+        with self.pool_cond:
+            self.pool_cond.wait_for(lambda: self.closed or not self.sealing)
+            if self.closed:
+                raise sqlite3.ProgrammingError(f"Storage for {self.table} is closed")
+            if self.idle_readers:
+                conn = self.idle_readers.pop()
+            else:
+                conn = sqlite3.connect(
+                    f"{self.path.absolute().as_uri()}?mode=ro",
+                    uri=True,
+                    check_same_thread=False,
+                )
+            self.active_readers += 1
+        try:
+            yield conn
+        finally:
+            with self.pool_cond:
+                self.active_readers -= 1
+                self.idle_readers.append(conn)
+                self.pool_cond.notify_all()
+
+    def scan(
+        self,
+        limit: int,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        before: Optional[Tuple[int, int]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        chunk_size: int = 500,
+    ) -> Iterator[Tuple[int, int, str]]:
+        """Yields up to `limit` (rowid, ts, data) rows, newest first.
+
+        Rows are read in keyset-paginated chunks, each on a connection that goes
+        back to the pool before the chunk is yielded, so a slow consumer never pins
+        a reader or holds up sealing the segment.
+        """
+        where, params = [], []
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        for name, value in (filters or {}).items():
+            where.append(f"{_filter_expr(name)} = ?")
+            params.append(value)
+        remaining = limit
+        while remaining > 0:
+            clauses, args = list(where), list(params)
+            if before is not None:
+                clauses.append("(ts, rowid) < (?, ?)")
+                args.extend(before)
+            sql = f"SELECT rowid, ts, data FROM {self.table}"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += " ORDER BY ts DESC, rowid DESC LIMIT ?"
+            size = min(chunk_size, remaining)
+            with self.reader() as conn:
+                rows = conn.execute(sql, args + [size]).fetchall()
+            yield from rows
+            if len(rows) < size:
+                return
+            remaining -= size
+            before = (rows[-1][1], rows[-1][0])
 
 
 class Storage:
     _instance = None
 
+    # Whether records may be handed over as parsed dicts instead of JSON text
+    columnar = False
+
     @classmethod
     def get(cls) -> "Storage":
         if not cls._instance:
             data_dir = pathlib.Path(os.getenv("DATA_DIR", "/tmp"))
             tables = os.getenv("TABLES", "searches,clicks").split(",")
-            cls._instance = cls(data_dir, tables)
+            if os.getenv("STORAGE_BACKEND", "sqlite") == "parquet":
+                from .parquet_storage import ParquetStorage
+
+                cls._instance = ParquetStorage(
+                    data_dir,
+                    tables,
+                    flush_rows=int(os.getenv("PARQUET_FLUSH_ROWS", "50000")),
+                    flush_age_s=float(os.getenv("PARQUET_FLUSH_AGE_S", "60")) or None,
+                )
+                return cls._instance
+            # the API's writes go through a bounded buffer unless this is "off"
+            group_commit = os.getenv("GROUP_COMMIT", ACK_DURABLE)
+            cls._instance = cls(
+                data_dir,
+                tables,
+                group_commit=None if group_commit in ("", "off") else group_commit,
+                batch_size=int(os.getenv("GROUP_COMMIT_BATCH_SIZE", "256")),
+                max_delay_ms=float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "0")),
+                max_pending=int(os.getenv("GROUP_COMMIT_MAX_PENDING", "10000")) or None,
+                segment_max_bytes=int(os.getenv("SEGMENT_MAX_BYTES", "0")) or None,
+                segment_max_age_s=float(os.getenv("SEGMENT_MAX_AGE_S", "0")) or None,
+                fetch_indexes=[
+                    f
+                    for f in os.getenv("FETCH_INDEXES", ",".join(FETCH_FILTERS)).split(
+                        ","
+                    )
+                    if f
+                ],
+            )
         return cls._instance
 
-    def __init__(self, data_dir: pathlib.Path, tables: List[str]):
-        self.path = data_dir / _get_db_filename()
-        self.db = sqlite3.connect(self.path, check_same_thread=False)
+    def __init__(
+        self,
+        data_dir: pathlib.Path,
+        tables: List[str],
+        group_commit: Optional[str] = None,
+        batch_size: int = 256,
+        max_delay_ms: float = 0,
+        max_pending: Optional[int] = None,
+        segment_max_bytes: Optional[int] = None,
+        segment_max_age_s: Optional[float] = None,
+        ready_dir: Optional[pathlib.Path] = None,
+        fetch_indexes: Optional[List[str]] = None,
+    ):
+        """Opens a new SQLite database segment for each of the given tables.
+
+        By default every write is committed before it returns. Setting `group_commit`
+        to `ACK_DURABLE` or `ACK_QUEUED` instead hands writes to a background writer
+        per table that commits up to `batch_size` rows per transaction, lingering at
+        most `max_delay_ms` for more rows; the value picks when `write` returns.
+        Each writer buffers at most `max_pending` rows, beyond which writes raise
+        `BufferFull` so that callers can shed load.
+
+        Once the rows written to a table's segment take up `segment_max_bytes`, or
+        its first row is `segment_max_age_s` old, it is sealed: closed and moved
+        into `ready_dir` (default `data_dir/ready`), where the ETL can pick it up
+        while new writes go to a fresh segment. Segments without rows are removed
+        rather than sealed.
+
+        Every segment indexes `ts`, plus the `FETCH_FILTERS` named in
+        `fetch_indexes` (default: all of them) so that those `/fetch` filters
+        don't scan the table.
+        """
+        if group_commit not in (None, ACK_DURABLE, ACK_QUEUED):
+            raise ValueError(f"Unknown group commit ack policy {group_commit}")
+        self.data_dir = data_dir
+        self.ready_dir = ready_dir or data_dir / "ready"
         self.tables = tables
-        for t in tables:
-            self.db.execute(f"CREATE TABLE IF NOT EXISTS {t} (ts int, data text)")
-        self.lock = threading.Lock()
+        self.stores: Dict[str, _TableStore] = {
+            t: _TableStore(
+                t,
+                data_dir,
+                self.ready_dir,
+                segment_max_bytes,
+                segment_max_age_s,
+                list(FETCH_FILTERS) if fetch_indexes is None else fetch_indexes,
+            )
+            for t in tables
+        }
+        self.closed = threading.Event()
+        self.segment_max_age_s = segment_max_age_s
+        if segment_max_age_s:
+            threading.Thread(
+                target=self._roll_on_age, name="storage-segment-roller", daemon=True
+            ).start()
+        self.ack = group_commit
+        self.writers: Dict[str, _GroupCommitWriter] = {}
+        if group_commit:
+            self.writers = {
+                t: _GroupCommitWriter(s, batch_size, max_delay_ms / 1000, max_pending)
+                for t, s in self.stores.items()
+            }
 
-    def close(self) -> str:
-        with self.lock:
-            self.db.close()
-            self._instance = None
-        return self.path
+    def close(self) -> Dict[str, pathlib.Path]:
+        """Seals each table's segment and returns their paths in the ready directory.
+
+        Tables with nothing written to their current segment are left out.
+        """
+        for writer in self.writers.values():
+            writer.close()
+        self.closed.set()
+        sealed = {t: s.close() for t, s in self.stores.items()}
+        return {t: path for t, path in sealed.items() if path}
+
+    @classmethod
+    def close_instance(cls):
+        """Closes the storage that `get` opened, if any, so nothing it holds is lost.
+
+        This drains the group commit writers and seals the segments (or, for the
+        Parquet backend, flushes its buffers); the next `get` opens a new one.
+        """
+        instance, cls._instance = cls._instance, None
+        if instance:
+            instance.close()
+
+    def _roll_on_age(self):
+        # Seal old segments even if no new writes arrive to trigger the check.
+        while not self.closed.wait(min(self.segment_max_age_s, 1.0)):
+            for store in self.stores.values():
+                store.roll_if_old()
 
     def write(self, table: str, data: str):
-        with self.lock:
-            self.db.execute(
-                f"INSERT INTO {table} (ts, data) VALUES (?, ?)",
-                (int(time.time() * 1e6), data),
-            )
-            self.db.commit()
+        self.write_many(table, [data])
 
-    def fetch(self, table: str, limit: int = 10):
-        rows = []
-        with self.lock:
-            cursor = self.db.execute(f"SELECT ts, data FROM {table} LIMIT {limit}")
-            rows = cursor.fetchall()
+    def write_many(self, table: str, datas: List[str]):
+        """Writes all of the given records to the table in a single transaction."""
+        if not self.writers:
+            ts = int(time.time() * 1e6)
+            self.stores[table].insert([(ts, data) for data in datas])
+            return
+        fut = self.submit(table, datas)
+        if self.ack == ACK_DURABLE:
+            fut.result()
+
+    def submit(self, table: str, datas: List[str]) -> Future:
+        """Queues records for the table's group commit writer without blocking.
+
+        The returned future resolves once the records are committed. Raises
+        `BufferFull` if the writer is over its high watermark.
+        """
+        ts = int(time.time() * 1e6)
+        return self.writers[table].submit([(ts, data) for data in datas])
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Current buffer depth and rejected row counts for each table's writer."""
+        return {
+            t: {"pending": w.pending, "dropped": w.dropped}
+            for t, w in self.writers.items()
+        }
+
+    def scan(self, table: str, limit: int, **kwargs) -> Iterator[Tuple[int, int, str]]:
+        """Yields the table's most recent (rowid, ts, data) rows; see `_TableStore.scan`."""
+        return self.stores[table].scan(limit, **kwargs)
+
+    def fetch(self, table: str, limit: int = 10, **kwargs) -> List[Dict]:
         ret = []
-        for row in rows:
-            data = json.loads(row[1])
-            data["__ts"] = row[0]
-            ret.append(data)
+        for _, ts, data in self.scan(table, limit, **kwargs):
+            record = codec.loads(data)
+            record["__ts"] = ts
+            ret.append(record)
         return ret
@@ -1,9 +1,8 @@
 import graphlib
+import json
 import os
 from typing import List, Dict
 
-from fastapi.testclient import TestClient
-
 from app.api import app
 from app.lib.jsonschema import AppDefs
 
@@ -30,8 +29,10 @@ def gen_columns(schema: dict, schemas: dict, prefix: str = "") -> List[str]:
 
 
 def main():
-    client = TestClient(app)
-    json_schema = client.get("/openapi.json").json()
+    # The same schema the app serves at /openapi.json, without standing up a
+    # test client to request it; copied, since the app caches it and
+    # from_json_schema edits it
+    json_schema = json.loads(json.dumps(app.openapi()))
     app_defs = AppDefs.from_json_schema(json_schema)
     existing_app_defs = AppDefs.get_current()
 
@@ -1,17 +1,174 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from typing import Any, Iterator, List, Optional, Sequence
 
 import duckdb
-import sys
 
-if __name__ == '__main__':
-  if len(sys.argv) != 2:
-    print("Usage: pcat <file.parquet>")
-    sys.exit(1)
-
-  conn = duckdb.connect()
-  conn.install_extension("parquet")
-  conn.load_extension("parquet")
-  ret = conn.execute(f"SELECT * FROM '{sys.argv[1]}'").fetchall()
-  colnames = [x[0] for x in conn.description]
-  print(colnames)
-  for row in ret:
-    print(row)
+NUMERIC_TYPES = ("INT32", "INT64", "INT96", "FLOAT", "DOUBLE")
+
+BOOLEANS = {"true": True, "false": False}
+
+
+def _files(paths: List[str]) -> List[str]:
+    """Expands files, globs and (partitioned) directories into Parquet files."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, "**", "*.parquet")
+        if glob.has_magic(path):
+            files.extend(sorted(glob.glob(path, recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def _scan(files: List[str]) -> str:
+    names = ", ".join(f"'{f}'" for f in files)
+    return f"read_parquet([{names}], hive_partitioning=true, union_by_name=true)"
+
+
+def _batches(cursor, batch_size: int) -> Iterator[List[Sequence[Any]]]:
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _print(colnames: List[str], batches: Iterator[List], fmt: str):
+    out = sys.stdout
+    if fmt == "table":
+        print(colnames, file=out)
+        for rows in batches:
+            for row in rows:
+                print(row, file=out)
+    elif fmt == "json":
+        for rows in batches:
+            for row in rows:
+                out.write(json.dumps(dict(zip(colnames, row)), default=str))
+                out.write("\n")
+    else:
+        writer = csv.writer(out)
+        writer.writerow(colnames)
+        for rows in batches:
+            writer.writerows(rows)
+
+
+def cat(
+    conn: duckdb.DuckDBPyConnection,
+    files: List[str],
+    fmt: str,
+    columns: Optional[str] = None,
+    where: Optional[str] = None,
+    limit: Optional[int] = None,
+    batch_size: int = 1000,
+):
+    """Streams the rows of the files out in batches, optionally picking some out."""
+    # DuckDB pushes the projection, filter and limit down into the Parquet scan,
+    # so only the row groups and columns that are needed get read.
+    sql = f"SELECT {columns or '*'} FROM {_scan(files)}"
+    if where:
+        sql += f" WHERE {where}"
+    if limit is not None:
+        sql += f" LIMIT {limit}"
+    cursor = conn.execute(sql)
+    colnames = [x[0] for x in cursor.description]
+    _print(colnames, _batches(cursor, batch_size), fmt)
+
+
+def _value(text: str, physical_type: str) -> Any:
+    """Parses a min/max statistic, or leaves it as text if it doesn't parse."""
+    if text is None:
+        return None
+    if physical_type == "BOOLEAN":
+        return BOOLEANS.get(text.lower(), text)
+    if physical_type in NUMERIC_TYPES:
+        for parse in (int, float):
+            try:
+                return parse(text)
+            except ValueError:
+                pass
+    return text
+
+
+def stats(conn: duckdb.DuckDBPyConnection, files: List[str], fmt: str):
+    """Prints row group sizes and per-column min/max/null counts from the footers."""
+    names = ", ".join(f"'{f}'" for f in files)
+    footer = conn.execute(
+        f"""
+        SELECT file_name, row_group_id, row_group_num_rows, path_in_schema, type,
+            stats_min_value, stats_max_value, stats_null_count,
+            total_compressed_size
+        FROM parquet_metadata([{names}])
+        ORDER BY file_name, row_group_id, column_id
+    """
+    ).fetchall()
+
+    row_groups, columns = {}, {}
+    for file, rg, num_rows, column, ptype, lo, hi, nulls, size in footer:
+        row_groups.setdefault((file, rg), [file, rg, num_rows, 0])[3] += size
+        # list elements are reported as "column, list, element"
+        column = column.split(", ")[0]
+        col = columns.setdefault(column, [column, ptype, None, None, 0])
+        lo, hi = _value(lo, ptype), _value(hi, ptype)
+        if lo is not None and (col[2] is None or lo < col[2]):
+            col[2] = lo
+        if hi is not None and (col[3] is None or hi > col[3]):
+            col[3] = hi
+        col[4] += nulls or 0
+
+    _print(
+        ["file", "row_group", "rows", "compressed_bytes"],
+        iter([list(row_groups.values())]),
+        fmt,
+    )
+    _print(
+        ["column", "type", "min", "max", "nulls"], iter([list(columns.values())]), fmt
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the rows of Parquet files")
+    parser.add_argument(
+        "paths", nargs="+", help="Parquet files, globs or partitioned directories"
+    )
+    parser.add_argument("--columns", help="comma-separated columns to print")
+    parser.add_argument("--where", help='SQL filter on the rows, e.g. "user__id = 1"')
+    parser.add_argument("--limit", type=int, help="maximum number of rows to print")
+    parser.add_argument(
+        "--format", choices=["table", "json", "csv"], default="table", dest="fmt"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print row group and column statistics instead of rows",
+    )
+    args = parser.parse_args()
+
+    files = _files(args.paths)
+    if not files:
+        print(f"No Parquet files found in {' '.join(args.paths)}", file=sys.stderr)
+        sys.exit(1)
+    conn = duckdb.connect()
+    if args.stats:
+        stats(conn, files, args.fmt)
+        sys.exit(0)
+
+    try:
+        cat(
+            conn,
+            files,
+            args.fmt,
+            args.columns,
+            args.where,
+            args.limit,
+            args.batch_size,
+        )
+    except BrokenPipeError:
+        # e.g. piped into head
+        sys.stderr.close()
@@ -0,0 +1,68 @@
+"""Measures wall time, peak memory and output size of the ETL under different settings.
+
+Builds a synthetic searches store (see synth.py) and ETLs it to a single Parquet
+file once per settings combination, each in a fresh process so that the peak RSS
+is that run's alone.
+
+Usage: python benchmarks/etl_resources.py [rows] [max_results]
+"""
+
+import json
+import multiprocessing
+import pathlib
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from app import etl
+from app.lib.jsonschema import AppDefs
+
+from synth import make_searches
+
+SETTINGS = [
+    etl.ETLSettings(),
+    etl.ETLSettings(threads=1),
+    etl.ETLSettings(memory_limit="256MB"),
+    etl.ETLSettings(memory_limit="256MB", threads=1),
+    etl.ETLSettings(compression="zstd"),
+    etl.ETLSettings(compression="zstd", row_group_size=500000),
+    etl.ETLSettings(compression="snappy", row_group_size=20000),
+]
+
+
+def _run(db: pathlib.Path, output_dir: pathlib.Path, settings: etl.ETLSettings):
+    start = time.perf_counter()
+    out = etl.etl(db, "searches", AppDefs.get_current(), output_dir, settings)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, peak, out.stat().st_size
+
+
+def run(db: pathlib.Path, workdir: pathlib.Path, settings: etl.ETLSettings) -> dict:
+    output_dir = workdir / "out"
+    output_dir.mkdir()
+    if settings.temp_directory is None and settings.memory_limit:
+        settings = settings._replace(temp_directory=str(workdir / "spill"))
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        elapsed, peak, size = pool.apply(_run, (db, output_dir, settings))
+    shutil.rmtree(output_dir)
+    return {
+        "settings": {k: v for k, v in settings._asdict().items() if v is not None},
+        "wall_s": round(elapsed, 2),
+        "peak_rss_mb": round(peak, 1),
+        "parquet_mb": round(size / 1e6, 1),
+    }
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    max_results = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = pathlib.Path(tmp)
+        db = make_searches(workdir / "searches.db", rows, 0, max_results)
+        for settings in SETTINGS:
+            print(json.dumps(run(db, workdir, settings)))
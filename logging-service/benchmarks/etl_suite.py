@@ -0,0 +1,250 @@
+"""Benchmarks `etl.etl()` on synthetic stores of increasing size, and saves the results.
+
+For every size, it runs the `searches` table once per range of results list lengths,
+and also runs the `clicks` table. The stores are built with synth.py and
+kept in `--data-dir` between runs if one is given. Each case runs in a fresh process, so
+its peak RSS is its own, and reports:
+
+* `rows_per_s`, `wall_s`, `peak_rss_mb` and `parquet_mb` for the `etl.etl()` call;
+* `stages`, where `setup_s` is loading DuckDB and its extensions, `plan_s` compiling
+the flattening plan and `attach_s` attaching the SQLite store. After the timed run,
+the query is repeated in steps: reading the rows out of SQLite, then also parsing
+their JSON, then the full COPY. `read_s`, `parse_s` and `write_s` are the differences
+between those steps.
+
+The results go to `--output` as JSON. Passing an earlier results file as `--baseline`
+compares each case with the same one in it, and exits non-zero when throughput, peak
+memory or output size got worse by more than `--tolerance`.
+
+Usage: python benchmarks/etl_suite.py [--sizes 1e4,1e5,1e6] [--results 0-10,0-50]
+           [--output etl_suite.json] [--baseline old.json] [--data-dir DIR]
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import duckdb
+
+from app import etl
+from app.lib.jsonschema import AppDefs
+
+from synth import make_clicks, make_searches
+
+# metric: whether a higher value is better
+COMPARED = {"rows_per_s": True, "peak_rss_mb": False, "parquet_mb": False}
+
+
+def _run(db: pathlib.Path, table: str, workdir: pathlib.Path) -> dict:
+    settings = etl.ETLSettings()
+    etl.PLAN_CACHE_DIR = workdir / "plans"
+    stages = {}
+
+    start = time.perf_counter()
+    etl._database(settings)
+    stages["setup_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    out = etl.etl(db, table, AppDefs.get_current(), workdir, settings)
+    wall = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    size = out.stat().st_size
+    rows = duckdb.execute(f"SELECT count(*) FROM '{out}'").fetchone()[0]
+    out.unlink()
+
+    # The same steps as etl.etl(), from a cold plan cache
+    etl._plans.clear()
+    for plan_file in etl.PLAN_CACHE_DIR.glob("*.json"):
+        plan_file.unlink()
+    start = time.perf_counter()
+    plan = etl.flatten_plan(table, AppDefs.get_current())
+    stages["plan_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with etl._connect(db, settings) as ddb:
+        stages["attach_s"] = time.perf_counter() - start
+        select = etl._flatten(ddb, table, plan)
+
+        start = time.perf_counter()
+        ddb.execute(f"SELECT sum(length(data)) FROM {table}").fetchall()
+        read = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ddb.execute(f"SELECT count(*) FROM {table}_parsed WHERE d IS NOT NULL")
+        ddb.fetchall()
+        parse = time.perf_counter() - start
+
+        options = ", ".join(etl._parquet_options(settings, plan))
+        start = time.perf_counter()
+        ddb.execute(f"COPY ({select}) TO '{out}' ({options})")
+        copy = time.perf_counter() - start
+    out.unlink()
+
+    stages["read_s"] = read
+    stages["parse_s"] = max(parse - read, 0.0)
+    stages["write_s"] = max(copy - parse, 0.0)
+    return {
+        "rows": rows,
+        "wall_s": round(wall, 3),
+        "rows_per_s": round(rows / wall),
+        "peak_rss_mb": round(peak, 1),
+        "parquet_mb": round(size / 1e6, 2),
+        "stages": {k: round(v, 4) for k, v in stages.items()},
+    }
+
+
+def _store(data_dir: pathlib.Path, case: dict) -> pathlib.Path:
+    if case["table"] == "clicks":
+        path = data_dir / f"clicks-{case['rows']}.db"
+        if not path.exists():
+            make_clicks(path, case["rows"])
+    else:
+        lo, hi = case["min_results"], case["max_results"]
+        path = data_dir / f"searches-{case['rows']}-{lo}-{hi}.db"
+        if not path.exists():
+            make_searches(path, case["rows"], lo, hi)
+    return path
+
+
+def run(data_dir: pathlib.Path, case: dict) -> dict:
+    start = time.perf_counter()
+    db = _store(data_dir, case)
+    print(
+        f"{_key(case)}: store ready in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+    with tempfile.TemporaryDirectory(dir=data_dir) as tmp:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(1) as pool:
+            result = pool.apply(_run, (db, case["table"], pathlib.Path(tmp)))
+    return {**case, "sqlite_mb": round(db.stat().st_size / 1e6, 1), **result}
+
+
+def _cases(sizes: List[int], results: List[str]) -> List[dict]:
+    cases = []
+    for rows in sizes:
+        for spec in results:
+            lo, _, hi = spec.partition("-")
+            cases.append(
+                {
+                    "table": "searches",
+                    "rows": rows,
+                    "min_results": int(lo),
+                    "max_results": int(hi or lo),
+                }
+            )
+        cases.append({"table": "clicks", "rows": rows})
+    return cases
+
+
+def _key(case: dict) -> str:
+    if case["table"] == "clicks":
+        return f"clicks/{case['rows']}"
+    return f"searches/{case['rows']}/{case['min_results']}-{case['max_results']}"
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """Prints each case's change from the baseline and returns the regressions."""
+    before = {_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED.items():
+            if not old.get(metric):
+                continue
+            change = result[metric] / old[metric] - 1
+            changes.append(f"{metric} {change:+.1%}")
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{_key(result)}: {metric} {change:+.1%}")
+        print(f"{_key(result)}: {', '.join(changes)}")
+    return regressions
+
+
+def _size(text: str) -> int:
+    # accepts 10000 as well as 1e4
+    return int(float(text))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ETL at scale")
+    parser.add_argument(
+        "--sizes",
+        default="1e4,1e5,1e6",
+        help="comma-separated row counts, e.g. 1e4,1e6,1e8",
+    )
+    parser.add_argument(
+        "--results",
+        default="0-10,0-50",
+        help="comma-separated min-max lengths of the searches' results lists",
+    )
+    parser.add_argument("--output", default="etl_suite.json", type=pathlib.Path)
+    parser.add_argument(
+        "--baseline", type=pathlib.Path, help="an earlier results file to compare to"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="the relative change from the baseline that counts as a regression",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=pathlib.Path,
+        help="where to keep the synthetic stores between runs (default: a temp dir)",
+    )
+    args = parser.parse_args()
+
+    cases = _cases([_size(s) for s in args.sizes.split(",")], args.results.split(","))
+    environment = _environment()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or pathlib.Path(tmp)
+        data_dir.mkdir(parents=True, exist_ok=True)
+        for case in cases:
+            results.append(run(data_dir, case))
+            print(json.dumps(results[-1]))
+            # save as we go, so that a long run that fails part way keeps its results
+            with open(args.output, "w") as f:
+                json.dump({"environment": environment, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        if regressions:
+            print("Regressions:\n" + "\n".join(regressions), file=sys.stderr)
+            sys.exit(1)
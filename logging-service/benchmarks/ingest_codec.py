@@ -0,0 +1,55 @@
+"""Measures the per-event CPU cost of turning a request body into a stored record.
+
+Compares the model re-serialization path against raw ingest with the standard
+library json module and with orjson (if installed).
+
+Usage: python benchmarks/ingest_codec.py [events]
+"""
+
+import json
+import sys
+import time
+
+from app import api, contracts
+from app.lib import codec
+
+BODY = json.dumps(
+    {
+        "user": {"id": 1},
+        "query_id": "0123456789abcdef",
+        "raw_query": "data engineering",
+        "results": [
+            {"document_id": i, "position": i, "score": 1.0 / (i + 1)} for i in range(10)
+        ],
+    }
+).encode()
+
+
+def reserialize(body: bytes) -> str:
+    return contracts.SearchEvent.parse_obj(json.loads(body)).json()
+
+
+def raw_json(body: bytes) -> str:
+    return api._to_record(contracts.SearchEvent.parse_obj(json.loads(body)), body)
+
+
+def raw_orjson(body: bytes) -> str:
+    return api._to_record(contracts.SearchEvent.parse_obj(codec.loads(body)), body)
+
+
+def run(fn, events: int) -> dict:
+    start = time.process_time()
+    for _ in range(events):
+        fn(BODY)
+    elapsed = time.process_time() - start
+    return {"path": fn.__name__, "cpu_us_per_event": round(elapsed / events * 1e6, 2)}
+
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    api.RAW_INGEST = True
+    paths = [reserialize, raw_json]
+    if codec.orjson:
+        paths.append(raw_orjson)
+    for fn in paths:
+        print(json.dumps(run(fn, events)))
@@ -0,0 +1,74 @@
+"""Compares per-event commits against group commit for the Storage write path.
+
+The `parquet` mode writes through the columnar Parquet backend instead, handing
+it parsed events the way the API does.
+
+Usage: python benchmarks/storage_write.py [threads] [events_per_thread]
+"""
+
+import json
+import pathlib
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from app.lib.parquet_storage import ParquetStorage
+from app.lib.storage import ACK_DURABLE, ACK_QUEUED, Storage
+
+EVENT = json.dumps(
+    {
+        "timestamp_micros": 1669852800000000,
+        "user": {"id": 1},
+        "query_id": "0123456789abcdef",
+        "raw_query": "data engineering",
+        "results": [
+            {"document_id": i, "position": i, "score": 1.0 / (i + 1)} for i in range(10)
+        ],
+    }
+)
+
+
+def run(group_commit, threads: int, events: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        event = EVENT
+        if group_commit == "parquet":
+            storage = ParquetStorage(pathlib.Path(tmp), ["searches"])
+            event = json.loads(EVENT)
+        else:
+            storage = Storage(
+                pathlib.Path(tmp), ["searches"], group_commit=group_commit
+            )
+        latencies = [[] for _ in range(threads)]
+
+        def worker(lats):
+            for _ in range(events):
+                start = time.perf_counter()
+                storage.write("searches", event)
+                lats.append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=worker, args=(l,)) for l in latencies]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        # include the final drain so queued acks aren't credited with unwritten rows
+        storage.close()
+        elapsed = time.perf_counter() - start
+
+    lats = sorted(x for l in latencies for x in l)
+    return {
+        "mode": group_commit or "per-event",
+        "events/sec": round(threads * events / elapsed),
+        "p50_ms": round(statistics.median(lats) * 1e3, 3),
+        "p99_ms": round(lats[int(len(lats) * 0.99)] * 1e3, 3),
+    }
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    for mode in (None, ACK_DURABLE, ACK_QUEUED, "parquet"):
+        print(json.dumps(run(mode, threads, events)))
@@ -0,0 +1,115 @@
+"""Builds synthetic SQLite stores in the logging service's on-disk layout.
+
+The rows are generated inside SQLite, so even very large stores are quick to make.
+Search events get between `min_results` and `max_results` results each, cycling
+through the lengths, and their timestamps are spread evenly over `hours` hours.
+Click events point at documents in the results of those searches.
+
+Usage: python benchmarks/synth.py output.db rows [min_results] [max_results]
+       python benchmarks/synth.py --clicks output.db rows [searches]
+"""
+
+import pathlib
+import sqlite3
+import sys
+
+# 2023-01-01T00:00:00Z
+START_MICROS = 1672531200 * 1000000
+
+
+def make_searches(
+    path: pathlib.Path,
+    rows: int,
+    min_results: int = 10,
+    max_results: int = 10,
+    hours: int = 24,
+) -> pathlib.Path:
+    """Writes `rows` search events to a new SQLite store at `path`."""
+    path = pathlib.Path(path)
+    path.unlink(missing_ok=True)
+    step = max(1, hours * 3600 * 1000000 // max(rows, 1))
+    spread = max_results - min_results + 1
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("CREATE TABLE searches (ts int, data text)")
+    db.execute("CREATE TABLE positions (k int PRIMARY KEY)")
+    db.executemany(
+        "INSERT INTO positions VALUES (?)", [(k,) for k in range(max_results)]
+    )
+    db.execute(
+        f"""
+        WITH RECURSIVE seq(i) AS (
+            SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < {rows - 1}
+        )
+        INSERT INTO searches (ts, data)
+        SELECT {START_MICROS} + i * {step}, json_object(
+            'timestamp_micros', {START_MICROS} + i * {step},
+            'user', json_object('id', i % 100000),
+            'query_id', printf('%016x', i),
+            'raw_query', printf('query %d', i % 5000),
+            'results', json((
+                SELECT json_group_array(json_object(
+                    'document_id', (i * 7 + k) % 1000000,
+                    'position', k,
+                    'score', 1.0 / (k + 1)
+                ))
+                FROM positions WHERE k < {min_results} + i % {spread}
+            ))
+        )
+        FROM seq
+    """
+    )
+    db.execute("DROP TABLE positions")
+    db.commit()
+    db.close()
+    return path
+
+
+def make_clicks(
+    path: pathlib.Path,
+    rows: int,
+    searches: int = 0,
+    hours: int = 24,
+) -> pathlib.Path:
+    """Writes `rows` click events on `searches` searches to a new SQLite store.
+
+    Click `i` is on search `i * 7919 % searches` (as generated by `make_searches`),
+    at the result in position `i % 3`, a minute after the search; `searches`
+    defaults to `rows`.
+    """
+    path = pathlib.Path(path)
+    path.unlink(missing_ok=True)
+    searches = searches or rows
+    step = max(1, hours * 3600 * 1000000 // max(searches, 1))
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("CREATE TABLE clicks (ts int, data text)")
+    db.execute(
+        f"""
+        WITH RECURSIVE seq(i) AS (
+            SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < {rows - 1}
+        ), picks AS (
+            SELECT i, i * 7919 % {searches} AS j FROM seq
+        )
+        INSERT INTO clicks (ts, data)
+        SELECT {START_MICROS} + j * {step} + 60000000, json_object(
+            'timestamp_micros', {START_MICROS} + j * {step} + 60000000,
+            'query_id', printf('%016x', j),
+            'document_id', (j * 7 + i % 3) % 1000000
+        )
+        FROM picks
+    """
+    )
+    db.commit()
+    db.close()
+    return path
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[0] == "--clicks":
+        make_clicks(pathlib.Path(args[1]), *(int(a) for a in args[2:]))
+    else:
+        make_searches(pathlib.Path(args[0]), *(int(a) for a in args[1:]))
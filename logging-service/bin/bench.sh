@@ -0,0 +1 @@
+PYTHONPATH=. python3 benchmarks/$1.py ${@:2}
@@ -0,0 +1 @@
+PYTHONPATH=. python3 app/compact.py "$@"
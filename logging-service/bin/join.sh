@@ -0,0 +1 @@
+PYTHONPATH=. python3 app/join.py "$@"
@@ -1 +1 @@
-PYTHONPATH=. python3 app/pcat.py ${@}
+PYTHONPATH=. python3 app/pcat.py "$@"
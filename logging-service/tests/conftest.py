@@ -0,0 +1,61 @@
+import pathlib
+
+import pytest
+
+from app import etl
+from app.lib.jsonschema import AppDefs
+from app.lib.storage import Storage
+
+
+@pytest.fixture(autouse=True)
+def plan_cache(tmp_path_factory, monkeypatch):
+    """Keeps the ETL's compiled plans out of the real cache, in this process and
+    the ones it spawns."""
+    cache = tmp_path_factory.mktemp("plans")
+    monkeypatch.setenv("ETL_PLAN_CACHE", str(cache))
+    monkeypatch.setattr(etl, "PLAN_CACHE_DIR", cache)
+    return cache
+
+
+def search_event(query_id: str, ts: int = 1, documents=(1,)) -> str:
+    """A logged search, with a result for each of the documents in order."""
+    results = ", ".join(
+        f'{{"document_id": {d}, "position": {p}, "score": 0.5}}'
+        for p, d in enumerate(documents)
+    )
+    return (
+        f'{{"timestamp_micros": {ts}, "user": {{"id": 1}}, "query_id": "{query_id}", '
+        f'"raw_query": "q", "results": [{results}]}}'
+    )
+
+
+def click_event(query_id: str, document_id: int, ts: int) -> str:
+    return (
+        f'{{"timestamp_micros": {ts}, "query_id": "{query_id}", '
+        f'"document_id": {document_id}}}'
+    )
+
+
+def export_events(
+    tmp_path: pathlib.Path, searches=(), clicks=(), one_by_one: bool = False
+) -> pathlib.Path:
+    """Logs the events and ETLs them into tmp_path/out, which it returns.
+
+    With `one_by_one`, each search is exported incrementally as soon as it is
+    logged, so that it gets a part of its own.
+    """
+    storage = Storage(tmp_path, ["searches", "clicks"])
+    app_defs = AppDefs.get_current()
+    out = tmp_path / "out"
+    for event in searches:
+        storage.write("searches", event)
+        if one_by_one:
+            db = storage.stores["searches"].path
+            etl.etl_incremental(db, "searches", app_defs, out)
+    for event in clicks:
+        storage.write("clicks", event)
+    dbs = storage.close()
+    if not one_by_one:
+        for table, db in dbs.items():
+            etl.etl_many([db], table, app_defs, out)
+    return out
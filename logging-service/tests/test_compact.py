@@ -0,0 +1,78 @@
+import duckdb
+
+from app import compact, etl
+from app.lib.jsonschema import AppDefs
+from conftest import export_events, search_event
+
+
+def _rows(files):
+    conn = duckdb.connect()
+    try:
+        names = ", ".join(f"'{f}'" for f in files)
+        return conn.execute(
+            f"SELECT query_id, timestamp_micros FROM read_parquet([{names}])"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def _columns(path):
+    conn = duckdb.connect()
+    try:
+        rows = conn.execute(
+            f"SELECT name FROM parquet_schema('{path}') WHERE name != 'duckdb_schema'"
+        ).fetchall()
+        return [name for (name,) in rows]
+    finally:
+        conn.close()
+
+
+def test_compact(tmp_path):
+    searches = [search_event(q, ts) for q, ts in zip("dbca", (4, 3, 2, 1))]
+    table_dir = export_events(tmp_path, searches, one_by_one=True) / "searches"
+    partition = table_dir / "date=1970-01-01" / "hour=0"
+    parts = sorted(partition.glob("*.parquet"))
+    assert len(parts) == 4
+    columns = _columns(parts[0])
+
+    changed = compact.compact(table_dir, sort_by="query_id")
+    assert changed == {"date=1970-01-01/hour=0": (4, 1)}
+    [merged] = partition.glob("*.parquet")
+    assert _rows([merged]) == [("a", 1), ("b", 3), ("c", 2), ("d", 4)]
+    # the partition columns stay in the path, so the schema version still holds
+    assert _columns(merged) == columns
+    assert "date" not in columns and "hour" not in columns
+    assert list(tmp_path.glob("out/_staging/**/*.parquet")) == []
+
+    # the compacted file keeps the parts' schema version
+    conn = duckdb.connect()
+    versions = conn.execute(
+        f"SELECT decode(value) FROM parquet_kv_metadata('{merged}')"
+    ).fetchall()
+    conn.close()
+    assert versions == [(etl.flatten_plan("searches", AppDefs.get_current()).version,)]
+
+    # nothing left to do the second time around
+    assert compact.compact(table_dir) == {}
+
+
+def test_compact_skips_uncommitted_parts(tmp_path):
+    searches = [search_event(q, ts) for q, ts in zip("abc", (3, 2, 1))]
+    table_dir = export_events(tmp_path, searches, one_by_one=True) / "searches"
+    partition = table_dir / "date=1970-01-01" / "hour=0"
+    parts = sorted(partition.glob("*.parquet"))
+    # as if the last export died before its watermark was saved
+    watermarks = etl.read_watermarks(table_dir)
+    [source] = watermarks
+    watermarks[source] -= 1
+    etl._save_watermarks(table_dir, watermarks)
+
+    assert compact.compact(table_dir, sort_by="timestamp_micros") == {
+        "date=1970-01-01/hour=0": (3, 2)
+    }
+    assert parts[-1].exists()
+    assert sorted(_rows(partition.glob("*.parquet"))) == [
+        ("a", 3),
+        ("b", 2),
+        ("c", 1),
+    ]
@@ -0,0 +1,245 @@
+import argparse
+import datetime
+import json
+
+import duckdb
+import pytest
+from prometheus_client import REGISTRY
+
+from app import etl
+from app.lib.jsonschema import AppDefs
+from app.lib.storage import Storage
+from conftest import search_event
+
+
+@pytest.fixture
+def app_defs():
+    return AppDefs.get_current()
+
+
+def _query_ids(paths) -> list:
+    if not isinstance(paths, list):
+        paths = [paths]
+    files = ", ".join(f"'{p}'" for p in paths)
+    conn = duckdb.connect()
+    try:
+        rows = conn.execute(
+            f"SELECT query_id FROM read_parquet([{files}]) ORDER BY 1"
+        ).fetchall()
+        return [r[0] for r in rows]
+    finally:
+        conn.close()
+
+
+def test_etl_incremental(app_defs, tmp_path):
+    storage = Storage(tmp_path, ["searches"])
+    db = storage.stores["searches"].path
+    out = tmp_path / "out"
+    storage.write("searches", search_event("a"))
+    storage.write("searches", search_event("b"))
+
+    exported = REGISTRY.get_sample_value(
+        "logging_service_etl_rows_total", {"table": "searches"}
+    )
+    first = etl.etl_incremental(db, "searches", app_defs, out)
+    assert _query_ids(first) == ["a", "b"]
+    assert (
+        REGISTRY.get_sample_value(
+            "logging_service_etl_rows_total", {"table": "searches"}
+        )
+        == (exported or 0) + 2
+    )
+    assert etl.read_watermarks(out / "searches") == {db.name: 2}
+
+    # nothing new since the last run
+    assert etl.etl_incremental(db, "searches", app_defs, out) == []
+
+    # only the new row is exported, into a new part
+    storage.write("searches", search_event("c"))
+    second = etl.etl_incremental(db, "searches", app_defs, out)
+    assert second != first
+    assert _query_ids(second) == ["c"]
+    assert etl.read_watermarks(out / "searches") == {db.name: 3}
+    assert _query_ids(out / "searches" / "**" / "*.parquet") == ["a", "b", "c"]
+    assert list(out.glob("_staging/**/*.parquet")) == []
+    storage.close()
+
+
+def test_flatten_reads_only_new_rows(app_defs, tmp_path):
+    storage = Storage(tmp_path, ["searches"])
+    db = storage.stores["searches"].path
+    for query_id in "abc":
+        storage.write("searches", search_event(query_id))
+
+    plan = etl.flatten_plan("searches", app_defs)
+    with etl._connect(db, etl.ETLSettings()) as ddb:
+        select = etl._flatten(ddb, "searches", plan, start=1, end=2)
+        explain = ddb.execute(f"EXPLAIN {select}").fetchall()[0][1]
+        rows = ddb.execute(f"SELECT query_id FROM ({select})").fetchall()
+    # SQLite looks up the rowid range, rather than DuckDB filtering a full scan
+    assert "SQLITE_QUERY" in explain and "SQLITE_SCAN" not in explain
+    assert rows == [("b",)]
+    storage.close()
+
+
+def test_etl_many_partitioned(app_defs, tmp_path):
+    # a segment per write
+    for query_id in "abcd":
+        storage = Storage(tmp_path, ["searches", "clicks"])
+        storage.write("searches", search_event(query_id))
+        storage.close()
+    storage = Storage(tmp_path, ["searches", "clicks"])
+    storage.write(
+        "clicks", '{"timestamp_micros": 1, "query_id": "a", "document_id": 1}'
+    )
+    storage.close()
+
+    sources = etl._resolve_sources(str(tmp_path / "ready"), "searches")
+    assert len(sources) == 4
+    assert all("searches" in s.name for s in sources)
+
+    out = tmp_path / "out"
+    parts = etl.etl_many(sources, "searches", app_defs, out, workers=2)
+    assert len(parts) == 4
+    assert all(
+        p.parent == out / "searches" / "date=1970-01-01" / "hour=0" for p in parts
+    )
+    assert _query_ids(parts) == ["a", "b", "c", "d"]
+
+    # re-running a full export overwrites the same parts
+    assert etl.etl_many(sources, "searches", app_defs, out, workers=2) == parts
+    conn = duckdb.connect()
+    rows = conn.execute(
+        f"""
+        SELECT date, hour, count(*)
+        FROM read_parquet('{out}/searches/**/*.parquet', hive_partitioning=true)
+        GROUP BY ALL
+    """
+    ).fetchall()
+    conn.close()
+    assert rows == [(datetime.date(1970, 1, 1), 0, 4)]
+
+
+def test_etl_settings_from_args():
+    parser = argparse.ArgumentParser()
+    etl.add_settings_arguments(parser)
+    args = parser.parse_args(["--memory-limit", "1GB", "--compression", "zstd"])
+    assert etl.ETLSettings.from_args(args) == etl.ETLSettings(
+        memory_limit="1GB", compression="zstd"
+    )
+
+    parser = argparse.ArgumentParser()
+    etl.add_settings_arguments(parser, parquet=False)
+    args = parser.parse_args(["--threads", "2"])
+    assert etl.ETLSettings.from_args(args) == etl.ETLSettings(threads=2)
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--compression", "zstd"])
+
+
+def test_etl_settings(app_defs, tmp_path):
+    storage = Storage(tmp_path, ["searches"])
+    for query_id in "abc":
+        storage.write("searches", search_event(query_id))
+    db = storage.close()["searches"]
+
+    settings = etl.ETLSettings(
+        memory_limit="128MB",
+        threads=1,
+        temp_directory=str(tmp_path / "spill"),
+        row_group_size=2,
+        compression="zstd",
+    )
+    with etl._connect(db, settings) as ddb:
+        assert ddb.execute("SELECT current_setting('threads')").fetchone() == (1,)
+
+    out = etl.etl(db, "searches", app_defs, tmp_path, settings)
+    assert _query_ids(out) == ["a", "b", "c"]
+    conn = duckdb.connect()
+    codecs = conn.execute(
+        f"SELECT DISTINCT compression FROM parquet_metadata('{out}')"
+    ).fetchall()
+    conn.close()
+    assert codecs == [("ZSTD",)]
+
+
+def test_flatten_plan_cache(app_defs, tmp_path, monkeypatch):
+    compiled = []
+    compile_plan = etl._compile
+    monkeypatch.setattr(etl, "PLAN_CACHE_DIR", tmp_path / "plans")
+    monkeypatch.setattr(etl, "_plans", {})
+    monkeypatch.setattr(
+        etl, "_compile", lambda *args: compiled.append(args) or compile_plan(*args)
+    )
+    plan = etl.flatten_plan("searches", app_defs)
+    assert any("list_transform" in col for col in plan.select)
+    assert etl.flatten_plan("searches", app_defs) == plan
+    assert len(compiled) == 1
+    assert len(list((tmp_path / "plans").glob("*.json"))) == 1
+
+    # a fresh process reads the plan back instead of compiling it again
+    monkeypatch.setattr(etl, "_plans", {})
+    assert etl.flatten_plan("searches", app_defs) == plan
+    assert len(compiled) == 1
+
+    # a different column list is a different plan
+    monkeypatch.setattr(etl, "_columns_helper", lambda table: ["query_id"])
+    assert etl.flatten_plan("searches", app_defs).select == ["d.query_id as query_id"]
+    assert len(compiled) == 2
+
+
+def test_flatten_plan_cache_must_be_private(app_defs, tmp_path, monkeypatch):
+    cache = tmp_path / "plans"
+    cache.mkdir()
+    cache.chmod(0o777)
+    monkeypatch.setattr(etl, "PLAN_CACHE_DIR", cache)
+    monkeypatch.setattr(etl, "_plans", {})
+
+    # anyone could have left a plan here, so it isn't read, nor written to
+    key = etl._plan_key("searches", app_defs, etl._columns_helper("searches"))
+    planted = etl._compile("searches", app_defs, ["query_id"])._asdict()
+    planted["macros"] = ["CREATE TEMP TABLE planted AS SELECT 1"]
+    (cache / f"{key}.json").write_text(json.dumps(planted))
+    plan = etl.flatten_plan("searches", app_defs)
+    assert plan.macros != planted["macros"]
+    assert [p.name for p in cache.iterdir()] == [f"{key}.json"]
+
+
+def test_etl_schema_versions(app_defs, tmp_path, monkeypatch):
+    storage = Storage(tmp_path, ["searches"])
+    db = storage.stores["searches"].path
+    out = tmp_path / "out"
+    columns = etl._columns_helper("searches")
+
+    # an older version of the table, before raw_query was added and while it
+    # still had a field that has since been dropped from the schema
+    old_columns = [c for c in columns if c != "raw_query"] + ["dropped"]
+    monkeypatch.setattr(etl, "_columns_helper", lambda table: old_columns)
+    storage.write("searches", search_event("a"))
+    (old_part,) = etl.etl_incremental(db, "searches", app_defs, out)
+    old_bytes = old_part.read_bytes()
+
+    monkeypatch.setattr(etl, "_columns_helper", lambda table: columns)
+    storage.write("searches", search_event("b"))
+    (new_part,) = etl.etl_incremental(db, "searches", app_defs, out)
+    storage.close()
+
+    # the old part is left as it was, stamped with its own schema version
+    assert old_part.read_bytes() == old_bytes
+    conn = duckdb.connect()
+    versions = [
+        conn.execute(
+            "SELECT value::varchar FROM parquet_kv_metadata(?) "
+            "WHERE key::varchar = 'schema_version'",
+            [str(part)],
+        ).fetchone()[0]
+        for part in (old_part, new_part)
+    ]
+    assert versions[0] != versions[1]
+    schemas = sorted(p.stem for p in (out / "searches" / "_schemas").glob("*.json"))
+    assert schemas == sorted(versions)
+
+    rows = conn.execute(
+        f"SELECT query_id, raw_query FROM {etl.scan_table(out / 'searches')} ORDER BY 1"
+    ).fetchall()
+    conn.close()
+    assert rows == [("a", None), ("b", "q")]
@@ -0,0 +1,67 @@
+import duckdb
+
+from app import etl, join
+from app.lib.jsonschema import AppDefs
+from app.lib.storage import Storage
+from conftest import click_event, export_events, search_event
+
+DAY = 24 * 3600 * 1000000
+
+# the results of every search
+DOCUMENTS = (10, 20, 30)
+
+
+def _labeled(out):
+    conn = duckdb.connect()
+    rows = conn.execute(
+        f"""
+        SELECT date::varchar, query_id, document_id, position, clicked
+        FROM read_parquet('{out}/labeled/**/*.parquet', hive_partitioning=true)
+        ORDER BY ALL
+    """
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def test_join(tmp_path):
+    out = export_events(
+        tmp_path,
+        [search_event(q, ts, DOCUMENTS) for q, ts in (("a", 0), ("b", 1), ("c", DAY))],
+        # b's click comes in the day after the search
+        [
+            click_event("a", 20, 5),
+            click_event("a", 20, 6),
+            click_event("b", 30, DAY + 5),
+        ],
+    )
+    assert join.join(out, buckets=4) == ["1970-01-01", "1970-01-02"]
+    assert _labeled(out) == [
+        ("1970-01-01", "a", 10, 0, False),
+        ("1970-01-01", "a", 20, 1, True),
+        ("1970-01-01", "a", 30, 2, False),
+        ("1970-01-01", "b", 10, 0, False),
+        ("1970-01-01", "b", 20, 1, False),
+        ("1970-01-01", "b", 30, 2, True),
+        ("1970-01-02", "c", 10, 0, False),
+        ("1970-01-02", "c", 20, 1, False),
+        ("1970-01-02", "c", 30, 2, False),
+    ]
+    # each bucket's file is sorted
+    for part in (out / "labeled").glob("**/*.parquet"):
+        conn = duckdb.connect()
+        keys = conn.execute(f"SELECT query_id, position FROM '{part}'").fetchall()
+        conn.close()
+        assert keys == sorted(keys)
+
+    # nothing changed, so nothing is rebuilt
+    assert join.join(out, buckets=4) == []
+
+    # a late click only rebuilds the days whose window it falls in
+    (tmp_path / "late").mkdir()
+    storage = Storage(tmp_path / "late", ["clicks"])
+    storage.write("clicks", click_event("c", 10, 2 * DAY))
+    etl.etl_many([storage.close()["clicks"]], "clicks", AppDefs.get_current(), out)
+    assert join.join(out, buckets=4) == ["1970-01-02"]
+    assert ("1970-01-02", "c", 10, 0, True) in _labeled(out)
+    assert len(_labeled(out)) == 9
@@ -0,0 +1,25 @@
+import os
+
+from app.lib import jsonschema
+from app.lib.jsonschema import AppDefs
+
+
+def test_get_current_is_memoized():
+    app_defs = AppDefs.get_current()
+    assert AppDefs.get_current() is app_defs
+    assert app_defs.to_structure("SearchEvent") is app_defs.to_structure("SearchEvent")
+
+    # touching the file without changing it keeps the parsed defs
+    openapi_path = os.path.join(
+        os.path.dirname(jsonschema.__file__), "..", "config", "openapi.json"
+    )
+    st = os.stat(openapi_path)
+    os.utime(openapi_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    try:
+        assert AppDefs.get_current() is app_defs
+    finally:
+        os.utime(openapi_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    # saving a new schema drops them, so the file is parsed again
+    AppDefs._current = None
+    assert AppDefs.get_current() is not app_defs
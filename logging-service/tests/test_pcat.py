@@ -0,0 +1,115 @@
+import csv
+import io
+import json
+
+import duckdb
+import pytest
+
+from app import pcat
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def partitioned(tmp_path, conn):
+    """Ten rows partitioned by whether their id is odd, with the odd names null."""
+    conn.execute(
+        f"""
+        COPY (
+            SELECT i AS id, CASE WHEN i % 2 = 0 THEN 'x' || i END AS name, i % 2 AS p
+            FROM range(10) t(i)
+        ) TO '{tmp_path}' (FORMAT PARQUET, PARTITION_BY (p))
+    """
+    )
+    return tmp_path
+
+
+def _json_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_pcat_stats(partitioned, conn, capsys):
+    files = pcat._files([str(partitioned)])
+    assert [f.split("/")[-2] for f in files] == ["p=0", "p=1"]
+
+    pcat.stats(conn, files, "json")
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 4  # two row groups, then two columns
+    assert lines[2:] == [
+        '{"column": "id", "type": "INT64", "min": 0, "max": 9, "nulls": 0}',
+        '{"column": "name", "type": "BYTE_ARRAY", "min": "x0", "max": "x8", "nulls": 5}',
+    ]
+
+
+def test_pcat_stats_boolean(tmp_path, conn, capsys):
+    path = tmp_path / "labeled.parquet"
+    conn.execute(
+        f"""
+        COPY (
+            SELECT i AS id, i % 3 = 0 AS clicked, i / 4 AS score FROM range(10) t(i)
+        ) TO '{path}' (FORMAT PARQUET)
+    """
+    )
+    pcat.stats(conn, [str(path)], "json")
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 4  # one row group, then three columns
+    assert lines[1:] == [
+        '{"column": "id", "type": "INT64", "min": 0, "max": 9, "nulls": 0}',
+        '{"column": "clicked", "type": "BOOLEAN", "min": false, "max": true, "nulls": 0}',
+        '{"column": "score", "type": "DOUBLE", "min": 0.0, "max": 2.25, "nulls": 0}',
+    ]
+
+
+def test_pcat_files(partitioned):
+    [even] = (partitioned / "p=0").iterdir()
+    assert pcat._files([str(partitioned / "p=*" / "*.parquet")]) == pcat._files(
+        [str(partitioned)]
+    )
+    assert pcat._files([str(partitioned / "p=1" / "*"), str(even)]) == [
+        *map(str, (partitioned / "p=1").iterdir()),
+        str(even),
+    ]
+    assert pcat._files([str(partitioned / "*.csv")]) == []
+
+
+def test_pcat_streams_picked_out_rows(partitioned, conn, capsys):
+    files = pcat._files([str(partitioned)])
+    # batches smaller than the output, so that it takes a few of them
+    pcat.cat(
+        conn,
+        files,
+        "json",
+        columns="id, name, p",
+        where="id >= 4",
+        limit=4,
+        batch_size=3,
+    )
+    rows = _json_lines(capsys)
+    assert len(rows) == 4
+    assert all(row["id"] >= 4 and list(row) == ["id", "name", "p"] for row in rows)
+    # the partition column comes from the directory names
+    assert all(row["p"] == row["id"] % 2 for row in rows)
+    assert all(
+        row["name"] == (None if row["id"] % 2 else f"x{row['id']}") for row in rows
+    )
+
+    pcat.cat(conn, files, "json", batch_size=3)
+    assert sorted(row["id"] for row in _json_lines(capsys)) == list(range(10))
+
+
+def test_pcat_formats(partitioned, conn, capsys):
+    files = pcat._files([str(partitioned / "p=0")])
+    pcat.cat(conn, files, "csv", columns="id, name", where="id < 4")
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out)))
+    assert rows == [["id", "name"], ["0", "x0"], ["2", "x2"]]
+
+    pcat.cat(conn, files, "json", columns="name", limit=1)
+    assert _json_lines(capsys) == [{"name": "x0"}]
+
+    pcat.cat(conn, files, "table", columns="id", limit=2)
+    assert capsys.readouterr().out.splitlines() == ["['id']", "(0,)", "(2,)"]
@@ -1,4 +1,6 @@
-import pathlib
+import json
+import os
+import time
 import pytest
 
 import duckdb
@@ -6,7 +8,8 @@ from fastapi.testclient import TestClient
 
 from app import api, etl
 from app.lib.jsonschema import AppDefs
-from app.lib.storage import Storage
+from app.lib.parquet_storage import ParquetStorage
+from app.lib.storage import ACK_DURABLE, ACK_QUEUED, Storage
 
 
 @pytest.fixture
@@ -47,7 +50,7 @@ def test_searches(client, storage, tmp_path):
     assert rows[0]["results"] == [{"document_id": 1, "position": 1, "score": 1.0}]
 
     # Close up the DB and run the ETL pipeline for the searches table
-    output_path = pathlib.Path(storage.close())
+    output_path = storage.close()["searches"]
     parquet_file = etl.etl(output_path, "searches", app_defs, tmp_path)
 
     # Verify the ETL pipeline output is a valid parquet file and its contents
@@ -77,3 +80,301 @@ def test_bad_search(client):
     }
     response = client.post("/searches", json=bad_search_event)
     assert response.status_code == 422
+
+
+def test_search_batch(client, storage):
+    json_schema = client.get("/openapi.json").json()
+    assert set(AppDefs.from_json_schema(json_schema).tables) == {"searches", "clicks"}
+
+    good_search_event = {
+        "user": {"id": 1},
+        "query_id": "123",
+        "raw_query": "test",
+        "results": [],
+    }
+    bad_search_event = {"user": {"id": 1}, "raw_query": "test", "results": []}
+    response = client.post(
+        "/searches/batch", json=[good_search_event, bad_search_event, good_search_event]
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["written"] == 2
+    assert [e["index"] for e in body["errors"]] == [1]
+    assert body["errors"][0]["detail"][0]["loc"] == ["query_id"]
+
+    ndjson = "\n".join(
+        [json.dumps(good_search_event), "{not json", json.dumps(good_search_event)]
+    )
+    response = client.post(
+        "/searches/batch",
+        content=ndjson,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["written"] == 2
+    assert [e["index"] for e in body["errors"]] == [1]
+
+    rows = client.get("/fetch", params={"table": "searches", "limit": 100}).json()
+    assert len(rows) == 4
+
+    response = client.post("/searches/batch", json=good_search_event)
+    assert response.status_code == 400
+
+
+def test_search_backpressure(client, mocker, tmp_path):
+    storage = Storage(tmp_path, ["searches"], group_commit=ACK_QUEUED, max_pending=1)
+    mocker.patch("app.lib.storage.Storage.get", return_value=storage)
+    search_event = {"user": {"id": 1}, "query_id": "1", "raw_query": "q", "results": []}
+
+    with storage.stores["searches"].lock:
+        assert client.post("/searches", json=search_event).status_code == 200
+        response = client.post("/searches", json=search_event)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert client.get("/stats").json()["searches"]["dropped"] == 1
+    storage.close()
+
+
+def test_group_commit_is_the_default(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    monkeypatch.delenv("STORAGE_BACKEND", raising=False)
+    monkeypatch.delenv("GROUP_COMMIT", raising=False)
+    mocker.patch.object(Storage, "_instance", None)
+    storage = Storage.get()
+    assert storage.ack == ACK_DURABLE
+    assert set(storage.stats()) == {"searches", "clicks"}
+    Storage.close_instance()
+
+    monkeypatch.setenv("GROUP_COMMIT", "off")
+    storage = Storage.get()
+    assert storage.ack is None and not storage.writers
+    Storage.close_instance()
+
+
+def test_shutdown_drains_queued_writes(mocker, tmp_path):
+    # a long linger keeps the acknowledged writes queued until shutdown
+    storage = Storage(
+        tmp_path, ["searches"], group_commit=ACK_QUEUED, max_delay_ms=60000
+    )
+    mocker.patch.object(Storage, "_instance", storage)
+    search_event = {"user": {"id": 1}, "query_id": "1", "raw_query": "q", "results": []}
+    with TestClient(api.app) as client:
+        for _ in range(3):
+            assert client.post("/searches", json=search_event).status_code == 200
+        assert client.get("/stats").json()["searches"]["pending"] == 3
+
+    [sealed] = (tmp_path / "ready").glob("*.db")
+    conn = duckdb.connect()
+    count = conn.execute(
+        f"SELECT count(*) FROM sqlite_scan('{sealed}', 'searches')"
+    ).fetchone()[0]
+    conn.close()
+    assert count == 3
+    assert Storage._instance is None
+
+
+def test_search_raw_ingest(client, storage, mocker):
+    mocker.patch("app.api.RAW_INGEST", True)
+    raw = b' {"user": {"id": 1}, "query_id": "raw", "raw_query": "q", "results": []}'
+    response = client.post(
+        "/searches", content=raw, headers={"Content-Type": "application/json"}
+    )
+    assert response.status_code == 200
+    response = client.post(
+        "/searches/batch",
+        content=b'{"timestamp_micros": 7, "user": {"id": 2}, "query_id": "b", '
+        b'"raw_query": "q", "results": null}\n',
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.json()["written"] == 1
+
+    # the stored text is the original payload, plus the server-side timestamp
+    # only when the client didn't send one
+    batch_row, raw_row = storage.scan("searches", 10)
+    assert raw_row[2].startswith('{"timestamp_micros":')
+    assert raw_row[2].endswith(raw[2:].decode())
+    assert batch_row[2].startswith('{"timestamp_micros": 7, ')
+
+    second, first = client.get("/fetch", params={"table": "searches"}).json()
+    assert first["timestamp_micros"] > 0 and first["query_id"] == "raw"
+    assert second["timestamp_micros"] == 7 and second["user"] == {"id": 2}
+
+
+def test_fetch_pagination(client, storage):
+    for i in range(5):
+        search_event = {
+            "user": {"id": i % 2},
+            "query_id": str(i),
+            "raw_query": "q",
+            "results": [],
+        }
+        assert client.post("/searches", json=search_event).status_code == 200
+
+    # newest first, resuming from the cursor of the last row on each page
+    seen, cursor = [], None
+    while True:
+        params = {"table": "searches", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        rows = client.get("/fetch", params=params).json()
+        if not rows:
+            break
+        seen.extend(r["query_id"] for r in rows)
+        cursor = rows[-1]["__cursor"]
+    assert seen == ["4", "3", "2", "1", "0"]
+
+    rows = client.get("/fetch", params={"table": "searches", "user_id": 1}).json()
+    assert [r["query_id"] for r in rows] == ["3", "1"]
+    rows = client.get("/fetch", params={"table": "searches", "query_id": "2"}).json()
+    assert [r["query_id"] for r in rows] == ["2"]
+    ts = rows[0]["__ts"]
+    rows = client.get("/fetch", params={"table": "searches", "until": ts}).json()
+    assert all(r["__ts"] < ts for r in rows)
+
+    # the filters are served from the expression indexes
+    sql = "SELECT rowid FROM searches WHERE json_extract(data, '$.query_id') = '2'"
+    with storage.stores["searches"].reader() as conn:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    assert "searches_query_id" in plan[0][-1]
+
+    assert client.get("/fetch", params={"table": "nope"}).status_code == 404
+    params = {"table": "searches", "cursor": "bad"}
+    assert client.get("/fetch", params=params).status_code == 400
+
+
+def test_search_parquet_storage(client, mocker, tmp_path):
+    storage = ParquetStorage(tmp_path, ["searches"], flush_rows=2, flush_age_s=None)
+    mocker.patch("app.lib.storage.Storage.get", return_value=storage)
+    results = [{"document_id": 7, "position": 1, "score": 0.5}]
+    for i in range(3):
+        search_event = {
+            "timestamp_micros": 3600 * 1000000 * i,
+            "user": {"id": i},
+            "query_id": str(i),
+            "raw_query": "q",
+            "results": results if i else None,
+        }
+        assert client.post("/searches", json=search_event).status_code == 200
+
+    # the first two events filled the buffer and were flushed, one per hour
+    parts = sorted((tmp_path / "parquet" / "searches").glob("**/*.parquet"))
+    assert [p.parent.name for p in parts] == ["hour=0", "hour=1"]
+    assert client.get("/stats").json() == {"searches": {"pending": 1, "dropped": 0}}
+    assert client.get("/fetch", params={"table": "searches"}).status_code == 501
+
+    table_dir = storage.close()["searches"]
+    conn = duckdb.connect()
+    rows = conn.execute(
+        f"""
+        SELECT user__id, query_id, results__document_id, results__score, hour
+        FROM read_parquet('{table_dir}/**/*.parquet', hive_partitioning=true)
+        ORDER BY query_id
+    """
+    ).fetchall()
+    conn.close()
+    assert rows == [
+        (0, "0", None, None, 0),
+        (1, "1", [7], [0.5], 1),
+        (2, "2", [7], [0.5], 2),
+    ]
+    assert not any((tmp_path / "parquet" / "_staging" / "searches").iterdir())
+
+
+def test_shutdown_flushes_parquet_storage(mocker, tmp_path):
+    storage = ParquetStorage(tmp_path, ["searches"], flush_age_s=None)
+    mocker.patch.object(Storage, "_instance", storage)
+    with TestClient(api.app) as client:
+        for i in range(3):
+            search_event = {
+                "user": {"id": i},
+                "query_id": str(i),
+                "raw_query": "q",
+                "results": [],
+            }
+            assert client.post("/searches", json=search_event).status_code == 200
+        assert not list((tmp_path / "parquet").glob("searches/**/*.parquet"))
+
+    conn = duckdb.connect()
+    rows = conn.execute(
+        f"""
+        SELECT query_id FROM read_parquet('{tmp_path}/parquet/searches/**/*.parquet')
+        ORDER BY 1
+    """
+    ).fetchall()
+    conn.close()
+    assert rows == [("0",), ("1",), ("2",)]
+
+
+def test_parquet_storage_keeps_a_batch_that_fails_to_flush(mocker, tmp_path):
+    replace = os.replace
+    failures = []
+
+    def failing_replace(src, dst):
+        # fail the first move of each flush that's told to
+        if failures and str(dst).endswith(".parquet"):
+            failures.pop()
+            raise OSError(28, "No space left on device")
+        return replace(src, dst)
+
+    mocker.patch("app.lib.parquet_storage.os.replace", side_effect=failing_replace)
+    storage = ParquetStorage(tmp_path, ["searches"], flush_rows=2, flush_age_s=0.05)
+    table_dir = tmp_path / "parquet" / "searches"
+
+    def search(i):
+        return {"timestamp_micros": i, "user": {"id": i}, "query_id": str(i)}
+
+    def written():
+        conn = duckdb.connect()
+        rows = conn.execute(
+            f"SELECT query_id FROM read_parquet('{table_dir}/**/*.parquet')"
+        ).fetchall()
+        conn.close()
+        return [r[0] for r in rows]
+
+    # a full buffer that fails to flush keeps its rows, ahead of the next ones
+    failures.append(True)
+    storage.write_many("searches", [search(0), search(1)])
+    assert not list(table_dir.glob("**/*.parquet"))
+    assert storage.stats() == {"searches": {"pending": 2, "dropped": 0}}
+    storage.write("searches", search(2))
+    assert written() == ["0", "1", "2"]
+
+    # and the flusher carries on after a flush on age fails
+    failures.append(True)
+    storage.write("searches", search(3))
+    deadline = time.monotonic() + 10
+    while len(written()) < 4 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not failures
+    assert sorted(written()) == ["0", "1", "2", "3"]
+    storage.close()
+    assert not any((tmp_path / "parquet" / "_staging" / "searches").iterdir())
+
+
+def _metric(text: str, name: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[-1])
+    return 0.0
+
+
+def test_metrics(client, storage):
+    search_event = {"user": {"id": 1}, "query_id": "1", "raw_query": "q", "results": []}
+    before = client.get("/metrics").text
+    assert client.post("/searches", json=search_event).status_code == 200
+    assert client.post("/searches", json={"user": {"id": 1}}).status_code == 422
+    after = client.get("/metrics").text
+
+    table = '{table="searches"}'
+    for name, delta in [
+        ("logging_service_validation_seconds_count", 1),
+        ("logging_service_validation_errors_total", 1),
+        ("logging_service_storage_lock_wait_seconds_count", 1),
+        ("logging_service_storage_insert_seconds_count", 1),
+        ("logging_service_storage_commit_seconds_count", 1),
+        ("logging_service_storage_rows_written_total", 1),
+    ]:
+        assert _metric(after, name + table) - _metric(before, name + table) == delta
+    assert _metric(after, "logging_service_storage_bytes_written_total" + table) > 0
+    assert _metric(after, "logging_service_storage_db_file_bytes" + table) > 0
@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app.lib.storage import ACK_DURABLE, ACK_QUEUED, BufferFull, Storage
+
+
+def _count(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_group_commit_durable(tmp_path):
+    storage = Storage(tmp_path, ["searches", "clicks"], group_commit=ACK_DURABLE)
+
+    def worker(i):
+        for j in range(50):
+            storage.write("searches" if j % 2 else "clicks", f'{{"i": {i}, "j": {j}}}')
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # durable acks mean every write is visible as soon as write() returns
+    assert len(storage.fetch("searches", limit=1000)) == 100
+    assert len(storage.fetch("clicks", limit=1000)) == 100
+    storage.close()
+
+
+def test_group_commit_queued_flushes_on_close(tmp_path):
+    storage = Storage(
+        tmp_path, ["searches"], group_commit=ACK_QUEUED, max_delay_ms=1000
+    )
+    for i in range(10):
+        storage.write("searches", f'{{"i": {i}}}')
+    path = storage.close()["searches"]
+    assert _count(path, "searches") == 10
+
+
+def test_group_commit_unknown_policy(tmp_path):
+    with pytest.raises(ValueError):
+        Storage(tmp_path, ["searches"], group_commit="eventually")
+
+
+def test_segments_roll_on_size(tmp_path):
+    storage = Storage(tmp_path, ["searches"], segment_max_bytes=1)
+    for i in range(3):
+        storage.write("searches", f'{{"i": {i}, "pad": "{"x" * 5000}"}}')
+    # every write adds pages and so fills a segment, which is sealed right away
+    sealed = sorted((tmp_path / "ready").iterdir())
+    assert len(sealed) == 3
+    assert [_count(p, "searches") for p in sealed] == [1, 1, 1]
+
+    # and the empty segment left open is removed rather than sealed
+    assert storage.close() == {}
+    assert len(list((tmp_path / "ready").iterdir())) == 3
+    assert list(tmp_path.glob("*.db*")) == []
+
+
+def test_segments_roll_on_the_size_of_their_rows(tmp_path):
+    # smaller than a segment's empty tables and indexes
+    storage = Storage(tmp_path, ["searches"], segment_max_bytes=16384)
+    store = storage.stores["searches"]
+    assert store.empty_bytes > 16384
+    for i in range(10):
+        storage.write("searches", f'{{"i": {i}}}')
+    assert not (tmp_path / "ready").exists()
+
+    storage.write("searches", f'{{"pad": "{"x" * 16384}"}}')
+    [sealed] = (tmp_path / "ready").iterdir()
+    assert _count(sealed, "searches") == 11
+    storage.write("searches", '{"i": 11}')
+    assert _count(storage.close()["searches"], "searches") == 1
+
+
+def test_segments_roll_on_age(tmp_path):
+    storage = Storage(tmp_path, ["searches"], segment_max_age_s=0.05)
+    storage.write("searches", '{"i": 1}')
+    deadline = time.monotonic() + 5
+    while not list(tmp_path.glob("ready/*.db")) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sealed = list(tmp_path.glob("ready/*.db"))
+    assert len(sealed) == 1
+    assert _count(sealed[0], "searches") == 1
+
+    # new writes go to a fresh segment
+    storage.write("searches", '{"i": 2}')
+    assert len(storage.fetch("searches")) == 1
+    storage.close()
+
+
+def _crash_after_writing(data_dir):
+    storage = Storage(data_dir, ["searches"])
+    storage.write("searches", '{"i": 1}')
+    storage.write("searches", '{"i": 2}')
+    os._exit(1)
+
+
+def test_recovers_unsealed_segments(tmp_path):
+    # a process that dies without sealing leaves its segment and WAL behind
+    crashed = multiprocessing.get_context("spawn").Process(
+        target=_crash_after_writing, args=(tmp_path,)
+    )
+    crashed.start()
+    crashed.join()
+    [left] = tmp_path.glob("*.db")
+    assert left.with_name(left.name + "-wal").exists()
+
+    storage = Storage(tmp_path, ["searches"])
+    assert [p.name for p in tmp_path.glob("ready/*.db")] == [left.name]
+    assert _count(tmp_path / "ready" / left.name, "searches") == 2
+    assert not list(tmp_path.glob(left.name + "-*"))
+
+    # but the segment of a live process is left alone
+    other = Storage(tmp_path, ["searches"])
+    assert storage.stores["searches"].path.exists()
+    assert len(list(tmp_path.glob("ready/*.db"))) == 1
+    other.close()
+    storage.close()
+
+
+def test_reads_do_not_block_writes(tmp_path):
+    storage = Storage(tmp_path, ["searches", "clicks"])
+    storage.write("searches", '{"i": 1}')
+
+    # an open reader doesn't stop the table's writer from committing
+    with storage.stores["searches"].reader() as conn:
+        storage.write("searches", '{"i": 2}')
+        assert conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0] == 2
+
+    # and a busy writer on one table doesn't stop writes to another
+    with storage.stores["searches"].lock:
+        storage.write("clicks", '{"i": 3}')
+    assert len(storage.fetch("clicks")) == 1
+
+    paths = storage.close()
+    assert _count(paths["searches"], "searches") == 2
+    assert _count(paths["clicks"], "clicks") == 1
+
+
+def test_group_commit_backpressure(tmp_path):
+    storage = Storage(tmp_path, ["searches"], group_commit=ACK_QUEUED, max_pending=2)
+    store = storage.stores["searches"]
+
+    # stall the writer so that rows pile up in the buffer
+    with store.lock:
+        storage.write("searches", '{"i": 1}')
+        storage.write("searches", '{"i": 2}')
+        with pytest.raises(BufferFull):
+            storage.write("searches", '{"i": 3}')
+        assert storage.stats() == {"searches": {"pending": 2, "dropped": 1}}
+
+    path = storage.close()["searches"]
+    assert _count(path, "searches") == 2
+    assert storage.stats() == {"searches": {"pending": 0, "dropped": 1}}